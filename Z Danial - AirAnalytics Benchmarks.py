@@ -0,0 +1,294 @@
+"""
+Benchmark suite for the AirAnalytics scraper's hot paths.
+
+Runs every stage on two kinds of input: search pages in the current listing card markup
+(generated here, or recorded pages from a directory of saved .html files), and synthetic
+listing stores of 1k, 10k and 100k listings over 30 to 365 days.  For each stage it reports
+throughput and peak memory, and it can save the results as a baseline and compare later
+runs against it so regressions show up.
+
+    python "Z Danial - AirAnalytics Benchmarks.py" --save bench_baseline.json
+    python "Z Danial - AirAnalytics Benchmarks.py" --compare bench_baseline.json
+
+"""
+
+
+import argparse
+import gc
+import glob
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+
+SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Z Danial - AirAnalytics Source.py')
+
+SIZES = [1000, 10000, 100000]
+WINDOWS = [30, 90, 365]
+CARDS_PER_PAGE = 18
+#The xlsx export is only timed on stores up to this many listing x day cells (it writes a file)
+EXPORT_CELLS = 100000
+
+
+#The source file name has spaces in it, so it is loaded by path
+def load_source():
+    spec = importlib.util.spec_from_file_location('air_analytics', SOURCE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['air_analytics'] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+#Values of one generated listing, shared by its card and its entry in the page state
+def card_values(i, rng):
+    values = {'id': 100000 + i, 'name': 'Listing %d' % i,
+              'lat': round(26.3 + 0.1 * rng.random(), 6), 'lng': round(-80.1 - 0.1 * rng.random(), 6),
+              'price': int(rng.integers(40, 2500)), 'beds': int(rng.integers(1, 6))}
+    if i % 5 != 0:
+        values['rating'] = round(3 + rng.random() * 2, 1)
+        values['reviews'] = int(rng.integers(1, 400))
+    else:
+        values['rating'] = None
+        values['reviews'] = int(rng.integers(1, 40))
+    return values
+
+
+#One listing card in the markup the xpath selectors expect
+def card_html(values):
+    if values['rating'] is not None:
+        rating = ('<div class="ratingContainer_inline_36rlri"><span role="img" aria-label="Rating %.1f out of 5">'
+                  '</span><span class="text_5mbkop-o_O-size_micro_16wifzf-o_O-inline_g86r3e">%d</span></div>'
+                  % (values['rating'], values['reviews']))
+    else:
+        rating = '<span>%d reviews</span>' % values['reviews']
+    return ('<div itemprop="itemListElement"><meta itemprop="name" content="%s - Entire home - Boca Raton"/>'
+            '<div itemprop="geo"><meta itemprop="latitude" content="%.6f"/><meta itemprop="longitude" content="%.6f"/>'
+            '</div><div class="listingCardWrapper_9kg52c"><div class="listingContainer_f21qs6" id="listing-%d">'
+            '<div class="infoContainer_v72lrv"><span>Entire home</span><span>$%s</span><span>%d beds</span>%s'
+            '</div></div></div></div>'
+            % (values['name'], values['lat'], values['lng'], values['id'], format(values['price'], ','),
+               values['beds'], rating))
+
+
+#The embedded page state (see parse_state) for the same listings, so json-mode parses it
+#instead of falling back to the cards
+def state_json(cards):
+    results = [{'listing': {'id': values['id'], 'name': values['name'], 'room_type': 'Entire home',
+                            'city': 'Boca Raton', 'beds': values['beds'], 'star_rating': values['rating'],
+                            'reviews_count': values['reviews'], 'lat': values['lat'], 'lng': values['lng']},
+                'pricing_quote': {'rate': {'amount': values['price'], 'currency': 'USD'}}} for values in cards]
+    state = {'bootstrapData': {'reduxData': {'exploreTab': {'response': {'explore_tabs': [
+        {'sections': [{'listings': results}]}]}}}}}
+    return json.dumps(state)
+
+
+def page_html(start, rng):
+    values = [card_values(start + i, rng) for i in range(CARDS_PER_PAGE)]
+    cards = ''.join(card_html(card) for card in values)
+    buttons = ''.join('<li class="buttonContainer_1am0dt"><a>%d</a></li>' % n for n in range(1, 18))
+    return ('<html><head><title>Search</title></head><body><div class="results">' + cards +
+            '</div><ul>' + buttons + '</ul><script type="application/json" data-hypernova-key="spaspabundlejs">'
+            '<!--' + state_json(values) + '--></script></body></html>').encode('utf-8')
+
+
+def generated_pages(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [page_html(n * CARDS_PER_PAGE, rng) for n in range(count)]
+
+
+def recorded_pages(directory):
+    pages = []
+    for name in sorted(glob.glob(os.path.join(directory, '*.html'))):
+        with open(name, 'rb') as f:
+            pages.append(f.read())
+    return pages
+
+
+#Baseline records as parse_page would return them
+def synthetic_records(n, rng):
+    records = []
+    for i in range(n):
+        records.append({'id': str(100000 + i), 'name': 'Listing ' + str(i), 'typo': 'Entire home',
+                        'city': 'Boca Raton', 'price': int(rng.integers(40, 2500)), 'beds': int(rng.integers(1, 6)),
+                        'rating': 4.5, 'review_count': int(rng.integers(0, 400)),
+                        'lat': 26.3 + 0.1 * float(rng.random()), 'lng': -80.1 - 0.1 * float(rng.random()), 'error': 0})
+    return records
+
+
+#A session holding n baseline listings, with the given vacancy rate over a days-long window
+def synthetic_session(air, n, days, rng, vacancy_rate=0.4):
+    session = air.ScrapeSession('Benchmark')
+    start = air.Date('2017-07-01')
+    period = air.days_forward(start, days - 1, session)
+    for record in synthetic_records(n, rng):
+        air.Listing(record['id'], record['name'], record['typo'], record['city'], record['price'],
+                    record['beds'], record['rating'], record['review_count'], session, record['lat'], record['lng'])
+    online = session.online
+    online.set_period(period)
+    for listing in session.listings:
+        online.row(listing.id, listing.beds)
+    vacant = rng.random((n, days)) < vacancy_rate
+    online.vacant[:n, :days] = vacant
+    online.prices[:n, :days] = np.where(vacant, rng.integers(40, 2500, (n, days)), np.nan)
+    return session, period
+
+
+#Times func (repeated until min_time has passed, so fast stages are not all noise), then runs
+#it once more under tracemalloc for peak memory
+def measure(func, min_time=0.2):
+    gc.collect()
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        func()
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+    elapsed = elapsed / runs
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def bench(results, stage, size, items, unit, func):
+    elapsed, peak = measure(func)
+    rate = items / elapsed if elapsed > 0 else float('inf')
+    key = stage + ' [' + size + ']'
+    results[key] = {'seconds': elapsed, 'throughput': rate, 'unit': unit, 'peak_bytes': peak}
+    print(format(key, '<52') + format(rate, '>14,.0f') + ' ' + format(unit + '/s', '<10') +
+          format(elapsed, '>9.3f') + ' s' + format(peak / 2 ** 20, '>10.1f') + ' MiB')
+
+
+def page_stages(air, results, pages, label):
+    cards = sum(len(air.LISTING_NODES(air.etree.fromstring(page, air.PAGE_PARSER))) for page in pages)
+    size = label + ', ' + str(len(pages)) + ' pages'
+    bench(results, 'listing_process (parse_page)', size, cards, 'cards',
+          lambda: [air.parse_page(page) for page in pages])
+    bench(results, 'parse_page json-mode', size, cards, 'cards',
+          lambda: [air.parse_page(page, mode='json') for page in pages])
+    bench(results, 'date_price_process (online)', size, cards, 'cards',
+          lambda: [air.parse_page(page, online=True) for page in pages])
+    records = [air.parse_page(page) for page in pages]
+    known = frozenset(unit_info['id'] for page in records for unit_info in page if unit_info != air.CARD_ERROR)
+    bench(results, 'date_price_process (known)', size, cards, 'cards',
+          lambda: [air.parse_page(page, online=True, known=known) for page in pages])
+    online = [air.parse_page(page, online=True) for page in pages]
+    date_on = air.Date('2017-07-01')
+
+    def baseline_ingest():
+        session = air.ScrapeSession('Benchmark')
+        for page in records:
+            air.Listing.baseline_processor(page, session)
+
+    def online_ingest():
+        session = air.ScrapeSession('Benchmark')
+        for page in online:
+            air.ListingOnline.page_processor(page, date_on, session)
+
+    bench(results, 'baseline_processor', size, cards, 'cards', baseline_ingest)
+    bench(results, 'ListingOnline.page_processor', size, cards, 'cards', online_ingest)
+
+
+def store_stages(air, results, sizes, windows, seed):
+    rng = np.random.default_rng(seed)
+    for n in sizes:
+        records = synthetic_records(n, rng)
+
+        def ingest():
+            session = air.ScrapeSession('Benchmark')
+            for start in range(0, n, CARDS_PER_PAGE):
+                air.Listing.baseline_processor(records[start:start + CARDS_PER_PAGE], session)
+
+        bench(results, 'baseline_processor', str(n) + ' listings', n, 'listings', ingest)
+        session = air.ScrapeSession('Benchmark')
+        for start in range(0, n, CARDS_PER_PAGE):
+            air.Listing.baseline_processor(records[start:start + CARDS_PER_PAGE], session)
+        points = rng.random((100, 2)) * 0.1 + [26.3, -80.2]
+        bench(results, 'spatial queries (box + 1km radius)', str(n) + ' listings', 200, 'queries',
+              lambda: [(session.listings.within_box(lat - 0.01, lng - 0.01, lat + 0.01, lng + 0.01),
+                        session.listings.within_radius(lat, lng, 1.0)) for lat, lng in points])
+        for days in windows:
+            session, period = synthetic_session(air, n, days, rng)
+            size = str(n) + ' x ' + str(days) + 'd'
+            bench(results, 'vacancy aggregation', size, n * days, 'cells',
+                  lambda: session.online.counts_by_bed(period))
+            bench(results, 'demand report', size, n * days, 'cells',
+                  lambda: air.DemandReport(session.online, period, session.listings))
+            report = air.DemandReport(session.online, period, session.listings)
+            bench(results, 'density curves (all dates)', size, n * days, 'cells',
+                  lambda: air.DensityEngine().curves('Benchmark', report, period, range(1, 6)))
+            bench(results, 'baseline_frame', size, n, 'rows', lambda: air.baseline_frame(days, session))
+            bench(results, 'vacancy_frame', size, n * days, 'cells', lambda: air.vacancy_frame(period, session))
+            if n * days <= EXPORT_CELLS:
+                frame = air.vacancy_frame(period, session)
+                with tempfile.TemporaryDirectory() as directory:
+                    bench(results, 'excel export (vacancy sheet)', size, n * days, 'cells',
+                          lambda: excel_export(air, frame, os.path.join(directory, 'Benchmark Data.xlsx')))
+
+
+def excel_export(air, frame, filename):
+    with air.ExcelExport(filename, keep=False) as book:
+        book.write_frame('Vacancy', frame)
+
+
+#Stages whose throughput fell by more than tolerance against the baseline
+def regressions(results, baseline, tolerance):
+    out = []
+    for key, result in results.items():
+        if key in baseline:
+            before = baseline[key]['throughput']
+            if before > 0 and result['throughput'] < before * (1 - tolerance):
+                out.append((key, before, result['throughput']))
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the AirAnalytics hot paths.')
+    parser.add_argument('--pages', help='directory of recorded search pages (*.html) to benchmark as well')
+    parser.add_argument('--page-count', type=int, default=200, help='number of generated search pages')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='synthetic store sizes (listings)')
+    parser.add_argument('--windows', type=int, nargs='+', default=WINDOWS, help='synthetic scan windows (days)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', help='save the results as a baseline json file')
+    parser.add_argument('--compare', help='compare against a baseline json file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed throughput drop against the baseline (default 0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    air = load_source()
+    results = dict()
+    print(format('stage [input]', '<52') + format('throughput', '>25') + format('time', '>11') +
+          format('peak', '>14'))
+    page_stages(air, results, generated_pages(args.page_count, args.seed), 'generated')
+    if args.pages:
+        page_stages(air, results, recorded_pages(args.pages), 'recorded')
+    store_stages(air, results, args.sizes, args.windows, args.seed)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('Baseline saved to ' + args.save)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = regressions(results, baseline, args.tolerance)
+        for key, before, after in slower:
+            print('REGRESSION ' + key + ': ' + format(before, ',.0f') + ' -> ' + format(after, ',.0f') + '/s')
+        if len(slower) > 0:
+            return 1
+        print('No regressions against ' + args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -16,31 +16,694 @@ Air Analytics Dashboard Example in my portfolio.
 
 
 #import requirements
-from lxml import html
+from lxml import html, etree
+import atexit
+import contextlib
 import datetime
+from calendar import monthrange
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import warnings
+import multiprocessing
+import queue
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 import requests
+from requests.adapters import HTTPAdapter
+from xml.sax.saxutils import escape
 import plotly.tools
-import plotly.plotly as py
+import plotly.offline
 import plotly.graph_objs as go
-import plotly.figure_factory as ff
-from scipy.signal import argrelextrema
 import numpy as np
 import pandas as pd
 import colorlover as cl
-from openpyxl import load_workbook
+from openpyxl import Workbook, load_workbook
 
 
 
-start_time = datetime.datetime.now()
-
 #configuring plot package
-plotly.tools.set_config_file(world_readable=False,
-                             sharing='private')
 scheme = 5*cl.scales['9']['qual']['Pastel1']
 
-#counters to track numbers of listings grabbed
-total_accuracy = 0
-accuracy_count = 0
+#Xpath selectors, compiled once and reused for every page and listing card
+#Everything below LISTING_NODES is evaluated relative to a single listing card
+#Text and attribute results are plain strings (smart_strings=False), which are much cheaper
+#The card's meta tags (name, coordinates) and its id attribute are read without XPath, see
+#card_meta, as each XPath call costs a few microseconds per card
+#SPAN_NODES only looks at the top level of a listing span (see listing_span), where the cards
+#usually all are, instead of searching the whole tree
+LISTING_NODES = etree.XPath('//div[@itemprop="itemListElement"]')
+SPAN_NODES = etree.XPath('/html/body/div[@itemprop="itemListElement"]')
+PAGE_BUTTONS = etree.XPath('//li[@class = "buttonContainer_1am0dt"]/descendant::text()', smart_strings=False)
+#CARD_TEXT gives a card's (first) listing container followed by its info text nodes in one
+#call. The info container and rating selectors are evaluated on the listing container, the
+#two rating fields are reached in one call each instead of going through the containers
+CARD_TEXT = etree.XPath('(div[@class="listingCardWrapper_9kg52c"]/div[@class="listingContainer_f21qs6"])[1] | '
+                        '(div[@class="listingCardWrapper_9kg52c"]/div[@class="listingContainer_f21qs6"])[1]'
+                        '/div[@class="infoContainer_v72lrv"][1]/descendant::text()', smart_strings=False)
+INFO_CONTAINER = etree.XPath('div[@class="infoContainer_v72lrv"]')
+RATING_LABEL = etree.XPath('div[@class="infoContainer_v72lrv"][1]'
+                           '/descendant::div[@class="ratingContainer_inline_36rlri"][1]'
+                           '/descendant::span[@role="img"]/@aria-label', smart_strings=False)
+REVIEW_COUNT = etree.XPath('div[@class="infoContainer_v72lrv"][1]'
+                           '/descendant::div[@class="ratingContainer_inline_36rlri"][1]'
+                           '/descendant::span[@class="text_5mbkop-o_O-size_micro_16wifzf-o_O-inline_g86r3e"]/text()',
+                           smart_strings=False)
+
+#Field tokens of the listing card info text, matched over the text nodes of every card of a
+#page at once (see CardFields). Nodes are joined by NODE_SEP and each alternative has to span
+#a whole node: a price "$1,234", a bed count "3 beds" or a review count "12 reviews ..."
+NODE_SEP = '\x1f'
+CARD_TOKENS = re.compile(r'(?<![^\x1f])(?:\$(?P<price>,*\d[\d,]*)|(?P<beds>\d+) beds?|(?P<reviews>\d+) review[^\x1f]*)'
+                         r'(?![^\x1f])')
+
+#Parser for search pages: plain lxml elements, no HtmlElement class lookup per node
+PAGE_PARSER = etree.HTMLParser(collect_ids=False)
+
+#Targeted parsing (see listing_span): parse_page only builds a tree for the byte span from the
+#first listing card to the end of the last one. CARD_START finds the cards, DIV_TAG the div
+#tags that close the last card, PAGE_CHARSET the page's declared encoding to carry over
+CARD_START = re.compile(rb'<div[^>]*\bitemprop="itemListElement"')
+DIV_TAG = re.compile(rb'<(/?)div\b', re.I)
+PAGE_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.I)
+
+#Listing ids in the raw bytes of a page, see known_on_page
+LISTING_ID = re.compile(rb'\bid="listing-([^"]*)"')
+
+#Embedded page state: search pages ship their results as JSON inside a script tag
+#(optionally wrapped in an html comment), which can be read without building a DOM
+STATE_SCRIPT = re.compile(rb'<script[^>]*type="application/json"[^>]*>\s*(?:<!--)?(.*?)(?:-->)?\s*</script>', re.S)
+
+#Extractors parse_page can use: 'xpath' reads the listing cards from the DOM, 'json'
+#decodes the embedded page state and falls back to the DOM when there is none
+EXTRACT_MODES = ('xpath', 'json')
+
+#Returned in place of a record for a listing card that could not be read
+CARD_ERROR = [1, 0, 0, 0, 0, 0, 0, 0]
+
+#Mean earth radius in km, for distances between listing coordinates
+EARTH_RADIUS = 6371.0088
+
+#Incremental refresh schedule, (days ahead, max age in days) pairs: a night is scraped again
+#at most max age days after its last scrape, using the first pair it is within (None covers
+#the rest of the window). Nights new to the window are always scraped. Nights are staggered
+#over their max age (see refresh_due) so daily refreshes stay about the same size
+REFRESH_SCHEDULE = ((7, 7), (None, 21))
+
+
+#Metrics is a small registry of counters, gauges and histograms for one run (or for the
+#shared fetch layer). Each series is a metric name plus labels, and the registry exports
+#as JSON or as Prometheus text
+class Metrics:
+    SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+    PERCENT = (50, 80, 90, 95, 99, 100)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = OrderedDict()
+        self.gauges = OrderedDict()
+        self.histograms = OrderedDict()
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = Metrics._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[Metrics._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=SECONDS, **labels):
+        key = Metrics._key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            histogram = self.histograms[key]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    #with metrics.timer('air_stage_seconds', stage='baseline'): ...
+    def timer(self, name, **labels):
+        metrics = self
+
+        class Timer:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *exc):
+                metrics.observe(name, time.perf_counter() - self.start, **labels)
+
+        return Timer()
+
+    def value(self, name, **labels):
+        key = Metrics._key(name, labels)
+        with self.lock:
+            return self.counters.get(key, self.gauges.get(key))
+
+    def to_dict(self):
+        out = {'counters': [], 'gauges': [], 'histograms': []}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                out['counters'].append({'name': name, 'labels': dict(labels), 'value': value})
+            for (name, labels), value in self.gauges.items():
+                out['gauges'].append({'name': name, 'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in self.histograms.items():
+                out['histograms'].append({'name': name, 'labels': dict(labels), 'buckets': list(histogram['buckets']),
+                                          'counts': list(histogram['counts']), 'sum': histogram['sum'],
+                                          'count': histogram['count']})
+        return out
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if len(pairs) == 0:
+            return ''
+        return '{' + ','.join(k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"'
+                              for k, v in pairs) + '}'
+
+    #Series are grouped by name, as the text format expects
+    def to_prometheus(self):
+        lines = []
+        typed = set()
+        with self.lock:
+            for kind, series in (('counter', self.counters), ('gauge', self.gauges)):
+                for (name, labels), value in sorted(series.items(), key=lambda item: item[0][0]):
+                    if name not in typed:
+                        lines.append('# TYPE ' + name + ' ' + kind)
+                        typed.add(name)
+                    lines.append(name + Metrics._labels(labels) + ' ' + repr(value))
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0][0]):
+                if name not in typed:
+                    lines.append('# TYPE ' + name + ' histogram')
+                    typed.add(name)
+                total = 0
+                for bound, count in zip(histogram['buckets'], histogram['counts']):
+                    total += count
+                    lines.append(name + '_bucket' + Metrics._labels(labels, [('le', bound)]) + ' ' + str(total))
+                lines.append(name + '_bucket' + Metrics._labels(labels, [('le', '+Inf')]) + ' ' +
+                             str(histogram['count']))
+                lines.append(name + '_sum' + Metrics._labels(labels) + ' ' + repr(histogram['sum']))
+                lines.append(name + '_count' + Metrics._labels(labels) + ' ' + str(histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename, form='json'):
+        with open(filename, 'w') as f:
+            if form == 'prometheus':
+                f.write(self.to_prometheus())
+            else:
+                f.write(self.to_json())
+
+
+#ResponseCache is a content-addressed on-disk cache of page responses keyed by normalized url
+#Entries are stored as <sha256 of url>.html, the file mtime is when the page was fetched and
+#the atime is when it was last served. Entries older than ttl seconds are refetched, the
+#cache is trimmed back under max_bytes by evicting the least recently used entries, and in
+#offline mode pages are replayed from the cache only (stale or not) and never fetched
+class ResponseCache:
+    def __init__(self, directory='.air_cache', ttl=24 * 3600, max_bytes=512 * 2 ** 20, offline=False):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.size = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for name in os.listdir(directory):
+            if name.endswith('.html'):
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_atime, name[:-5], stat.st_size))
+        for used, key, size in sorted(found):
+            self._entries[key] = size
+            self.size += size
+
+    @staticmethod
+    def normalize(url):
+        parts = urlsplit(url)
+        query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+    @staticmethod
+    def key(url):
+        return hashlib.sha256(ResponseCache.normalize(url).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.html')
+
+    def get(self, url):
+        key = ResponseCache.key(url)
+        path = self._path(key)
+        #A concurrent put can evict the entry at any point, a vanished file is a miss
+        try:
+            stat = os.stat(path)
+            if not self.offline and self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                content = f.read()
+            os.utime(path, (time.time(), stat.st_mtime))
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+        return content
+
+    def put(self, url, content):
+        key = ResponseCache.key(url)
+        path = self._path(key)
+        temp = path + '.' + str(threading.get_ident()) + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(content)
+        os.replace(temp, path)
+        with self._lock:
+            self.size += len(content) - self._entries.pop(key, 0)
+            self._entries[key] = len(content)
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self.size -= old_size
+                try:
+                    os.remove(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+
+
+#The Fetcher class is the shared fetch layer for every page request. It keeps one pooled
+#keep-alive session, fans requests out over a bounded thread pool, and limits both the
+#number of requests in flight and the request rate (requests per second) for each host
+#With a ResponseCache attached, pages are served from disk when possible. Only pages that
+#hold listing cards are cached, a blocked or empty page is fetched again next time
+#Requests are counted in the fetcher's own (process wide) metrics and, when given, in the
+#metrics of the run that made them
+#Concurrent gets of the same url share one request, later callers wait on the first one's
+#download instead of making their own
+#fresh=True skips the cached copy, for retries of a page that came back empty or unreadable
+class Fetcher:
+    def __init__(self, max_workers=8, per_host=4, rate=4.0, timeout=30, cache=None):
+        self.cache = cache
+        self.metrics = Metrics()
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.rate = rate
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._lock = threading.Lock()
+        self._hosts = dict()
+        self._in_flight = dict()
+
+    def _host_slot(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = [threading.BoundedSemaphore(self.per_host), 0.0]
+            return self._hosts[host]
+
+    def _throttle(self, slot):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = slot[1] - now
+            slot[1] = max(now, slot[1]) + 1.0 / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+    def get(self, url, metrics=None, fresh=False):
+        sinks = [self.metrics]
+        if metrics is not None:
+            sinks.append(metrics)
+        if self.cache is not None:
+            if not fresh:
+                content = self.cache.get(url)
+                if content is not None:
+                    for sink in sinks:
+                        sink.inc('air_cache_hits_total')
+                    return content
+                for sink in sinks:
+                    sink.inc('air_cache_misses_total')
+            if self.cache.offline:
+                return b''
+        with self._lock:
+            pending = self._in_flight.get(url)
+            if pending is None:
+                self._in_flight[url] = Future()
+        if pending is not None:
+            for sink in sinks:
+                sink.inc('air_requests_coalesced_total')
+            return pending.result()
+        try:
+            content = self._download(url, sinks)
+        except BaseException as error:
+            self._in_flight[url].set_exception(error)
+            raise
+        else:
+            self._in_flight[url].set_result(content)
+        finally:
+            with self._lock:
+                del self._in_flight[url]
+        return content
+
+    def _download(self, url, sinks):
+        slot = self._host_slot(url)
+        with slot[0]:
+            self._throttle(slot)
+            start = time.perf_counter()
+            try:
+                page = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException:
+                for sink in sinks:
+                    sink.inc('air_request_errors_total')
+                raise
+            elapsed = time.perf_counter() - start
+        for sink in sinks:
+            sink.inc('air_requests_total', status=page.status_code)
+            sink.inc('air_bytes_downloaded_total', len(page.content))
+            sink.observe('air_request_seconds', elapsed)
+        if self.cache is not None and page.status_code == 200 and CARD_START.search(page.content):
+            self.cache.put(url, page.content)
+        return page.content
+
+    #False in offline mode, where a page that came back empty cannot come back any different
+    def can_refetch(self):
+        return self.cache is None or not self.cache.offline
+
+    #Applies func to every item over the thread pool, results come back in input order
+    def map(self, func, items):
+        return list(self.pool.map(func, items))
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+
+fetcher = Fetcher()
+
+
+#Replaces the shared fetch layer, e.g. configure_fetcher(max_workers=16, per_host=6, rate=8)
+def configure_fetcher(**kwargs):
+    global fetcher
+    old = fetcher
+    fetcher = Fetcher(**kwargs)
+    old.close()
+    return fetcher
+
+
+#RetryPolicy decides whether, and after how long, an empty or failed page is fetched again
+#Retry n of a page waits a random time up to base * factor^(n-1) seconds (capped), every
+#page gets at most `attempts` fetches, and a run gets `budget` retries in total
+#The circuit breaker opens after `threshold` empty pages in a row: further retries wait out
+#the cooldown first, and after `trips` cooldowns with no good page in between it gives up
+class RetryPolicy:
+    def __init__(self, attempts=3, base=1.0, factor=2.0, cap=30.0, budget=500, threshold=10, cooldown=60.0,
+                 trips=3, metrics=None):
+        self.attempts = attempts
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.budget = budget
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.trips = trips
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.spent = 0
+        self.empty = 0
+        self.tripped = 0
+        self.opened_at = None
+
+    def _count(self, name, **labels):
+        if self.metrics is not None:
+            self.metrics.inc(name, **labels)
+
+    def delay(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * self.factor ** (attempt - 1)))
+
+    def success(self):
+        with self.lock:
+            self.empty = 0
+            self.tripped = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self.lock:
+            self.empty += 1
+            if self.empty >= self.threshold:
+                if self.opened_at is None:
+                    self._count('air_circuit_opened_total')
+                self.opened_at = time.monotonic()
+
+    def is_open(self):
+        return self.opened_at is not None
+
+    #Called before retry number `attempt` of a page, sleeps and returns True if it may go ahead
+    #Never retries in offline mode, there is nothing to fetch again
+    def wait(self, attempt, stage='fetch'):
+        if not fetcher.can_refetch():
+            return False
+        with self.lock:
+            if attempt >= self.attempts:
+                return False
+            if self.spent >= self.budget:
+                self._count('air_retry_budget_exhausted_total', stage=stage)
+                return False
+            pause = 0
+            if self.opened_at is not None:
+                if self.tripped >= self.trips:
+                    self._count('air_circuit_rejected_total', stage=stage)
+                    return False
+                self.tripped += 1
+                pause = max(0, self.opened_at + self.cooldown - time.monotonic())
+            self.spent += 1
+        pause += self.delay(attempt)
+        self._count('air_retries_total', stage=stage)
+        if self.metrics is not None:
+            self.metrics.observe('air_backoff_seconds', pause, stage=stage)
+        time.sleep(pause)
+        return True
+
+
+#ScrapePipeline runs a staged fetch -> parse -> ingest scrape
+#Fetch worker threads download pages through the shared Fetcher, parse workers in a process
+#pool turn page bytes into plain records (parse_page), and the caller's thread is the single
+#ingest stage. The stages are linked by bounded queues so a slow stage holds back the ones
+#before it. Results are ingested in job order, so at most window jobs are let past the feed
+#ahead of the next one to ingest: a slow page at the head holds the rest back instead of
+#piling finished pages up in the reorder buffer
+#With parse_workers=0 pages are parsed on the fetch threads instead
+#A page that fails to parse stops the run with the parse error. A consumer that stops early
+#(or raises) stops the run too: the feed hands out no more jobs and the stages drain
+class ScrapePipeline:
+    def __init__(self, parse_workers=None, queue_size=32, window=None):
+        self.queue_size = queue_size
+        self.window = window if window is not None else 2 * queue_size
+        if parse_workers == 0:
+            self.parse_pool = None
+        else:
+            self.parse_pool = parse_pool(parse_workers)
+
+    def _feed(self, jobs, fetch_queue, workers, window, stop):
+        for index, job in enumerate(jobs):
+            window.acquire()
+            if stop.is_set():
+                break
+            fetch_queue.put((index, job[0], job[1]))
+        for _ in range(workers):
+            fetch_queue.put(None)
+
+    def _fetch(self, fetch_queue, parse_queue, online, mode, metrics, known, stop):
+        while True:
+            job = fetch_queue.get()
+            if job is None:
+                parse_queue.put(None)
+                return
+            if stop.is_set():
+                continue
+            index, key, url = job
+            try:
+                content = fetcher.get(url, metrics)
+            except Exception as error:
+                print('Pipeline fetch error', url, error)
+                content = None
+            if content is not None and self.parse_pool is None:
+                done = Future()
+                try:
+                    done.set_result(timed_parse(content, online, mode, known))
+                except Exception as error:
+                    done.set_exception(error)
+                parse_queue.put((index, key, done))
+            else:
+                parse_queue.put((index, key, content))
+
+    def _dispatch(self, parse_queue, ingest_queue, workers, online, mode, known, stop):
+        finished = 0
+        while finished < workers:
+            item = parse_queue.get()
+            if item is None:
+                finished += 1
+                continue
+            if stop.is_set():
+                continue
+            index, key, content = item
+            if content is None or isinstance(content, Future):
+                ingest_queue.put((index, key, content))
+            else:
+                try:
+                    result = self.parse_pool.submit(timed_parse, content, online, mode, known_on_page(content, known))
+                except Exception as error:
+                    result = Future()
+                    result.set_exception(error)
+                ingest_queue.put((index, key, result))
+        ingest_queue.put(None)
+
+    #jobs is a list of (key, url), yields (key, records) in job order
+    #records is None when a page could not be fetched, known is passed on to parse_page
+    def run(self, jobs, online=False, mode='xpath', metrics=None, known=frozenset()):
+        workers = fetcher.max_workers
+        fetch_queue = queue.Queue(self.queue_size)
+        parse_queue = queue.Queue(self.queue_size)
+        ingest_queue = queue.Queue(self.queue_size)
+        window = threading.Semaphore(self.window)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._feed, args=(jobs, fetch_queue, workers, window, stop), daemon=True),
+                   threading.Thread(target=self._dispatch,
+                                    args=(parse_queue, ingest_queue, workers, online, mode, known, stop), daemon=True)]
+        for _ in range(workers):
+            threads.append(threading.Thread(target=self._fetch,
+                                            args=(fetch_queue, parse_queue, online, mode, metrics, known, stop),
+                                            daemon=True))
+        for thread in threads:
+            thread.start()
+        waiting = dict()
+        next_index = 0
+        finished = False
+        try:
+            while True:
+                item = ingest_queue.get()
+                if item is None:
+                    finished = True
+                    break
+                waiting[item[0]] = item[1:]
+                while next_index in waiting:
+                    key, result = waiting.pop(next_index)
+                    next_index += 1
+                    window.release()
+                    records = None
+                    if result is not None:
+                        try:
+                            records, seconds = result.result()
+                        except Exception as error:
+                            if metrics is not None:
+                                metrics.inc('air_parse_errors_total', stage=parse_stage(online))
+                            raise RuntimeError('Pipeline parse error on ' + str(key) + ': ' + repr(error)) from error
+                        if metrics is not None:
+                            metrics.observe('air_parse_seconds', seconds, stage=parse_stage(online))
+                    yield key, records
+        finally:
+            if not finished:
+                ScrapePipeline._drain(stop, window, ingest_queue, list(waiting.values()))
+            for thread in threads:
+                thread.join()
+
+    #Winds down a run left early: the feed is let go and stops, the fetch and dispatch stages
+    #pass what is left through without work, and queued parses are cancelled
+    @staticmethod
+    def _drain(stop, window, ingest_queue, waiting):
+        stop.set()
+        window.release()
+        results = [result for key, result in waiting]
+        while True:
+            item = ingest_queue.get()
+            if item is None:
+                break
+            results.append(item[2])
+        for result in results:
+            if isinstance(result, Future):
+                result.cancel()
+
+    def close(self):
+        if self.parse_pool is not None:
+            self.parse_pool.shutdown(wait=True)
+
+
+#Parse worker processes are spawned, never forked from a process whose fetch threads are
+#running, and find timed_parse by importing this module. Run as a script they load it from
+#its path on their own, loaded by path under another name (as the tests and benchmarks do)
+#each worker first loads it from the same file under that name. As with any spawned pool, a
+#script that uses this module keeps its own top-level code under if __name__ == '__main__'
+WORKER_BOOTSTRAP = '''
+import importlib.util, sys
+spec = importlib.util.spec_from_file_location(%r, %r)
+module = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = module
+spec.loader.exec_module(module)
+'''
+
+
+def parse_pool(workers):
+    context = multiprocessing.get_context('spawn')
+    if __name__ == '__main__':
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=exec,
+                               initargs=(WORKER_BOOTSTRAP % (__name__, os.path.abspath(__file__)),))
+
+
+pipeline = None
+pipeline_lock = threading.Lock()
+
+
+#Shared scrape pipeline, created on first use
+def get_pipeline():
+    global pipeline
+    with pipeline_lock:
+        if pipeline is None:
+            pipeline = ScrapePipeline()
+        return pipeline
+
+
+#Replaces the shared scrape pipeline, e.g. configure_pipeline(parse_workers=4, queue_size=64)
+def configure_pipeline(**kwargs):
+    global pipeline
+    if pipeline is not None:
+        pipeline.close()
+    pipeline = ScrapePipeline(**kwargs)
+    return pipeline
+
+
+#Shuts the shared pipeline's parse pool down, run at interpreter exit so the worker
+#processes are not left for garbage collection to tear down
+def close_pipeline():
+    global pipeline
+    with pipeline_lock:
+        if pipeline is not None:
+            pipeline.close()
+            pipeline = None
+
+
+atexit.register(close_pipeline)
 
 
 #This class allows chopping a coordinate grid into smaller peices 
@@ -55,6 +718,13 @@ class MapSearch:
         self.sw_lng = sw_lng
         self.area_total_price = 0
         self.area_total_units = 0
+        self.pages = None
+        self.first = None
+        self.ids = []
+        self.sample = 0
+        self.readable = 0
+        self.scraped = None
+        self.done_pages = set()
 
     def add_units(self, increment):
         self.area_total_units += increment
@@ -74,29 +744,44 @@ class MapSearch:
                    str(self.sw_lat) + "&sw_lng=" + str(self.sw_lng) + "&search_by_map=true")
 
     def chop(self, pieces):
-        lng_start = self.sw_lng
-        lng_step = abs((self.ne_lng - self.sw_lng) / pieces)
-        lng_end = self.ne_lng
-
-        lat_start = self.sw_lat
-        lat_step = abs((self.sw_lat - self.ne_lat) / pieces)
-        lat_end = self.ne_lat
-        print(lat_start, lat_end, lat_step, (lat_end-lat_start)/lat_step)
-        print(lng_start, lng_end, lng_step, (lng_end-lng_start)/lng_step)
-
-        start = np.asarray([lat_start, lng_start, lat_start + lat_step, lng_start + lng_step])
-        box_on = start
+        lng_step = (self.ne_lng - self.sw_lng) / pieces
+        lat_step = (self.ne_lat - self.sw_lat) / pieces
         out = []
         for i in range(pieces):
             for x in range(pieces):
-                out.append(MapSearch(self.base, box_on[0]+x*lat_step, box_on[1], box_on[2]+x*lat_step, box_on[3]))
-                print(box_on[0]+x*lat_step, box_on[1], box_on[2]+x*lat_step, box_on[3])
-            box_on = start
-            box_on[1] += lng_step
-            box_on[3] += lng_step
+                box = MapSearch(self.base, self.sw_lat + x * lat_step, self.sw_lng + i * lng_step,
+                                self.sw_lat + (x + 1) * lat_step, self.sw_lng + (i + 1) * lng_step)
+                out.append(box)
+                print(box.sw_lat, box.sw_lng, box.ne_lat, box.ne_lng)
         print()
         return out
 
+    #Adaptive quadtree subdivision of the search area
+    #Each level of boxes is probed for its page count concurrently, boxes at or over split_at
+    #pages are split into quarters and probed again, sparse boxes become leaves right away
+    #The probed page count and first page (box.pages, box.first) are kept on each leaf so the
+    #baseline need not probe again, mode is the extractor the baseline will use and metrics and
+    #retry are the run's, so probe requests are counted and retried like the rest of the run
+    def adaptive(self, split_at=18, max_depth=4, mode='xpath', metrics=None, retry=None):
+        leaves = []
+        level = [self]
+        depth = 0
+        while len(level) > 0:
+            probes = fetcher.map(lambda box: probe_page(box.query(), mode=mode, metrics=metrics, retry=retry),
+                                 level)
+            next_level = []
+            for box, (pages, first) in zip(level, probes):
+                box.pages = pages
+                box.first = first
+                if pages >= split_at and depth < max_depth:
+                    next_level.extend(box.chop(2))
+                else:
+                    leaves.append(box)
+            print('Depth ' + str(depth) + ': ' + str(len(level)) + ' probed, ' + str(len(next_level)) + ' to split')
+            level = next_level
+            depth += 1
+        return leaves
+
     @staticmethod
     def clean(base, string):
         first = string.split("&")
@@ -118,37 +803,59 @@ class MapSearch:
 
 
 #Date class is an object for storage of data from scraping specific days 
+#A Date is an integer day index (days since 1970-01-01, the numpy datetime64[D] value), so
+#date arithmetic is integer addition and is correct across month, year and leap day
+#boundaries. The string fields of the old format (month, string_day, year) are derived
 class Date:
     calendar = []
-    scan = []
 
     def __init__(self, text):
         if "/" in text:
-            self.month = text[:2]
-            self.string_day = text[3:5]
-            self.day = int(text[3:5])
-            self.year = text[6:]
-        else:
-            self.month = text[5:7]
-            self.string_day = text[-2:]
-            self.day = int(self.string_day)
-            self.year = text[:4]
+            text = text[6:10] + "-" + text[:2] + "-" + text[3:5]
+        self.index = int(np.datetime64(text[:10], 'D').astype(np.int64))
+
+    @classmethod
+    def from_index(cls, index):
+        date = cls.__new__(cls)
+        date.index = int(index)
+        return date
+
+    def __eq__(self, other):
+        return isinstance(other, Date) and self.index == other.index
+
+    def __lt__(self, other):
+        return self.index < other.index
+
+    def __hash__(self):
+        return self.index
+
+    def __repr__(self):
+        return 'Date(' + repr(self.out()) + ')'
+
+    def datetime64(self):
+        return np.datetime64(self.index, 'D')
 
     def out(self):
-        return self.year + "-" + self.month + "-" + add_zero(self.day)
+        return str(self.datetime64())
+
+    @property
+    def year(self):
+        return self.out()[:4]
+
+    @property
+    def month(self):
+        return self.out()[5:7]
+
+    @property
+    def string_day(self):
+        return self.out()[8:10]
+
+    @property
+    def day(self):
+        return int(self.string_day)
 
     def add_days(self, amount):
-        length = month_length(self)
-        month = self.month
-        day = self.day + amount
-        year = self.year
-        if day > length:
-            day -= length
-            month = add_zero(int(month)+1)
-        if int(month) > 12:
-            year = add_zero(int(year) + 1)
-            month = add_zero(int(month)-12)
-        return Date(str(year)+"-"+str(month)+"-"+str(add_zero(day)))
+        return Date.from_index(self.index + amount)
 
     def path(self):
         start = self
@@ -170,85 +877,299 @@ class Date:
 
     @staticmethod
     def to_form(date):
-        month = add_zero(date.month)
-        day = add_zero(date.day)
-        year = str(date.year)
-        text = year + "-" + month + "-" + day
-        return Date(text)
+        return Date(date.isoformat())
+
+
+#Scan window from start to end (both included) as an array of day indices
+def scan_window(start, end):
+    return np.arange(start.index, end.index + 1, dtype=np.int64)
+
+
+#Day indices (an array, or a list of Dates) as an array of day indices
+def day_indices(period):
+    if isinstance(period, np.ndarray):
+        return period.astype(np.int64)
+    return np.fromiter((date.index for date in period), dtype=np.int64, count=len(period))
+
+
+#Interned values of a categorical column (listing type, city): each distinct value is kept
+#once and rows hold its integer code
+class Categories:
+    def __init__(self):
+        self.values = []
+        self.codes = dict()
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+#ListingIndex is the store behind the Listing class. The baseline listings are kept as
+#columns in the order they were scraped: ids and titles as lists, type and city as codes
+#into Categories tables, and price, beds, rating and review count as typed arrays where
+#-1 (NaN for rating and coordinates) marks a value the scrape gave as '--'. The arrays grow
+#by doubling
+#Each id is kept once: a listing seen again (map cells share borders) keeps its first row.
+#An id map and a title map point at each listing's row, per-bed queries are array masks,
+#box and radius queries go through a SpatialGrid over the coordinates, and Listing objects
+#are views onto a row
+class ListingIndex:
+    def __init__(self, capacity=1024):
+        self.ids = []
+        self.titles = []
+        self.rows = dict()
+        self.title_rows = dict()
+        self.types = Categories()
+        self.cities = Categories()
+        self.type_codes = np.zeros(capacity, dtype=np.int32)
+        self.city_codes = np.zeros(capacity, dtype=np.int32)
+        self.prices = np.full(capacity, -1, dtype=np.int64)
+        self.beds = np.full(capacity, -1, dtype=np.int32)
+        self.ratings = np.full(capacity, np.nan, dtype=np.float64)
+        self.review_counts = np.full(capacity, -1, dtype=np.int32)
+        self.lats = np.full(capacity, np.nan, dtype=np.float64)
+        self.lngs = np.full(capacity, np.nan, dtype=np.float64)
+        self.grid = SpatialGrid()
+        self.highest_bed_number = 0
+        self.highest_price = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return (Listing.view(self, row) for row in range(0, len(self.ids)))
+
+    def __contains__(self, ident):
+        return ident in self.rows
+
+    def _grow(self):
+        for name in ['type_codes', 'city_codes', 'prices', 'beds', 'ratings', 'review_counts', 'lats', 'lngs']:
+            column = getattr(self, name)
+            grown = np.full(2 * len(column), -1 if column.dtype.kind == 'i' else np.nan, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    #Appends a listing and returns its row. A listing already in the index keeps its row and
+    #values, it only gains coordinates it did not have yet
+    def add(self, listing_id, title, typo, city, price, beds, rating, review_count, lat='--', lng='--'):
+        row = self.rows.get(listing_id)
+        if row is not None:
+            if np.isnan(self.lats[row]):
+                self._locate(row, lat, lng)
+            return row
+        row = len(self.ids)
+        if row >= len(self.prices):
+            self._grow()
+        self.ids.append(listing_id)
+        self.titles.append(title)
+        self.rows[listing_id] = row
+        self.title_rows.setdefault(title, row)
+        self.type_codes[row] = self.types.code(typo)
+        self.city_codes[row] = self.cities.code(city)
+        if type(price) is int:
+            self.prices[row] = price
+            if self.highest_price < price:
+                self.highest_price = price
+        if type(beds) is int:
+            self.beds[row] = beds
+            if self.highest_bed_number < beds:
+                self.highest_bed_number = beds
+        if type(rating) in (int, float):
+            self.ratings[row] = rating
+        if type(review_count) is int:
+            self.review_counts[row] = review_count
+        self._locate(row, lat, lng)
+        return row
+
+    def _locate(self, row, lat, lng):
+        if type(lat) in (int, float) and type(lng) in (int, float):
+            self.lats[row] = lat
+            self.lngs[row] = lng
+            self.grid.add(row, lat, lng)
+
+    #Listings inside a bounding box, edges included
+    def within_box(self, sw_lat, sw_lng, ne_lat, ne_lng):
+        rows = self.grid.rows(sw_lat, sw_lng, ne_lat, ne_lng)
+        lats = self.lats[rows]
+        lngs = self.lngs[rows]
+        rows = rows[(lats >= sw_lat) & (lats <= ne_lat) & (lngs >= sw_lng) & (lngs <= ne_lng)]
+        return [Listing.view(self, row) for row in rows.tolist()]
+
+    #Listings within km kilometres of a point, nearest first
+    def within_radius(self, lat, lng, km):
+        rows = self.grid.rows(*radius_box(lat, lng, km))
+        distances = distance_km(lat, lng, self.lats[rows], self.lngs[rows])
+        inside = distances <= km
+        rows = rows[inside][np.argsort(distances[inside], kind='stable')]
+        return [Listing.view(self, row) for row in rows.tolist()]
+
+    def list_by_bed(self, bed):
+        n = len(self.ids)
+        prices = self.prices[:n][self.beds[:n] == bed]
+        return prices[prices >= 0].tolist()
+
+    def count_by_bed(self, bed):
+        return int(np.count_nonzero(self.beds[:len(self.ids)] == bed))
+
+    def search_by_id(self, ident):
+        row = self.rows.get(ident)
+        if row is None:
+            return None
+        return Listing.view(self, row)
+
+    def search_by_title(self, title):
+        row = self.title_rows.get(title)
+        if row is None:
+            return None
+        return Listing.view(self, row)
+
+
+#Grid spatial index over listing coordinates: the map is cut into square cells of size
+#degrees and each cell keeps the rows of the listings inside it. A query gathers the rows of
+#the cells its box overlaps (the callers then filter them on their exact coordinates); a
+#box spanning more cells than are occupied walks the occupied cells instead
+class SpatialGrid:
+    def __init__(self, size=0.01):
+        self.size = size
+        self.cells = dict()
+
+    def _cell(self, lat, lng):
+        return int(np.floor(lat / self.size)), int(np.floor(lng / self.size))
+
+    def add(self, row, lat, lng):
+        self.cells.setdefault(self._cell(lat, lng), []).append(row)
+
+    #Sorted array of the candidate rows for a bounding box
+    def rows(self, sw_lat, sw_lng, ne_lat, ne_lng):
+        south, west = self._cell(sw_lat, sw_lng)
+        north, east = self._cell(ne_lat, ne_lng)
+        found = []
+        if (north - south + 1) * (east - west + 1) > len(self.cells):
+            for (i, j), rows in self.cells.items():
+                if south <= i <= north and west <= j <= east:
+                    found.extend(rows)
+        else:
+            for i in range(south, north + 1):
+                for j in range(west, east + 1):
+                    found.extend(self.cells.get((i, j), ()))
+        return np.sort(np.asarray(found, dtype=np.intp))
 
 
 #Listing object store information of a particular listings from a non-specific date scrape
 #Represents minimum price for a listing (baseline price)
+#Listings are kept in the ListingIndex of the ScrapeSession they were scraped in, the class
+#methods below take that session (the default session when none is given)
+#A Listing is a slotted view onto its row of the index, values missing from the scrape
+#read back as '--'
 class Listing:
-    _baseline = []
-    all_ids = []
-    highest_bed_number = 0
-    highest_price = 0
+    __slots__ = ('index', 'row')
 
-    def __init__(self, listing_id, title, typo, city, price, beds, rating, review_count):
-        self.id = listing_id
-        Listing.all_ids.append(listing_id)
-        self.typo = typo #type
-        self.city = city
-        self.price = price
-        self.beds = beds
-        self.title = title
-        self.rating = rating
-        self.review_count = review_count
-        Listing._baseline.append(self)
-        if Listing.highest_bed_number < beds:
-            Listing.highest_bed_number = beds
-        if Listing.highest_price < price:
-            Listing.highest_price = price
+    def __init__(self, listing_id, title, typo, city, price, beds, rating, review_count, session=None, lat='--',
+                 lng='--'):
+        self.index = session_for(session).listings
+        self.row = self.index.add(listing_id, title, typo, city, price, beds, rating, review_count, lat, lng)
+
+    @classmethod
+    def view(cls, index, row):
+        listing = cls.__new__(cls)
+        listing.index = index
+        listing.row = row
+        return listing
+
+    @property
+    def id(self):
+        return self.index.ids[self.row]
+
+    @property
+    def title(self):
+        return self.index.titles[self.row]
+
+    @property
+    def typo(self): #type
+        return self.index.types.values[self.index.type_codes[self.row]]
+
+    @property
+    def city(self):
+        return self.index.cities.values[self.index.city_codes[self.row]]
+
+    @property
+    def price(self):
+        return or_dash_int(self.index.prices[self.row])
+
+    @property
+    def beds(self):
+        return or_dash_int(self.index.beds[self.row])
+
+    @property
+    def rating(self):
+        rating = self.index.ratings[self.row]
+        if np.isnan(rating):
+            return '--'
+        return float(rating)
+
+    @property
+    def review_count(self):
+        return or_dash_int(self.index.review_counts[self.row])
+
+    @property
+    def lat(self):
+        return or_dash_float(self.index.lats[self.row])
+
+    @property
+    def lng(self):
+        return or_dash_float(self.index.lngs[self.row])
 
     def out(self):
         return self.id, self.title, self.typo, self.city, self.price, self.beds, self.rating, self.review_count
 
     @classmethod
-    def list_by_bed(cls, bed):
-        temp_list = []
-        scan = cls._baseline
-        for listing in scan:
-            if listing.beds == bed:
-                temp_list.append(listing.price)
-        return temp_list
+    def list_by_bed(cls, bed, session=None):
+        return session_for(session).listings.list_by_bed(bed)
+
+    @classmethod
+    def count_by_bed(cls, bed, session=None):
+        return session_for(session).listings.count_by_bed(bed)
 
     @classmethod
-    def count_by_bed(cls, bed):
-        count = 0
-        scan = cls._baseline
-        for listing in scan:
-            if listing.beds == bed:
-                count += 1
-        return count
+    def search_by_id(cls, ident, session=None):
+        return session_for(session).listings.search_by_id(ident)
 
     @classmethod
-    def search_by_id(cls, ident):
-        for item in Listing._baseline:
-            if item.id == ident:
-                return item
+    def search_by_title(cls, title, session=None):
+        return session_for(session).listings.search_by_title(title)
 
     @classmethod
-    def search_by_title(cls, title):
-        for item in Listing._baseline:
-            if item.title == title:
-                return item
+    def within_box(cls, sw_lat, sw_lng, ne_lat, ne_lng, session=None):
+        return session_for(session).listings.within_box(sw_lat, sw_lng, ne_lat, ne_lng)
+
+    @classmethod
+    def within_radius(cls, lat, lng, km, session=None):
+        return session_for(session).listings.within_radius(lat, lng, km)
     
     
     #This method sifts through the html code to gather the data for a specific listing
-    #via the Xpath to the data values 
+    #via the Xpath to the data values (coordinates from the card's geo meta tags, when present)
     #The reason the code no longer works is because as Airbnb updates their website, these
     #Xpaths change and have to be updated
+    #Price, beds and the fallback review count come from the page's CardFields (fields, with
+    #row the card's position on the page); a lone card is read on its own
     @staticmethod
-    def listing_process(item):
+    def listing_process(item, fields=None, row=0):
         unit_info = {'id': '--', 'name': '--', 'typo': '--', 'city': '--', 'price': '--', 'beds': '--', 'rating': '--',
-                     'review_count': '--', 'error': 0}
-        try:
-            name_type_city = item.xpath('meta[@itemprop="name"]/@content')[0].split(" - ")
-        except IndexError:
+                     'review_count': '--', 'lat': '--', 'lng': '--', 'error': 0}
+        name, lat, lng = card_meta(item)
+        if name is None:
             print('Listing Error - IndexError: 1')
-            return [1, 0, 0, 0, 0, 0, 0, 0]
+            return CARD_ERROR
         else:
+            name_type_city = name.split(" - ")
             if len(name_type_city) == 3:
                 name = name_type_city[0]
             elif len(name_type_city) > 3:
@@ -264,140 +1185,133 @@ class Listing:
             else:
                 print('Listing Error - NameError')
                 unit_info['error'] = 1
-                return [1, 0, 0, 0, 0, 0, 0, 0]
+                return CARD_ERROR
             typo = name_type_city[-2]
             city = name_type_city[-1]
             unit_info['name'] = name
             unit_info['typo'] = typo
             unit_info['city'] = city
-        try:
-            listing_card = item.xpath('div[@class="listingCardWrapper_9kg52c"]/div[@class="listingContainer_'
-                                      'f21qs6"]')[0]
-        except IndexError:
+        if fields is None:
+            fields = CardFields([item])
+            row = 0
+        card = fields.cards[row]
+        if card is None:
             print('Listing Error - IndexError: 2')
             print(item)
             unit_info['error'] = 1
-            return [1, 0, 0, 0, 0, 0, 0, 0]
-        except AttributeError:
-            print('AttributeError - this was passed', item)
-            return [1, 0, 0, 0, 0, 0, 0, 0]
-        else:
-            listing_id = listing_card.xpath('@id')[0][8:]
-            unit_info['id'] = listing_id
-            info_container = listing_card.xpath('div[@class="infoContainer_v72lrv"]')[0]
-            raw = info_container.xpath('descendant::text()')
+            return CARD_ERROR
+        listing_card, raw = card
+        unit_info['id'] = listing_card.get('id')[8:]
+        if lat is not None and lng is not None:
+            unit_info['lat'] = coordinate(lat)
+            unit_info['lng'] = coordinate(lng)
 
         try:
-            rating_container = info_container.xpath('descendant::div[@class="ratingContainer_inline_36rlri"]')[0]
-            rating_text = rating_container.xpath('descendant::span[@role="img"]/@aria-label')[0]
+            rating_text = RATING_LABEL(listing_card)[0]
             rating_texts = rating_text.split(" ")
             rating = float(rating_texts[1])
-            review_count = int(rating_container.xpath(
-                'descendant::span[@class="text_5mbkop-o_O-size_micro_16wifzf-o_O-inline_g86r3e"]/text()')[0])
+            review_count = int(REVIEW_COUNT(listing_card)[0])
             unit_info['rating'] = rating
             unit_info['review_count'] = review_count
         except IndexError:
             unit_info['error'] = 1
-            for bit in raw:
-                if ' review' in bit:
-                    stop = bit.find(' review')
-                    if bit[:stop].isdigit():
-                        num = int(bit[:stop])
-                        unit_info['review_count'] = num
-                        unit_info['error'] = 0
-        for bit in raw:
-            if bit[0] == '$' and (bit[1:].isdigit() or or_comma(bit[1:])):
-                price = big_int(bit[1:])
-                unit_info['price'] = price
-            elif (bit[-4:] == ' bed' or bit[-5:] == ' beds') and (bit[:-4].isdigit() or bit[:-5].isdigit()):
-                stop = bit.find(' bed')
-                beds = big_int(bit[:stop])
-                unit_info['beds'] = beds
+            if fields.reviews[row] >= 0:
+                unit_info['review_count'] = int(fields.reviews[row])
+                unit_info['error'] = 0
+        if fields.price[row] >= 0:
+            unit_info['price'] = int(fields.price[row])
+        if fields.beds[row] >= 0:
+            unit_info['beds'] = int(fields.beds[row])
         if unit_info['price'] == '--' or unit_info['beds'] == '--':
             print(raw)
         return unit_info
     
     
-    #This method iterates over a page, and calls the listing_process method on
-    #each listing on each page
+    #This method iterates over the parsed records of a page (see parse_page) and adds each
+    #readable listing to the baseline once the page is accepted, so a rejected page leaves the
+    #baseline as it was for its retry
+    #Returns [readable cards, total price, new listings]: a listing already in the baseline (seen
+    #in a neighbouring cell or on an earlier page) counts as readable but adds no price or unit,
+    #a listing without a price adds a unit but no price
     @staticmethod
-    def baseline_processor(listings):
-        page_total = len(listings)
-        page_counter = 0
+    def baseline_processor(records, session=None):
+        session = session_for(session)
+        page_total = len(records)
         total_prices = 0
-        page_units = []
-        errors = 0
-        for item in range(0, len(listings)):
-            if type(listings[item]) is str:
-                print(listings)
-            unit_info = Listing.listing_process(listings[item])
-            if unit_info == [1, 0, 0, 0, 0, 0, 0, 0]:
-                errors += 1
-            if not unit_info == [1, 0, 0, 0, 0, 0, 0, 0]:
-                listing_id = unit_info['id']
-                name = unit_info['name']
-                typo = unit_info['typo']
-                city = unit_info['city']
-                price = unit_info['price']
-                beds = unit_info['beds']
-                rating = unit_info['rating']
-                review_count = unit_info['review_count']
-                errors += unit_info['error']
-                total_prices += price
-                temp = Listing(listing_id, name, typo, city, price, beds, rating, review_count)
-                page_units.append(temp)
-                page_counter += 1
+        fresh = 0
+        page_units = [unit_info for unit_info in records if unit_info != CARD_ERROR]
+        page_counter = len(page_units)
+        session.metrics.inc('air_cards_total', page_counter, stage='baseline', result='accepted')
+        session.metrics.inc('air_cards_total', page_total - page_counter, stage='baseline', result='rejected')
         if page_counter/page_total <= 0.8:
-            for item in page_units:
-                del item
+            session.metrics.inc('air_pages_rejected_total', stage='baseline')
             print('--retrying query--')
             return [0, 0]
-        else:
-            return [page_counter, total_prices]
-        
-        
+        for unit_info in page_units:
+            listing_id = unit_info['id']
+            price = unit_info['price']
+            if listing_id not in session.listings:
+                if type(price) is int:
+                    total_prices += price
+                fresh += 1
+            Listing(listing_id, unit_info['name'], unit_info['typo'], unit_info['city'], price, unit_info['beds'],
+                    unit_info['rating'], unit_info['review_count'], session, unit_info['lat'], unit_info['lng'])
+        return [page_counter, total_prices, fresh]
+
+
     #This method iterates over the pages in a query, and calls the baseline_processor method
     #on each page
+    #prefetched holds the already parsed records of each page, None entries are fetched here
     @staticmethod
-    def pages_iterate(pages, search, path):
+    def pages_iterate(pages, search, path, prefetched=None, session=None):
+        session = session_for(session)
         search_sample = 0
         search_total = 0
         search_on = search.query()
+        urls = page_urls(search_on, path, pages)
+        if prefetched is None:
+            prefetched = fetch_records(urls, mode=session.extract_mode, metrics=session.metrics)
         for x in range(0, pages):
+            if x in search.done_pages:
+                continue
             print('Page: ' + str(x + 1), "/", str(pages))
             print(search.query())
-            i = 0
-            z = 0
+            attempt = 0
+            rejected = 0
             while True:
-                if x == 0:
-                    tree = grab(search_on)
+                if prefetched[x] is not None:
+                    listings = prefetched[x]
+                    prefetched[x] = None
                 else:
-                    tree = grab(search_on + path + str(x))
-                listings = tree.xpath('//div[@itemprop="itemListElement"]')
+                    listings = retry_records(urls[x], False, session)
                 if len(listings) == 0:
-                    i += 1
-                    if i == 3:
-                        print("N/A")
-                        break
-                    else:
+                    session.retry.failure()
+                    attempt += 1
+                    if session.retry.wait(attempt, 'baseline'):
                         continue
+                    print("N/A")
+                    break
                 else:
-                    if type(listings) is list:
-                        base_on = Listing.baseline_processor(listings)
-                    else:
-                        continue
+                    session.retry.success()
+                    base_on = Listing.baseline_processor(listings, session)
                     if base_on == [0, 0]:
-                        z += 1
-                        if z == 2:
-                            break
-                        continue
+                        rejected += 1
+                        attempt += 1
+                        if rejected < 2 and session.retry.wait(attempt, 'baseline'):
+                            continue
+                        break
                     else:
                         page_counter = base_on[0]
                         search_total += page_counter
                         search_sample += len(listings)
                         total_prices = base_on[1]
-                        search.add_units(page_counter)
+                        search.add_units(base_on[2])
                         search.add_price(total_prices)
+                        ids = [unit_info['id'] for unit_info in listings if unit_info != CARD_ERROR]
+                        search.ids.extend(ids)
+                        if session.checkpoint is not None:
+                            session.checkpoint.baseline_page(search, x, ids, base_on[2], len(listings), total_prices,
+                                                             page_counter)
                         print(str(page_counter) + "/" + str(len(listings)) + "\n")
                         break
         return [search_total, search_sample]
@@ -407,33 +1321,44 @@ class Listing:
     #all listings in a given area
     #Output is accuracy metrics
     @staticmethod
-    def baseline(path, searches):
+    def baseline(path, searches, session=None):
+        session = session_for(session)
         total_sample_total = 0
         total_total = 0
         search_num = 1
-        for search_on in searches:
-            print('Search: ' + str(search_num) + '/' + str(len(searches)))
-            search_num += 1
-            pages = get_pages(search_on.query())
-            if pages >= 18:
-                print('Baseline- ALERT: Listings missed - Search span included more than 18 pages')
-            elif pages == 0:
-                pages += 1
-            totals = Listing.pages_iterate(pages, search_on, path)
-            total = totals[0]
-            sample_total = totals[1]
-            if not sample_total == 0:
-                total_total += total
-                accuracy = 100 * total / sample_total
-                global total_accuracy
-                total_accuracy += accuracy
-                global accuracy_count
-                accuracy_count += 1
-                total_sample_total += sample_total
-                print('Sample of ' + str(total) + '/' + str(sample_total) + ' listings ('
-                      + format(accuracy, '.2f') + '% accuracy)\n')
-            else:
-                print('Search provided no results.\n')
+        probes = fetcher.map(lambda search_on: search_probe(search_on, session.extract_mode, session.metrics,
+                                                            session.retry), searches)
+        for search_on, probe in zip(searches, probes):
+            search_on.pages = probe[0]
+        all_pages = page_spans([probe[0] for probe in probes], 'Baseline')
+        queries = [search_on.query() for search_on in searches]
+        staged = pipeline_pages(queries, path, all_pages, mode=session.extract_mode, metrics=session.metrics,
+                                first=[probe[1] for probe in probes],
+                                skip=[search_on.done_pages for search_on in searches])
+        with contextlib.closing(staged):
+            for search_on, pages, prefetched in zip(searches, all_pages, staged):
+                print('Search: ' + str(search_num) + '/' + str(len(searches)))
+                search_num += 1
+                totals = Listing.pages_iterate(pages, search_on, path, prefetched, session)
+                total = totals[0]
+                sample_total = totals[1]
+                search_on.sample += sample_total
+                search_on.readable += total
+                search_on.scraped = datetime.datetime.now().isoformat()
+                if session.checkpoint is not None:
+                    session.checkpoint.cell_done(search_on)
+                cell = 'cell ' + str(search_num - 1)
+                session.metrics.set('air_coverage_listings', total, stage='baseline', unit=cell)
+                session.metrics.set('air_coverage_sample', sample_total, stage='baseline', unit=cell)
+                if not sample_total == 0:
+                    total_total += total
+                    accuracy = 100 * total / sample_total
+                    session.metrics.observe('air_accuracy_percent', accuracy, Metrics.PERCENT, stage='baseline')
+                    total_sample_total += sample_total
+                    print('Sample of ' + str(total) + '/' + str(sample_total) + ' listings ('
+                          + format(accuracy, '.2f') + '% accuracy)\n')
+                else:
+                    print('Search provided no results.\n')
         if total_sample_total != 0:
             print('Sample of ' + str(total_total) + '/' + str(total_sample_total) + ' listings (' + format(
                 100 * total_total / total_sample_total,
@@ -442,20 +1367,362 @@ class Listing:
 
 
 
+#VacancyStore backs the ListingOnline class with a listing x day layout. Rows are integer
+#listing offsets (in the order listings were first seen vacant) and columns are integer day
+#offsets from origin, the day index of column 0, so a Date maps to its column by subtraction.
+#vacant is a boolean matrix and prices is a float matrix that holds NaN wherever no price
+#was seen. Both grow by doubling so long windows stay cheap
+class VacancyStore:
+    def __init__(self, capacity=1024, days=32):
+        self.ids = []
+        self.rows = dict()
+        self.origin = None
+        self.n_days = 0
+        self.beds = np.full(capacity, -1, dtype=np.int32)
+        self.vacant = np.zeros((capacity, days), dtype=bool)
+        self.prices = np.full((capacity, days), np.nan, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    #Reallocates to rows x cols, moving the existing days shift columns to the right
+    def _resize(self, rows, cols, shift=0):
+        old_rows, old_cols = self.vacant.shape
+        vacant = np.zeros((rows, cols), dtype=bool)
+        prices = np.full((rows, cols), np.nan, dtype=np.float32)
+        beds = np.full(rows, -1, dtype=np.int32)
+        vacant[:old_rows, shift:shift + old_cols] = self.vacant
+        prices[:old_rows, shift:shift + old_cols] = self.prices
+        beds[:old_rows] = self.beds
+        self.vacant = vacant
+        self.prices = prices
+        self.beds = beds
+
+    def set_period(self, period):
+        days = day_indices(period)
+        if len(days) > 0:
+            self.day_column(int(days.min()))
+            self.day_column(int(days.max()))
+
+    def day_column(self, day, create=True):
+        if self.origin is None:
+            if not create:
+                return None
+            self.origin = day
+        col = day - self.origin
+        if col < 0:
+            if not create:
+                return None
+            shift = -col
+            self._resize(self.vacant.shape[0], max(self.vacant.shape[1], self.n_days + shift) * 2, shift)
+            self.origin = day
+            self.n_days += shift
+            col = 0
+        elif col >= self.n_days:
+            if not create:
+                return None
+            self.n_days = col + 1
+            if col >= self.vacant.shape[1]:
+                self._resize(self.vacant.shape[0], max(2 * self.vacant.shape[1], col + 1))
+        return col
+
+    def column(self, date, create=True):
+        return self.day_column(date.index, create)
+
+    #Date strings of the columns (all columns when cols is None)
+    def day_labels(self, cols=None):
+        if cols is None:
+            cols = np.arange(self.n_days)
+        if self.origin is None:
+            return []
+        return np.datetime_as_string(np.datetime64(self.origin, 'D') + cols, unit='D').tolist()
+
+    def row(self, listing_id, beds):
+        row = self.rows.get(listing_id)
+        if row is None:
+            row = len(self.ids)
+            self.ids.append(listing_id)
+            self.rows[listing_id] = row
+            if row >= self.vacant.shape[0]:
+                self._resize(2 * self.vacant.shape[0], self.vacant.shape[1])
+            if type(beds) is int:
+                self.beds[row] = beds
+        return row
+
+    def mark(self, listing_id, beds, date, price):
+        row = self.row(listing_id, beds)
+        col = self.column(date)
+        self.vacant[row, col] = True
+        if type(price) is int:
+            self.prices[row, col] = price
+
+    def vacant_dates(self, listing_id):
+        out = dict()
+        row = self.rows.get(listing_id)
+        if row is None:
+            return out
+        cols = np.flatnonzero(self.vacant[row, :self.n_days])
+        for col, day in zip(cols, self.day_labels(cols)):
+            price = self.prices[row, col]
+            out[day] = None if np.isnan(price) else int(price)
+        return out
+
+    #Column of every day in period (all columns when period is None)
+    def _cols(self, period):
+        if period is None:
+            return np.arange(self.n_days)
+        self.set_period(period)
+        return (day_indices(period) - self.origin).astype(np.intp)
+
+    #Number of vacant days for every listing row over the given days
+    def vacant_counts(self, period=None):
+        n = len(self.ids)
+        return self.vacant[:n][:, self._cols(period)].sum(axis=1)
+
+    #Vacant counts for every bed count over the given days, in one sorted reduction
+    #Returns a dict of bed count -> array of counts (one per day)
+    def counts_by_bed(self, period=None):
+        n = len(self.ids)
+        cols = self._cols(period)
+        if n == 0:
+            return dict()
+        beds = self.beds[:n]
+        order = np.argsort(beds, kind='stable')
+        bed_values, starts = np.unique(beds[order], return_index=True)
+        vacant = self.vacant[order][:, cols].astype(np.int32)
+        sums = np.add.reduceat(vacant, starts, axis=0)
+        return dict((int(bed), sums[i]) for i, bed in enumerate(bed_values))
+
+    def _bed_day(self, bed, date):
+        col = self.column(date, create=False)
+        if col is None:
+            return None
+        n = len(self.ids)
+        return col, self.vacant[:n, col] & (self.beds[:n] == bed)
+
+    def count_by_bed_by_date(self, bed, date):
+        found = self._bed_day(bed, date)
+        if found is None:
+            return 0
+        return int(np.count_nonzero(found[1]))
+
+    def list_by_bed_by_date(self, bed, date):
+        found = self._bed_day(bed, date)
+        if found is None:
+            return []
+        col, mask = found
+        prices = self.prices[:len(self.ids), col][mask]
+        return prices[~np.isnan(prices)].astype(int).tolist()
+
+
+#DemandReport holds the demand analytics of a scan window, computed in one pass over the
+#listing x day slice of a VacancyStore. Rows are grouped by bed count once, then for every
+#day of the period it keeps:
+#  vacant_by_bed / vacancy_rate - vacant listings per bed count (rate over the bed count's
+#      listings in the baseline index when one is given, else over the store's rows)
+#  total, baseline, spread, z - vacant listings overall, their centred rolling mean and
+#      standard deviation over `window` days and the z-score against it. Demand is high
+#      where vacancy is low, so spikes are the days at or below -z_threshold
+#  minima - days where total vacancy is a strict local minimum
+#  quantiles - nightly price quantiles over all vacant listings, and per bed count
+#Charts and reports read these arrays instead of querying the store again
+class DemandReport:
+    QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+    def __init__(self, store, period, listings=None, window=7, z_threshold=1.5, quantiles=QUANTILES):
+        self.dates = list(period)
+        self.labels = [date_on.out() for date_on in self.dates]
+        self.columns = dict((date_on, i) for i, date_on in enumerate(self.dates))
+        self.window = window
+        self.z_threshold = z_threshold
+        self.quantile_levels = np.asarray(quantiles, dtype=float)
+        n = len(store)
+        days = len(self.dates)
+        cols = store._cols(period)
+        beds = store.beds[:n]
+        order = np.argsort(beds, kind='stable')
+        self.bed_values, self.starts, rows = np.unique(beds[order], return_index=True, return_counts=True)
+        self.ends = self.starts + rows
+        self.vacant = store.vacant[order][:, cols]
+        self.prices = store.prices[order][:, cols]
+        if n > 0:
+            self.vacant_by_bed = np.add.reduceat(self.vacant.astype(np.int32), self.starts, axis=0)
+        else:
+            self.vacant_by_bed = np.zeros((0, days), dtype=np.int32)
+        listed = rows
+        if listings is not None:
+            listed = np.maximum(rows, [listings.count_by_bed(int(bed)) for bed in self.bed_values])
+        self.vacancy_rate = self.vacant_by_bed / np.maximum(listed, 1)[:, None]
+        self.total = self.vacant_by_bed.sum(axis=0)
+        self._rolling()
+        self.spikes = np.flatnonzero(self.z <= -z_threshold)
+        inner = self.total[1:-1]
+        self.minima = np.flatnonzero((inner < self.total[:-2]) & (inner < self.total[2:])) + 1
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.quantiles = np.nanquantile(self.prices, self.quantile_levels, axis=0) if n > 0 else \
+                np.full((len(self.quantile_levels), days), np.nan)
+            self.bed_quantiles = dict((int(bed), np.nanquantile(self.prices[start:end], self.quantile_levels, axis=0))
+                                      for bed, start, end in zip(self.bed_values, self.starts, self.ends))
+
+    #Centred rolling mean / standard deviation of total vacancy (window shrinks to fit the
+    #period, the edges repeat the first and last day) and the z-score of each day against it
+    def _rolling(self):
+        days = len(self.total)
+        width = max(1, min(self.window, days))
+        if days == 0:
+            self.baseline = self.spread = self.z = np.zeros(0)
+            return
+        padded = np.pad(self.total.astype(float), (width // 2, width - 1 - width // 2), mode='edge')
+        frames = np.lib.stride_tricks.sliding_window_view(padded, width)
+        self.baseline = frames.mean(axis=1)
+        self.spread = frames.std(axis=1)
+        self.z = np.divide(self.total - self.baseline, self.spread, out=np.zeros(days), where=self.spread > 0)
+
+    def _bed_row(self, bed):
+        found = np.flatnonzero(self.bed_values == bed)
+        if len(found) == 0:
+            return None
+        return int(found[0])
+
+    def vacant_count(self, bed, date_on):
+        row = self._bed_row(bed)
+        if row is None or date_on not in self.columns:
+            return 0
+        return int(self.vacant_by_bed[row, self.columns[date_on]])
+
+    #Nightly prices of the vacant listings with a bed count on a day, one slice of the
+    #grouped price matrix
+    def bed_prices(self, bed, date_on):
+        row = self._bed_row(bed)
+        if row is None or date_on not in self.columns:
+            return []
+        prices = self.prices[self.starts[row]:self.ends[row], self.columns[date_on]]
+        return prices[~np.isnan(prices)].astype(int).tolist()
+
+    def minima_dates(self):
+        return [self.dates[i] for i in self.minima]
+
+    def spike_dates(self):
+        return [self.dates[i] for i in self.spikes]
+
+    #One row per day: total vacancy and its rolling baseline and z-score, vacancy rate per bed
+    #count and the overall price quantiles
+    def frame(self):
+        frame = pd.DataFrame({'Vacant': self.total, 'Baseline': self.baseline.round(2), 'Z': self.z.round(2),
+                              'Spike': self.z <= -self.z_threshold}, index=pd.Index(self.labels, name='Night'))
+        for i, bed in enumerate(self.bed_values):
+            if bed >= 0:
+                frame[str(bed) + ' Bed Vacancy'] = self.vacancy_rate[i].round(3)
+        for level, row in zip(self.quantile_levels, self.quantiles):
+            frame['Price P' + str(int(round(100 * level)))] = row
+        return frame
+
+
+#DensityEngine draws the price density curves of the run_a_date charts
+#Each (date, bed count) group of prices is linearly binned onto its date's grid (each price
+#split between its two neighbouring grid points) and smoothed with a Gaussian kernel by FFT
+#convolution, all groups of a batch in one bincount and one rfft/irfft. Cost is
+#O(n + points log points) per group instead of O(n x points) for an exact KDE
+#bandwidth is 'scott', 'silverman' (rules of thumb on each group's standard deviation, as
+#scipy's gaussian_kde) or a fixed width in dollars. Curves are cached per (market, date)
+class DensityEngine:
+    BANDWIDTHS = ('scott', 'silverman')
+
+    def __init__(self, points=512, bandwidth='scott', min_count=4):
+        if isinstance(bandwidth, str) and bandwidth not in DensityEngine.BANDWIDTHS:
+            raise ValueError('Unknown bandwidth: ' + str(bandwidth))
+        self.points = points
+        self.bandwidth = bandwidth
+        self.min_count = min_count
+        self.cache = dict()
+
+    def width(self, values):
+        if not isinstance(self.bandwidth, str):
+            return float(self.bandwidth)
+        n = len(values)
+        std = values.std(ddof=1) if n > 1 else 0.0
+        if self.bandwidth == 'scott':
+            width = std * n ** -0.2
+        else:
+            width = std * (n * 3 / 4) ** -0.2
+        if width > 0:
+            return width
+        return 1.0
+
+    #Density of every group on its own grid, groups is a list of (prices, lo, hi) and the
+    #result a (groups x points) array
+    def _smooth(self, groups):
+        m = self.points
+        g = len(groups)
+        counts = np.zeros(g * m)
+        lo = np.array([group[1] for group in groups])
+        delta = np.array([(group[2] - group[1]) / (m - 1) for group in groups])
+        widths = np.array([self.width(group[0]) for group in groups])
+        sizes = np.array([len(group[0]) for group in groups])
+        values = np.concatenate([group[0] for group in groups])
+        owner = np.repeat(np.arange(g), sizes)
+        position = (values - lo[owner]) / delta[owner]
+        left = np.clip(np.floor(position).astype(np.int64), 0, m - 2)
+        right_share = np.clip(position - left, 0, 1)
+        flat = owner * m + left
+        counts += np.bincount(flat, 1 - right_share, minlength=g * m)
+        counts += np.bincount(flat + 1, right_share, minlength=g * m)
+        counts = counts.reshape(g, m)
+        length = 2 * m
+        freqs = np.fft.rfftfreq(length)
+        kernel = np.exp(-0.5 * (2 * np.pi * freqs[None, :] * (widths / delta)[:, None]) ** 2)
+        smooth = np.fft.irfft(np.fft.rfft(counts, length, axis=1) * kernel, length, axis=1)[:, :m]
+        return np.maximum(smooth, 0) / (sizes * delta)[:, None]
+
+    #Curves for the given dates (cached ones are not computed again), returns a dict of
+    #date -> list of (bed count, x, y) with x and y as lists
+    def curves(self, market, report, dates, beds):
+        todo = [date_on for date_on in dates if (market, date_on.out()) not in self.cache]
+        groups = []
+        keys = []
+        for date_on in todo:
+            prices = [(bed, np.asarray(report.bed_prices(bed, date_on), dtype=np.float64)) for bed in beds]
+            prices = [(bed, values) for bed, values in prices if len(values) >= self.min_count]
+            self.cache[(market, date_on.out())] = []
+            if len(prices) == 0:
+                continue
+            pad = 3 * max(self.width(values) for bed, values in prices)
+            lo = min(values.min() for bed, values in prices) - pad
+            hi = max(values.max() for bed, values in prices) + pad
+            for bed, values in prices:
+                groups.append((values, lo, hi))
+                keys.append((date_on, bed))
+        if len(groups) > 0:
+            density = self._smooth(groups)
+            for (date_on, bed), group, y in zip(keys, groups, density):
+                x = np.linspace(group[1], group[2], self.points)
+                self.cache[(market, date_on.out())].append((bed, x.round(2).tolist(), y.tolist()))
+        return dict((date_on, self.cache[(market, date_on.out())]) for date_on in dates)
+
+
 #The ListingOnline class is almost exactly the same as the Listing class, however it represents
 #a listing that is posted on a specific night
 #'Online' terminology refers to being online on a specific night
+#Vacancy and nightly prices live in the VacancyStore of the session, not on the object
 class ListingOnline:
-    in_the_month = []
-    all_pulled = []
-
-    def __init__(self, listing_id, date, price):
+    def __init__(self, listing_id, date, price, session=None):
+        session = session_for(session)
         self.id = listing_id
-        ListingOnline.in_the_month.append(listing_id)
-        self.vacant_dates = dict()
-        self.vacant_dates[date.out()] = price
-        self.info = Listing.search_by_id(listing_id)
-        ListingOnline.all_pulled.append(self)
+        self.store = session.online
+        self.info = Listing.search_by_id(listing_id, session)
+        self.store.mark(listing_id, self.beds(), date, price)
+        session.all_pulled.append(self)
+        session.pulled_by_id.setdefault(listing_id, self)
+
+    def beds(self):
+        if self.info is None:
+            return None
+        return self.info.beds
+
+    @property
+    def vacant_dates(self):
+        return self.store.vacant_dates(self.id)
 
     def out(self):
         info = self.info.out()
@@ -463,193 +1730,825 @@ class ListingOnline:
         return info, out
 
     @classmethod
-    def search_by_id(cls, listing_id):
-        for item in ListingOnline.all_pulled:
-            if item.id == listing_id:
-                return item
+    def search_by_id(cls, listing_id, session=None):
+        return session_for(session).pulled_by_id.get(listing_id)
 
     @classmethod
-    def list_by_bed_by_date(cls, bed, date):
-        temp_list = []
-        for listing in cls.all_pulled:
-            if listing.info.beds == bed and date.out() in Date.list_out(listing.vacant_dates):
-                temp_list.append(listing.vacant_dates[date.out()])
-        return temp_list
+    def list_by_bed_by_date(cls, bed, date, session=None):
+        return session_for(session).online.list_by_bed_by_date(bed, date)
 
     @classmethod
-    def count_by_bed_by_date(cls, bed, date):
-        count = 0
-        for listing in cls.all_pulled:
-            if listing.info.beds == bed and date.out() in Date.list_out(listing.vacant_dates):
-                count += 1
-        return count
+    def count_by_bed_by_date(cls, bed, date, session=None):
+        return session_for(session).online.count_by_bed_by_date(bed, date)
 
     @staticmethod
-    def vacant_date(listing_id, date, price):
-        listing = ListingOnline.search_by_id(listing_id)
-        listing.vacant_dates[date.out()] = price
+    def vacant_date(listing_id, date, price, session=None):
+        listing = ListingOnline.search_by_id(listing_id, session)
+        listing.store.mark(listing_id, listing.beds(), date, price)
 
+    #Reads the id and nightly price from a listing card, along with the full listing record
+    #(see Listing.listing_process) for listings that are not in the baseline yet: known holds the
+    #baseline ids, whose cards only give their id and price (their listing stays CARD_ERROR)
     @staticmethod
-    def date_price_process(item):
-        unit_info = {'id': '--', 'price': '--'}
-        try:
-            listing_card = item.xpath('div[@class="listingCardWrapper_9kg52c"]/div[@class="listingContainer_'
-                                      'f21qs6"]')[0]
-        except IndexError:
+    def date_price_process(item, fields=None, row=0, known=()):
+        unit_info = {'id': '--', 'price': '--', 'listing': CARD_ERROR}
+        if fields is None:
+            fields = CardFields([item])
+            row = 0
+        card = fields.cards[row]
+        if card is None:
             print('IndexError - Listing card')
             return [0, 0]
-        else:
-            listing_id = listing_card.xpath('@id')[0][8:]
-            unit_info['id'] = listing_id
-            info_container = listing_card.xpath('div[@class="infoContainer_v72lrv"]')[0]
-            raw = info_container.xpath('descendant::text()')
-            for bit in raw:
-                if bit[0] == '$' and (bit[1:].isdigit() or or_comma(bit[1:])):
-                    price = big_int(bit[1:])
-                    unit_info['price'] = price
-                    break
-            if unit_info['price'] == '--':
-                print(listing_id, raw)
-                return [0, 0]
-            else:
-                if listing_id in Listing.all_ids:
-                    return unit_info
-                else:
-                    unit_info = Listing.listing_process(item)
-                    if not unit_info == [1, 0, 0, 0, 0, 0, 0, 0]:
-                        listing_id = unit_info['id']
-                        name = unit_info['name']
-                        typo = unit_info['typo']
-                        city = unit_info['city']
-                        price = unit_info['price']
-                        beds = unit_info['beds']
-                        rating = unit_info['rating']
-                        review_count = unit_info['review_count']
-                        Listing(listing_id, name, typo, city, price, beds, rating, review_count)
-                    else:
-                        print('ListingOnline - Error')
-                        return [0, 0]
-                    return unit_info
+        listing_id = card[0].get('id')[8:]
+        unit_info['id'] = listing_id
+        if fields.first_price[row] < 0:
+            print(listing_id, card[1])
+            return [0, 0]
+        unit_info['price'] = int(fields.first_price[row])
+        if listing_id not in known:
+            unit_info['listing'] = Listing.listing_process(item, fields, row)
+        return unit_info
+
+    #Adds a listing that was first seen on a specific night to the baseline
+    #Returns False when its listing card could not be read
+    @staticmethod
+    def baseline_add(unit_info, session=None):
+        session = session_for(session)
+        if unit_info['id'] in session.listings:
+            return True
+        listing_info = unit_info['listing']
+        if listing_info == CARD_ERROR:
+            print('ListingOnline - Error')
+            return False
+        Listing(listing_info['id'], listing_info['name'], listing_info['typo'], listing_info['city'],
+                listing_info['price'], listing_info['beds'], listing_info['rating'], listing_info['review_count'],
+                session, listing_info['lat'], listing_info['lng'])
+        return True
 
+    #Iterates over the parsed records of a page (see parse_page) for a specific night
     @staticmethod
-    def page_processor(listings, date_on):
+    def page_processor(listings, date_on, session=None):
+        session = session_for(session)
         page_counter = 0
-        for item in listings:
-            unit_info = ListingOnline.date_price_process(item)
-            if not unit_info == [0, 0]:
+        rejected = 0
+        for unit_info in listings:
+            if not unit_info == [0, 0] and ListingOnline.baseline_add(unit_info, session):
                 listing_id = unit_info['id']
                 price = unit_info['price']
-                if listing_id in ListingOnline.in_the_month:
-                    ListingOnline.vacant_date(listing_id, date_on, price)
+                if listing_id in session.pulled_by_id:
+                    ListingOnline.vacant_date(listing_id, date_on, price, session)
                 else:
-                    ListingOnline(listing_id, date_on, price)
+                    ListingOnline(listing_id, date_on, price, session)
                 page_counter += 1
+            else:
+                rejected += 1
+        session.metrics.inc('air_cards_total', page_counter, stage='online', result='accepted')
+        session.metrics.inc('air_cards_total', rejected, stage='online', result='rejected')
         if page_counter == 0 and len(listings) != 0:
+            session.metrics.inc('air_pages_rejected_total', stage='online')
             print('Page Error')
             return int(-5)
         return page_counter
 
+    #prefetched holds the already parsed records of each page, None entries are fetched here
     @staticmethod
-    def online_pages_iterate(date_on, pages, path):
+    def online_pages_iterate(url, date_on, pages, path, prefetched=None, session=None):
+        session = session_for(session)
         total = 0
         sample_total = 0
+        done = session.done_pages.get(date_on.out(), ())
+        urls = page_urls(url + Date.path(date_on), path, pages)
+        if prefetched is None:
+            prefetched = fetch_records(urls, online=True, mode=session.extract_mode, metrics=session.metrics,
+                                       known=session.listings)
         for x in range(0, pages):
-            z = 0
-            y = 0
+            if x in done:
+                continue
+            print('Page: ' + str(x + 1), '/', str(pages))
+            attempt = 0
+            rejected = 0
             while True:
-                if y == 3:
-                    break
-                elif z == 3:
-                    print('!!Page Error!!')
+                if prefetched[x] is not None:
+                    listings = prefetched[x]
+                    prefetched[x] = None
+                else:
+                    listings = retry_records(urls[x], True, session)
+                print(urls[x])
+                if len(listings) == 0:
+                    session.retry.failure()
+                    attempt += 1
+                    if session.retry.wait(attempt, 'online'):
+                        print('--retrying--', str(attempt))
+                        continue
+                    print('--Page Error--')
                     break
-                print('Page: ' + str(x + 1), '/', str(pages))
-                i = 0
-                y = 0
-                while True:
-                    if x == 0:
-                        tree = grab(url + Date.path(date_on))
-                        print(url + Date.path(date_on))
-                    else:
-                        tree = grab(url + Date.path(date_on) + path + str(x))
-                        print(url + Date.path(date_on) + path + str(x))
-                    listings = tree.xpath('//div[@itemprop="itemListElement"]')
-                    if len(listings) == 0:
-                        i += 1
-                        print('--retrying--', str(i))
-                        if i == 5:
-                            print('--Page Error--')
-                            break
+                else:
+                    session.retry.success()
+                    page_counter = ListingOnline.page_processor(listings, date_on, session)
+                    if page_counter == int(-5):
+                        rejected += 1
+                        attempt += 1
+                        if rejected < 3 and session.retry.wait(attempt, 'online'):
+                            print('--retrying--')
+                            continue
+                        print('!!Page Error!!')
+                        break
                     else:
-                        if not len(listings) == 0:
-                            page_counter = ListingOnline.page_processor(listings, date_on)
-                            if page_counter == int(-5):
-                                print('--retrying--')
-                                z += 1
-                                break
-                            else:
-                                sample_total += len(listings)
-                                total += page_counter
-                                print(str(page_counter) + "/" + str(len(listings)))
-                                y = 3
-                                break
+                        sample_total += len(listings)
+                        total += page_counter
+                        if session.checkpoint is not None:
+                            session.checkpoint.online_page(date_on, x, [(unit_info['id'], unit_info['price'])
+                                                                        for unit_info in listings
+                                                                        if unit_info != [0, 0] and
+                                                                        unit_info['id'] in session.listings])
+                        print(str(page_counter) + "/" + str(len(listings)))
+                        break
         return [total, sample_total]
 
+    #Scrapes every night of the period, or only the given dates of it (incremental refresh)
     @staticmethod
-    def scrape(url, path, period):
+    def scrape(url, path, period, session=None, dates=None):
+        session = session_for(session)
+        session.online.set_period(period)
+        if dates is not None:
+            period = dates
         length = len(period)
-        for day in range(0, length):
-            date_on = period[day]
-            print('Date: ' + date_on.month + '/' + date_on.string_day)
-            pages = get_pages(url + Date.path(date_on))
-            if pages >= 18:
-                print('Scrape- ALERT: Listings missed - Search span included more than 18 pages')
-            elif pages == 0:
-                pages += 1
-            totals = ListingOnline.online_pages_iterate(date_on, pages, path)
-            total = totals[0]
-            sample_total = totals[1]
-            if sample_total != 0:
-                print(
-                    'Sample of ' + str(total) + '/' + str(sample_total) + ' listings ('
-                    + format(100 * total / sample_total, '.2f') + '% accuracy)\n')
+        queries = [url + Date.path(date_on) for date_on in period]
+        known = frozenset(session.listings.ids)
+        probes = fetcher.map(lambda query: probe_page(query, True, session.extract_mode, session.metrics,
+                                                      session.retry, known), queries)
+        all_pages = page_spans([probe[0] for probe in probes], 'Scrape')
+        staged = pipeline_pages(queries, path, all_pages, online=True, mode=session.extract_mode,
+                                metrics=session.metrics, first=[probe[1] for probe in probes],
+                                skip=[session.done_pages.get(date_on.out(), ()) for date_on in period], known=known)
+        with contextlib.closing(staged):
+            for day in range(0, length):
+                date_on = period[day]
+                print('Date: ' + date_on.month + '/' + date_on.string_day)
+                pages = all_pages[day]
+                totals = ListingOnline.online_pages_iterate(url, date_on, pages, path, next(staged), session)
+                total = totals[0]
+                sample_total = totals[1]
+                session.scraped[date_on.out()] = datetime.datetime.now().isoformat()
+                if session.checkpoint is not None:
+                    session.checkpoint.night_done(date_on)
+                session.metrics.set('air_coverage_listings', total, stage='online', unit=date_on.out())
+                session.metrics.set('air_coverage_sample', sample_total, stage='online', unit=date_on.out())
+                if sample_total != 0:
+                    session.metrics.observe('air_accuracy_percent', 100 * total / sample_total, Metrics.PERCENT,
+                                            stage='online')
+                    print(
+                        'Sample of ' + str(total) + '/' + str(sample_total) + ' listings ('
+                        + format(100 * total / sample_total, '.2f') + '% accuracy)\n')
+
+
+
+#Chart backends: 'offline' renders locally through a ChartBatch, 'cloud' uploads each chart
+#to the hosted plotly service
+CHART_BACKENDS = ('offline', 'cloud')
+
+
+#ChartBatch collects the charts of one market and renders them together into a single
+#self-contained html file (plotly.js is embedded once for all of them), nothing is uploaded
+class ChartBatch:
+    def __init__(self, title, directory='.'):
+        self.title = title
+        self.directory = directory
+        self.charts = OrderedDict()
+
+    def add(self, fig, name):
+        self.charts[name] = fig
+        return name
+
+    #Writes the charts (in the order of names, all charts when None) and returns a
+    #"<file>#<anchor>" link for each of them
+    def render(self, names=None, filename=None):
+        if names is None:
+            names = list(self.charts.keys())
+        if filename is None:
+            filename = os.path.join(self.directory, self.title + ' Charts.html')
+        parts = ['<html><head><meta charset="utf-8"><title>', escape(self.title), '</title>',
+                 '<script type="text/javascript">', plotly.offline.get_plotlyjs(), '</script></head><body>']
+        links = []
+        for i, name in enumerate(names):
+            anchor = 'chart-' + str(i)
+            parts.append('<div id="' + anchor + '">')
+            parts.append(plotly.offline.plot(self.charts[name], output_type='div', include_plotlyjs=False,
+                                             show_link=False))
+            parts.append('</div>')
+            links.append(filename + '#' + anchor)
+        parts.append('</body></html>')
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(''.join(parts))
+        return links
+
+
+#ScrapeSession holds all of the state of one market's analysis: the baseline listing store,
+#the vacancy store and pulled listings, the scan window and map cells, when each night was
+#last scraped, the extractor in use, the run's metrics and its retry policy. Sessions share
+#nothing but the fetch layer, so several markets can be scraped in one process at the same time
+class ScrapeSession:
+    def __init__(self, loc_title='', extract_mode='xpath', chart_backend='offline', chart_directory='.',
+                 retry=None):
+        if extract_mode not in EXTRACT_MODES:
+            raise ValueError('Unknown extract mode: ' + str(extract_mode))
+        if chart_backend not in CHART_BACKENDS:
+            raise ValueError('Unknown chart backend: ' + str(chart_backend))
+        self.loc_title = loc_title
+        self.extract_mode = extract_mode
+        self.chart_backend = chart_backend
+        self.charts = ChartBatch(loc_title, chart_directory)
+        self.listings = ListingIndex()
+        self.online = VacancyStore()
+        self.all_pulled = []
+        self.pulled_by_id = dict()
+        self.scan = []
+        self.searches = []
+        self.scraped = dict()
+        self.done_pages = dict()
+        self.checkpoint = None
+        self.demand = None
+        self.density = DensityEngine()
+        self.metrics = Metrics()
+        if retry is None:
+            retry = RetryPolicy()
+        if retry.metrics is None:
+            retry.metrics = self.metrics
+        self.retry = retry
+        self.start_time = datetime.datetime.now()
+
+    def elapsed(self):
+        return datetime.datetime.now() - self.start_time
+
+
+#Session used by the class methods and run functions when none is passed in
+default_session = ScrapeSession()
+
+
+def session_for(session):
+    if session is None:
+        return default_session
+    return session
+
+
+#DataStore is the embedded SQLite system of record for scraped markets
+#runs: one row per scrape run of a market
+#listings: one row per (market, listing) holding the latest baseline info seen
+#run_listings: one row per (market, run, listing) holding the baseline info that run saw
+#observations: one row per (market, listing, night, run) holding the nightly price
+#cells / cell_listings: each map cell of a run with its page count, totals, when its pages
+#were last scraped and the listings found on them. units and total_price count the listings
+#new to the run, sample every card and readable the cards that parsed
+#nights: when each night of a run's window was last scraped
+#work_units: checkpoints of a run in progress, one row per finished page of a map cell
+#('baseline', query) or of a night ('online', night), and page -1 once the whole unit is done
+#All writes are batched upserts, so saving the same run twice changes nothing
+class DataStore:
+    schema = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            market TEXT NOT NULL,
+            started TEXT NOT NULL,
+            finished TEXT,
+            scan_start TEXT,
+            scan_length INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS listings (
+            market TEXT NOT NULL,
+            id TEXT NOT NULL,
+            title TEXT,
+            type TEXT,
+            city TEXT,
+            price INTEGER,
+            beds INTEGER,
+            rating REAL,
+            review_count INTEGER,
+            first_run INTEGER,
+            last_run INTEGER,
+            lat REAL,
+            lng REAL,
+            PRIMARY KEY (market, id)
+        );
+        CREATE INDEX IF NOT EXISTS listings_by_position ON listings (market, lat, lng);
+        CREATE TABLE IF NOT EXISTS run_listings (
+            market TEXT NOT NULL,
+            run_id INTEGER NOT NULL,
+            id TEXT NOT NULL,
+            title TEXT,
+            type TEXT,
+            city TEXT,
+            price INTEGER,
+            beds INTEGER,
+            rating REAL,
+            review_count INTEGER,
+            lat REAL,
+            lng REAL,
+            PRIMARY KEY (market, run_id, id)
+        );
+        CREATE TABLE IF NOT EXISTS observations (
+            market TEXT NOT NULL,
+            listing_id TEXT NOT NULL,
+            night TEXT NOT NULL,
+            price REAL,
+            run_id INTEGER NOT NULL,
+            PRIMARY KEY (market, listing_id, night, run_id)
+        );
+        CREATE INDEX IF NOT EXISTS observations_by_night ON observations (market, night);
+        CREATE TABLE IF NOT EXISTS cells (
+            market TEXT NOT NULL,
+            run_id INTEGER NOT NULL,
+            query TEXT NOT NULL,
+            pages INTEGER,
+            units INTEGER,
+            sample INTEGER,
+            total_price INTEGER,
+            scraped TEXT,
+            readable INTEGER,
+            PRIMARY KEY (market, run_id, query)
+        );
+        CREATE TABLE IF NOT EXISTS cell_listings (
+            market TEXT NOT NULL,
+            run_id INTEGER NOT NULL,
+            query TEXT NOT NULL,
+            listing_id TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS cell_listings_by_run ON cell_listings (market, run_id, query);
+        CREATE TABLE IF NOT EXISTS nights (
+            market TEXT NOT NULL,
+            run_id INTEGER NOT NULL,
+            night TEXT NOT NULL,
+            scraped TEXT NOT NULL,
+            PRIMARY KEY (market, run_id, night)
+        );
+        CREATE TABLE IF NOT EXISTS work_units (
+            market TEXT NOT NULL,
+            run_id INTEGER NOT NULL,
+            stage TEXT NOT NULL,
+            unit TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            units INTEGER,
+            sample INTEGER,
+            total_price INTEGER,
+            done TEXT NOT NULL,
+            readable INTEGER,
+            PRIMARY KEY (market, run_id, stage, unit, page)
+        );
+    """
+
+    def __init__(self, path, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.executescript(DataStore.schema)
+
+    def close(self):
+        self.conn.close()
+
+    def _write(self, sql, rows):
+        self._write_all([(sql, rows)])
+
+    #Several statements in one transaction, each a (sql, rows) pair
+    def _write_all(self, statements):
+        with self.lock, self.conn:
+            for sql, rows in statements:
+                for start in range(0, len(rows), self.batch_size):
+                    self.conn.executemany(sql, rows[start:start + self.batch_size])
+
+    def start_run(self, market, scan_start, scan_length):
+        with self.lock, self.conn:
+            cursor = self.conn.execute('INSERT INTO runs (market, started, scan_start, scan_length) VALUES (?, ?, ?, ?)',
+                                       (market, datetime.datetime.now().isoformat(), scan_start, scan_length))
+        return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE runs SET finished = ? WHERE id = ?', (datetime.datetime.now().isoformat(), run_id))
+
+    listing_upsert = """
+        INSERT INTO listings (market, id, title, type, city, price, beds, rating, review_count, first_run, last_run, lat,
+                              lng)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (market, id) DO UPDATE SET
+            title = excluded.title, type = excluded.type, city = excluded.city, price = excluded.price,
+            beds = excluded.beds, rating = excluded.rating, review_count = excluded.review_count,
+            last_run = excluded.last_run, lat = coalesce(excluded.lat, lat), lng = coalesce(excluded.lng, lng)
+    """
+
+    #The listings as a run saw them, takes the rows of listing_rows (?11, last_run, is the
+    #same run id as ?10)
+    snapshot_upsert = """
+        INSERT INTO run_listings (market, id, title, type, city, price, beds, rating, review_count, run_id, lat, lng)
+        VALUES (?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?12, ?13)
+        ON CONFLICT (market, run_id, id) DO UPDATE SET
+            title = excluded.title, type = excluded.type, city = excluded.city, price = excluded.price,
+            beds = excluded.beds, rating = excluded.rating, review_count = excluded.review_count,
+            lat = excluded.lat, lng = excluded.lng
+    """
+
+    @staticmethod
+    def listing_rows(market, listings, run_id):
+        rows = []
+        for item in listings:
+            rows.append((market, item.id, item.title, item.typo, item.city, or_none(item.price), or_none(item.beds),
+                         or_none(item.rating), or_none(item.review_count), run_id, run_id, or_none(item.lat),
+                         or_none(item.lng)))
+        return rows
 
+    #Statements saving listings for a run: the latest values in listings and the run's own
+    #snapshot in run_listings
+    @staticmethod
+    def listing_statements(market, listings, run_id):
+        rows = DataStore.listing_rows(market, listings, run_id)
+        return [(DataStore.listing_upsert, rows), (DataStore.snapshot_upsert, rows)]
+
+    def save_listings(self, market, listings, run_id):
+        self._write_all(DataStore.listing_statements(market, listings, run_id))
+
+    #Every vacant (listing, night) cell of the vacancy store becomes one observation
+    def save_observations(self, market, online, run_id):
+        n = len(online)
+        rows, cols = np.nonzero(online.vacant[:n, :online.n_days])
+        prices = online.prices[rows, cols]
+        labels = online.day_labels()
+        records = [(market, online.ids[row], labels[col], None if np.isnan(price) else float(price), run_id)
+                   for row, col, price in zip(rows.tolist(), cols.tolist(), prices.tolist())]
+        self._write("""
+            INSERT INTO observations (market, listing_id, night, price, run_id) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (market, listing_id, night, run_id) DO UPDATE SET price = excluded.price
+        """, records)
+
+    def save_cells(self, market, searches, run_id):
+        cells = []
+        members = []
+        for search in searches:
+            query = search.query()
+            cells.append((market, run_id, query, search.pages, search.area_total_units, search.sample,
+                          search.area_total_price, search.scraped, search.readable))
+            members.extend((market, run_id, query, ident) for ident in search.ids)
+        self._write("""
+            INSERT INTO cells (market, run_id, query, pages, units, sample, total_price, scraped, readable)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (market, run_id, query) DO UPDATE SET
+                pages = excluded.pages, units = excluded.units, sample = excluded.sample,
+                total_price = excluded.total_price, scraped = excluded.scraped, readable = excluded.readable
+        """, cells)
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM cell_listings WHERE market = ? AND run_id = ?', (market, run_id))
+        self._write('INSERT INTO cell_listings (market, run_id, query, listing_id) VALUES (?, ?, ?, ?)', members)
+
+    def save_nights(self, market, scraped, run_id):
+        self._write("""
+            INSERT INTO nights (market, run_id, night, scraped) VALUES (?, ?, ?, ?)
+            ON CONFLICT (market, run_id, night) DO UPDATE SET scraped = excluded.scraped
+        """, [(market, run_id, night, when) for night, when in scraped.items()])
+
+    def save_session(self, session, run_id):
+        self.save_listings(session.loc_title, session.listings, run_id)
+        self.save_observations(session.loc_title, session.online, run_id)
+        self.save_cells(session.loc_title, session.searches, run_id)
+        self.save_nights(session.loc_title, session.scraped, run_id)
+
+    #finished=True skips runs that never completed
+    def latest_run(self, market, finished=False):
+        sql = 'SELECT max(id) FROM runs WHERE market = ?'
+        if finished:
+            sql += ' AND finished IS NOT NULL'
+        row = self.conn.execute(sql, (market,)).fetchone()
+        return row[0]
+
+    #The market's latest run as (id, scan_start, scan_length) if it never finished, or None
+    #(also when a later run has finished since, an older interrupted run is not picked up)
+    def unfinished_run(self, market):
+        row = self.conn.execute('SELECT id, scan_start, scan_length, finished FROM runs WHERE market = ? '
+                                'ORDER BY id DESC LIMIT 1', (market,)).fetchone()
+        if row is None or row[3] is not None:
+            return None
+        return row[:3]
+
+    #The map cells a run planned (see Checkpoint.plan_cells), in their original order
+    def run_searches(self, market, run_id, base):
+        rows = self.conn.execute('SELECT query FROM cells WHERE market = ? AND run_id = ? ORDER BY rowid',
+                                 (market, run_id))
+        return [MapSearch.clean(base, row[0]) for row in rows]
+
+    #query -> (pages, units, sample, total_price, scraped, readable) of each cell of a run
+    def cell_state(self, market, run_id):
+        rows = self.conn.execute('SELECT query, pages, units, sample, total_price, scraped, readable FROM cells '
+                                 'WHERE market = ? AND run_id = ?', (market, run_id))
+        return {row[0]: row[1:] for row in rows}
+
+    #night -> when it was last scraped, for each night of a run
+    def night_state(self, market, run_id):
+        rows = self.conn.execute('SELECT night, scraped FROM nights WHERE market = ? AND run_id = ?', (market, run_id))
+        return dict(rows.fetchall())
+
+    def _load_listings(self, market, ids, session):
+        missing = [ident for ident in ids if ident not in session.listings]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            rows = self.conn.execute('SELECT id, title, type, city, price, beds, rating, review_count, lat, lng '
+                                     'FROM listings WHERE market = ? AND id IN (' + ','.join('?' * len(chunk)) + ')',
+                                     [market] + chunk)
+            for row in rows:
+                values = [or_dash(value) for value in row]
+                Listing(*values[:8], session=session, lat=values[8], lng=values[9])
+
+    #Carries cells over from a run into the session: their totals, and their listings from
+    #the listings table
+    def load_cells(self, session, run_id, searches):
+        market = session.loc_title
+        state = self.cell_state(market, run_id)
+        for search in searches:
+            pages, units, sample, total_price, scraped, readable = state[search.query()]
+            search.area_total_units = units
+            search.area_total_price = total_price
+            search.sample = sample
+            search.readable = readable
+            search.scraped = scraped
+            search.ids = [row[0] for row in self.conn.execute(
+                'SELECT listing_id FROM cell_listings WHERE market = ? AND run_id = ? AND query = ?',
+                (market, run_id, search.query()))]
+            self._load_listings(market, search.ids, session)
+
+    #Carries the vacancy of some nights over from a run into the session
+    def load_nights(self, session, run_id, dates):
+        market = session.loc_title
+        state = self.night_state(market, run_id)
+        for date_on in dates:
+            night = date_on.out()
+            rows = self.conn.execute('SELECT listing_id, price FROM observations '
+                                     'WHERE market = ? AND run_id = ? AND night = ?', (market, run_id, night)).fetchall()
+            self._load_listings(market, [row[0] for row in rows], session)
+            for listing_id, price in rows:
+                if price is not None:
+                    price = int(price)
+                if listing_id in session.pulled_by_id:
+                    ListingOnline.vacant_date(listing_id, date_on, price, session)
+                else:
+                    ListingOnline(listing_id, date_on, price, session)
+            if night in state:
+                session.scraped[night] = state[night]
+
+    #Restores a run in progress from its checkpoints: finished cells and nights are carried
+    #over like an incremental refresh, cells and nights cut off partway keep the pages they
+    #finished (their listings and prices are loaded, the pages are skipped when scraping)
+    #Returns the cells and nights still to scrape, the nights to load (finished, or partly
+    #scraped) and the [total, sample] carried over
+    def restore(self, session, run_id, searches, scan):
+        market = session.loc_title
+        units = dict()
+        for stage, unit, page, count, sample, total_price, readable in self.conn.execute(
+                'SELECT stage, unit, page, units, sample, total_price, readable FROM work_units '
+                'WHERE market = ? AND run_id = ?', (market, run_id)):
+            units.setdefault((stage, unit), dict())[page] = (count, sample, total_price, readable)
+        done = [search for search in searches if -1 in units.get(('baseline', search.query()), ())]
+        self.load_cells(session, run_id, done)
+        todo = []
+        carried = [0, 0]
+        for search in searches:
+            pages = units.get(('baseline', search.query()), dict())
+            if -1 in pages:
+                carried[0] += search.readable
+                carried[1] += search.sample
+                continue
+            todo.append(search)
+            if len(pages) > 0:
+                search.done_pages = set(pages)
+                search.area_total_units = sum(page[0] for page in pages.values())
+                search.sample = sum(page[1] for page in pages.values())
+                search.area_total_price = sum(page[2] for page in pages.values())
+                search.readable = sum(page[3] for page in pages.values())
+                search.ids = [row[0] for row in self.conn.execute(
+                    'SELECT listing_id FROM cell_listings WHERE market = ? AND run_id = ? AND query = ?',
+                    (market, run_id, search.query()))]
+                self._load_listings(market, search.ids, session)
+                carried[0] += search.readable
+                carried[1] += search.sample
+        dates = []
+        kept_dates = []
+        for date_on in scan:
+            pages = units.get(('online', date_on.out()), dict())
+            if -1 in pages:
+                kept_dates.append(date_on)
+            else:
+                dates.append(date_on)
+                if len(pages) > 0:
+                    session.done_pages[date_on.out()] = set(pages)
+        kept_dates.extend(date_on for date_on in dates if date_on.out() in session.done_pages)
+        print('Resume: ' + str(len(todo)) + '/' + str(len(searches)) + ' cells, ' + str(len(dates)) + '/' +
+              str(len(scan)) + ' nights left to scrape')
+        return todo, dates, kept_dates, carried
+
+    #The baseline sheet of a run from its listing snapshot, same layout as baseline_frame
+    def baseline_frame(self, market, run_id, scan_length):
+        frame = pd.read_sql_query("""
+            SELECT l.id AS "ID", l.title AS "Title", l.type AS "Type", l.city AS "City", l.price AS "Price",
+                   l.beds AS "Beds", l.rating AS "Rating", l.review_count AS "Number of Reviews",
+                   count(o.night) AS "# of Vacant Days"
+            FROM run_listings l LEFT JOIN observations o
+                ON o.market = l.market AND o.listing_id = l.id AND o.run_id = l.run_id
+            WHERE l.market = ? AND l.run_id = ?
+            GROUP BY l.id
+        """, self.conn, params=(market, run_id), index_col='ID')
+        for col in ['Price', 'Beds', 'Number of Reviews', '# of Vacant Days']:
+            frame[col] = frame[col].astype('Int64')
+        frame['% Vacancy'] = (100 * frame['# of Vacant Days'] / scan_length).astype('Float64').round(1)
+        return frame
+
+    #Nightly prices of a run as a listing x night frame (NaN where not vacant)
+    def observations_frame(self, market, run_id):
+        frame = pd.read_sql_query('SELECT listing_id, night, price FROM observations WHERE market = ? AND run_id = ?',
+                                  self.conn, params=(market, run_id))
+        return frame.pivot(index='listing_id', columns='night', values='price')
+
+    #Stored listings of a market inside a bounding box (edges included), as the latest run that
+    #saw each of them has them, or as run_id saw them. Sub-area reports can join these ids to
+    #observations_frame without scraping again
+    def listings_within(self, market, sw_lat, sw_lng, ne_lat, ne_lng, run_id=None):
+        table = 'listings'
+        params = [market, sw_lat, ne_lat, sw_lng, ne_lng]
+        if run_id is not None:
+            table = 'run_listings'
+        sql = ('SELECT id AS "ID", title AS "Title", type AS "Type", city AS "City", price AS "Price", beds AS "Beds", '
+               'rating AS "Rating", review_count AS "Number of Reviews", lat AS "Lat", lng AS "Lng" FROM ' + table +
+               ' WHERE market = ? AND lat BETWEEN ? AND ? AND lng BETWEEN ? AND ?')
+        if run_id is not None:
+            sql += ' AND run_id = ?'
+            params.append(run_id)
+        frame = pd.read_sql_query(sql, self.conn, params=params, index_col='ID')
+        for col in ['Price', 'Beds', 'Number of Reviews']:
+            frame[col] = frame[col].astype('Int64')
+        return frame
+
+    #Stored listings within km kilometres of a point, nearest first, with their distance
+    def listings_near(self, market, lat, lng, km, run_id=None):
+        frame = self.listings_within(market, *radius_box(lat, lng, km), run_id=run_id)
+        frame['Distance (km)'] = distance_km(lat, lng, frame['Lat'].to_numpy(), frame['Lng'].to_numpy())
+        return frame[frame['Distance (km)'] <= km].sort_values('Distance (km)', kind='stable')
+
+
+#Checkpoint writes the progress of a run to its DataStore as it goes, so an interrupted run
+#can be picked up again with resume_run. Each finished page is saved with its listings (and
+#for a night, its vacancy) in one transaction, and each finished cell or night is marked done
+class Checkpoint:
+    observation_upsert = """
+        INSERT INTO observations (market, listing_id, night, price, run_id) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (market, listing_id, night, run_id) DO UPDATE SET price = excluded.price
+    """
+
+    def __init__(self, store, session, run_id):
+        self.store = store
+        self.session = session
+        self.market = session.loc_title
+        self.run_id = run_id
+        self.saved = set()
+
+    def _unit(self, stage, unit, page, count=None, sample=None, total_price=None, readable=None):
+        return ("""
+            INSERT INTO work_units (market, run_id, stage, unit, page, units, sample, total_price, done, readable)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (market, run_id, stage, unit, page) DO UPDATE SET
+                units = excluded.units, sample = excluded.sample, total_price = excluded.total_price,
+                done = excluded.done, readable = excluded.readable
+        """, [(self.market, self.run_id, stage, unit, page, count, sample, total_price,
+               datetime.datetime.now().isoformat(), readable)])
+
+    #Listings of the session not saved by an earlier checkpoint
+    def _listings(self, ids):
+        fresh = []
+        for ident in ids:
+            if ident not in self.saved and ident in self.session.listings:
+                self.saved.add(ident)
+                fresh.append(self.session.listings.search_by_id(ident))
+        return DataStore.listing_statements(self.market, fresh, self.run_id)
+
+    def _members(self, query, ids):
+        return ('INSERT INTO cell_listings (market, run_id, query, listing_id) VALUES (?, ?, ?, ?)',
+                [(self.market, self.run_id, query, ident) for ident in ids])
+
+    def _cells(self, searches):
+        return ("""
+            INSERT INTO cells (market, run_id, query, pages, units, sample, total_price, scraped, readable)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (market, run_id, query) DO UPDATE SET
+                pages = excluded.pages, units = excluded.units, sample = excluded.sample,
+                total_price = excluded.total_price, scraped = excluded.scraped, readable = excluded.readable
+        """, [(self.market, self.run_id, search.query(), search.pages, search.area_total_units, search.sample,
+               search.area_total_price, search.scraped, search.readable) for search in searches])
+
+    def _night(self, night, scraped):
+        return ('INSERT INTO nights (market, run_id, night, scraped) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (market, run_id, night) DO UPDATE SET scraped = excluded.scraped',
+                [(self.market, self.run_id, night, scraped)])
+
+    #Records every map cell of a new run up front, so a resumed run scrapes the same cells
+    #without probing the area again
+    def plan_cells(self, searches):
+        self.store._write_all([self._cells(searches)])
+
+    #count is the listings new to the run, sample the cards on the page and readable those that parsed
+    def baseline_page(self, search, page, ids, count, sample, total_price, readable):
+        self.store._write_all(self._listings(ids) + [self._members(search.query(), ids),
+                                                     self._unit('baseline', search.query(), page, count, sample,
+                                                                total_price, readable)])
+
+    def cell_done(self, search):
+        self.store._write_all([self._cells([search]), self._unit('baseline', search.query(), -1)])
+
+    #prices is a list of (listing id, nightly price) for the listings found vacant on the page
+    def online_page(self, date_on, page, prices):
+        night = date_on.out()
+        self.store._write_all(self._listings([ident for ident, price in prices]) + [
+            (Checkpoint.observation_upsert, [(self.market, ident, night, or_none(price), self.run_id)
+                                             for ident, price in prices]),
+            self._unit('online', night, page)])
+
+    def night_done(self, date_on):
+        night = date_on.out()
+        self.store._write_all([self._night(night, self.session.scraped[night]), self._unit('online', night, -1)])
+
+    #Marks the cells an incremental refresh carried over as done, with their listings
+    def carry_cells(self, searches):
+        statements = []
+        for search in searches:
+            statements.extend(self._listings(search.ids) + [self._members(search.query(), search.ids),
+                                                            self._unit('baseline', search.query(), -1)])
+        statements.append(self._cells(searches))
+        self.store._write_all(statements)
+
+    #Marks the nights an incremental refresh carried over from run previous as done, copying
+    #their observations into this run
+    def carry_nights(self, dates, previous):
+        statements = []
+        for date_on in dates:
+            night = date_on.out()
+            statements.extend([
+                ("""
+                    INSERT INTO observations (market, listing_id, night, price, run_id)
+                    SELECT market, listing_id, night, price, ? FROM observations
+                    WHERE market = ? AND run_id = ? AND night = ?
+                    ON CONFLICT (market, listing_id, night, run_id) DO UPDATE SET price = excluded.price
+                """, [(self.run_id, self.market, previous, night)]),
+                self._night(night, self.session.scraped[night]), self._unit('online', night, -1)])
+        self.store._write_all(statements)
 
 
 #A few methods for ease of writing later code
-def big_int(num):
+def month_length(date):
+    return monthrange(int(date.year), int(date.month))[1]
+
+
+#Scraped values that were never filled in ('--') are stored as NULL
+def or_none(value):
+    if value == '--':
+        return None
+    return value
+
+
+def or_dash(value):
+    if value is None:
+        return '--'
+    return value
+
+
+#Array value to a python int, '--' for the missing marker (-1)
+def or_dash_int(value):
+    if value < 0:
+        return '--'
+    return int(value)
+
+
+def or_dash_float(value):
+    if np.isnan(value):
+        return '--'
+    return float(value)
+
+
+#A coordinate read from the page as a float, '--' when there is none
+def coordinate(value):
     try:
-        out = int(num)
-    except ValueError:
-        if "," in num:
-            pre_out = num.replace(",", "")
-            return int(pre_out)
-    else:
-        return out
+        value = float(value)
+    except (TypeError, ValueError):
+        return '--'
+    if not np.isfinite(value):
+        return '--'
+    return value
 
 
-def or_comma(item):
-    top = len(item)
-    count = 0
-    for i in item:
-        if i.isdigit() or i == ',':
-            count += 1
-    if count == top:
-        return True
-    else:
-        return False
+#Great-circle distance in km from a point to arrays of points (haversine)
+def distance_km(lat, lng, lats, lngs):
+    lat1, lng1, lat2, lng2 = np.radians(lat), np.radians(lng), np.radians(lats), np.radians(lngs)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
 
 
-def month_length(date):
-    month = date.month
-    length = 0
-    if int(month) == 1 or int(month) == 3 or int(month) == 5 or int(month) == 7 or int(
-            month) == 8 or int(month) == 10 or int(month) == 12:
-        length = 31
-    elif int(month) == 4 or int(month) == 6 or int(month) == 9 or int(month) == 11:
-        length = 30
-    elif int(month) == 2:
-        length = 28
-    return length
+#Bounding box (sw_lat, sw_lng, ne_lat, ne_lng) around the circle of km kilometres about a point
+def radius_box(lat, lng, km):
+    lat_step = np.degrees(km / EARTH_RADIUS)
+    lng_step = np.degrees(km / (EARTH_RADIUS * max(np.cos(np.radians(lat)), 1e-6)))
+    return lat - lat_step, lng - lng_step, lat + lat_step, lng + lng_step
 
 
 def add_zero(num):
@@ -664,28 +2563,47 @@ def if_zero(item):
         return True
 
 
-def looking_forward(start, end):
-    scan = []
-    date_on = start
-    while True:
-        if not date_on.out() == end.out():
-            scan.append(date_on)
-            date_on = date_on.add_days(1)
-            Date.scan.append(date_on)
-        else:
-            break
-    if date_on.out() == end.out():
-        scan.append(date_on)
-        Date.scan.append(date_on)
+#Every day from start to end (both included), the window is also kept as the session's scan
+def looking_forward(start, end, session=None):
+    scan = [Date.from_index(day) for day in scan_window(start, end)]
+    session_for(session).scan = scan
     return scan
 
 
-def days_forward(start, num):
+def days_forward(start, num, session=None):
     end = start.add_days(num)
-    scan = looking_forward(start, end)
+    scan = looking_forward(start, end, session)
     return scan
 
 
+#Whether something last scraped age days ago is due on day (a day index), slot picks the
+#day of the max_age cycle it is refreshed on, so things scraped together (e.g. by a full run)
+#are spread over the cycle instead of all going stale on the same day
+def refresh_due(age, max_age, slot, day):
+    return age >= max_age or (age > 0 and slot % max_age == day % max_age)
+
+
+#Nights of the scan due for a scrape under the refresh schedule, given night -> last scrape
+def stale_dates(scan, scraped, schedule=REFRESH_SCHEDULE, now=None):
+    if now is None:
+        now = datetime.datetime.now()
+    today = Date.to_form(now.date())
+    out = []
+    for date_on in scan:
+        last = scraped.get(date_on.out())
+        if last is None:
+            out.append(date_on)
+            continue
+        ahead = date_on.index - today.index
+        age = round((now - datetime.datetime.fromisoformat(last)).total_seconds() / 86400)
+        for limit, max_age in schedule:
+            if limit is None or ahead <= limit:
+                if refresh_due(age, max_age, date_on.index, today.index):
+                    out.append(date_on)
+                break
+    return out
+
+
 def fileid_from_url(ob):
     """Return fileId from a url."""
     url = str(ob)
@@ -700,33 +2618,374 @@ def fileid_from_url(ob):
         return fileId[:share_key_index].replace('/', ':')
 
 
+cloud_configured = False
+
+
+#Uploads a chart to the hosted plotly service, only used by the 'cloud' chart backend
+def cloud_plot(fig, name):
+    global cloud_configured
+    import plotly.plotly as py
+    if not cloud_configured:
+        plotly.tools.set_config_file(world_readable=False,
+                                     sharing='private')
+        cloud_configured = True
+    return py.plot(fig, filename=name)
+
+
+#Hands a chart to the session's chart backend, returns its url (cloud) or its name (offline)
+def plot_chart(fig, name, session=None):
+    session = session_for(session)
+    if session.chart_backend == 'cloud':
+        return cloud_plot(fig, name)
+    return session.charts.add(fig, name)
+
+
+#Histogram pre-binned with numpy into size-wide bins from 0 to end, drawn as bars so the
+#figure carries one value per bin instead of every price
+def binned_histogram(values, end, size=20, **kwargs):
+    values = np.asarray([value for value in values if type(value) is int], dtype=np.float64)
+    edges = np.arange(0, max(end, 0) + size, size, dtype=np.float64)
+    if len(edges) < 2:
+        edges = np.asarray([0.0, float(size)])
+    counts, edges = np.histogram(values, bins=edges)
+    return go.Bar(x=(edges[:-1] + size / 2).tolist(), y=counts.tolist(), width=size, **kwargs)
+
+
 def my_round(x, base=5):
     return int(base * round(float(x) / base))
 
 #HTML request
-def grab(url):
-    page = requests.get(url)
-    soup = html.fromstring(page.content)
+#An empty response (e.g. an offline cache miss) gives an empty page rather than a parser error
+def grab(url, metrics=None):
+    content = fetcher.get(url, metrics)
+    if not content.strip():
+        return html.fromstring('<html></html>')
+    soup = html.fromstring(content)
     return soup
 
 
-#Returns the number of pages to iterate over for a given query
-def get_pages(url):
-    i = 0
-    while True:
-        page = requests.get(url)
-        tree = html.fromstring(page.content)
-        list_pages = tree.xpath('//li[@class = "buttonContainer_1am0dt"]/descendant::text()')
+#Page count and first page records for a map cell, reusing an adaptive probe when there is one
+def search_probe(search, mode='xpath', metrics=None, retry=None):
+    if search.pages is not None:
+        return search.pages, search.first
+    return probe_page(search.query(), False, mode, metrics, retry)
+
+
+#Parses a page into one record per listing card
+#Baseline records come from Listing.listing_process, online (specific night) records from
+#ListingOnline.date_price_process. Cards that cannot be read give CARD_ERROR / [0, 0]
+#mode picks the extractor, see EXTRACT_MODES. known holds the ids already in the baseline,
+#online records leave out their listing record
+def parse_page(content, online=False, mode='xpath', known=()):
+    if not content.strip():
+        return []
+    if mode == 'json':
+        records = parse_state(content, online)
+        if len(records) > 0:
+            return records
+    found = listing_span(content)
+    if found is None:
+        return []
+    tree = etree.fromstring(found[0], PAGE_PARSER)
+    items = SPAN_NODES(tree)
+    if len(items) != found[1]:
+        items = None
+    return parse_tree(tree, online, known, items)
+
+
+#The listing cards of a page as a small html document of their own: the bytes from the start
+#of the first card to the close of the last one (found by counting div tags), along with the
+#number of card tags in it, or None when the page has no cards. The rest of the page (scripts,
+#header, map) is never parsed
+def listing_span(content):
+    first = CARD_START.search(content)
+    if first is None:
+        return None
+    last = first
+    count = 1
+    for last in CARD_START.finditer(content, first.end()):
+        count += 1
+    end = len(content)
+    depth = 0
+    for tag in DIV_TAG.finditer(content, last.start()):
+        depth += -1 if tag.group(1) else 1
+        if depth == 0:
+            close = content.find(b'>', tag.end())
+            end = len(content) if close < 0 else close + 1
+            break
+    head = b''
+    charset = PAGE_CHARSET.search(content, 0, first.start())
+    if charset is not None:
+        head = b'<head><meta charset="' + charset.group(1) + b'"></head>'
+    return b'<html>' + head + b'<body>' + content[first.start():end] + b'</body></html>', count
+
+
+#Records of the listing cards of a page tree, items are its cards when already known
+def parse_tree(tree, online=False, known=(), items=None):
+    if items is None:
+        items = LISTING_NODES(tree)
+    fields = CardFields(items)
+    if online:
+        return [ListingOnline.date_price_process(item, fields, row, known) for row, item in enumerate(items)]
+    return [Listing.listing_process(item, fields, row) for row, item in enumerate(items)]
+
+
+#The listing cards of a page read in one pass: each card's listing container and info text
+#nodes (cards, None for a card without them), and its price, bed count and
+#review count as int arrays (-1 where the card has none)
+#The text nodes of all cards are joined into one string and scanned once with CARD_TOKENS,
+#matches are mapped back to their card by offset. first_price keeps the first price on a card
+#(the nightly price the online scrape reads), the other fields the last one
+class CardFields:
+    def __init__(self, items):
+        self.cards = [read_card(item) for item in items]
+        count = len(self.cards)
+        starts = []
+        parts = []
+        offset = 0
+        for card in self.cards:
+            part = NODE_SEP.join(card[1]) if card is not None else ''
+            starts.append(offset)
+            parts.append(part)
+            offset += len(part) + 1
+        #Rows of out: first price, then CARD_TOKENS group numbers (1 price, 2 beds, 3 reviews)
+        out = [[-1] * count for kind in range(4)]
+        row = 0
+        for match in CARD_TOKENS.finditer(NODE_SEP.join(parts)):
+            at = match.start()
+            while row + 1 < count and starts[row + 1] <= at:
+                row += 1
+            kind = match.lastindex
+            value = int(match.group(kind).replace(',', ''))
+            out[kind][row] = value
+            if kind == 1 and out[0][row] < 0:
+                out[0][row] = value
+        self.first_price, self.price, self.beds, self.reviews = np.array(out, dtype=np.int64)
+
+
+#Name (the content of the card's own name meta tag) and coordinates (meta tags anywhere in
+#the card, usually a nested geo block) of a listing card in one walk over its meta tags,
+#None for those it does not have
+def card_meta(item):
+    name = lat = lng = None
+    for meta in item.iter('meta'):
+        prop = meta.get('itemprop')
+        if prop == 'name':
+            if name is None and meta.getparent() is item:
+                name = meta.get('content')
+        elif prop == 'latitude':
+            if lat is None:
+                lat = meta.get('content')
+        elif prop == 'longitude':
+            if lng is None:
+                lng = meta.get('content')
+    return name, lat, lng
+
+
+#Listing container and info text nodes of a listing card, None when the card does not have a
+#listing container with an info container (only looked up on its own when there is no text)
+def read_card(item):
+    found = CARD_TEXT(item)
+    if len(found) == 0:
+        return None
+    listing_card = found[0]
+    raw = found[1:]
+    if len(raw) == 0 and len(INFO_CONTAINER(listing_card)) == 0:
+        return None
+    return listing_card, raw
+
+
+#Embedded-JSON extractor, returns the same records as parse_tree or [] when the page has no
+#usable state blob. Search results are the objects holding both a 'listing' and a
+#'pricing_quote', the same listing can appear in several sections so ids are deduplicated
+def parse_state(content, online=False):
+    records = []
+    seen = set()
+    for match in STATE_SCRIPT.finditer(content):
         try:
-            string_pages = list_pages[-1]
-        except:
-            i += 1
-            if i == 3:
-                return 0
+            state = json.loads(match.group(1))
+        except ValueError:
             continue
+        stack = [state]
+        while len(stack) > 0:
+            node = stack.pop()
+            if isinstance(node, list):
+                stack.extend(reversed(node))
+            elif isinstance(node, dict):
+                if isinstance(node.get('listing'), dict) and isinstance(node.get('pricing_quote'), dict):
+                    unit_info = state_record(node)
+                    if unit_info != CARD_ERROR and unit_info['id'] not in seen:
+                        seen.add(unit_info['id'])
+                        if online:
+                            unit_info = {'id': unit_info['id'], 'price': unit_info['price'], 'listing': unit_info}
+                        records.append(unit_info)
+                else:
+                    stack.extend(reversed(list(node.values())))
+    return records
+
+
+def state_record(result):
+    listing = result['listing']
+    rate = result['pricing_quote'].get('rate') or dict()
+    try:
+        listing_id = str(listing['id'])
+        price = int(rate['amount'])
+    except (KeyError, TypeError, ValueError):
+        return CARD_ERROR
+    unit_info = {'id': listing_id, 'name': listing.get('name', '--'), 'typo': listing.get('room_type', '--'),
+                 'city': listing.get('city', '--'), 'price': price, 'beds': listing.get('beds', '--'),
+                 'rating': listing.get('star_rating', '--'), 'review_count': listing.get('reviews_count', '--'),
+                 'lat': coordinate(listing.get('lat')), 'lng': coordinate(listing.get('lng')), 'error': 0}
+    for key in ['beds', 'review_count']:
+        if type(unit_info[key]) is not int:
+            unit_info[key] = '--'
+    if unit_info['rating'] is None:
+        unit_info['rating'] = '--'
+    return unit_info
+
+
+#The baseline ids among the listing ids of a page, what a parse worker needs of known without
+#the whole baseline being pickled with every page
+def known_on_page(content, known):
+    if len(known) == 0:
+        return frozenset()
+    return frozenset(ident.decode('utf-8', 'replace') for ident in LISTING_ID.findall(content)).intersection(known)
+
+
+#parse_page along with the time it took, so parse workers can report it
+def timed_parse(content, online=False, mode='xpath', known=()):
+    start = time.perf_counter()
+    records = parse_page(content, online, mode, known)
+    return records, time.perf_counter() - start
+
+
+def parse_stage(online):
+    if online:
+        return 'online'
+    return 'baseline'
+
+
+#Fetches and parses a single page
+def grab_records(url, online=False, mode='xpath', metrics=None, fresh=False, known=()):
+    records, seconds = timed_parse(fetcher.get(url, metrics, fresh), online, mode, known)
+    if metrics is not None:
+        metrics.observe('air_parse_seconds', seconds, stage=parse_stage(online))
+    return records
+
+
+#Refetch of a page for the retry loops, from the network rather than the cache, a request
+#error counts as an empty page
+def retry_records(url, online, session):
+    try:
+        return grab_records(url, online, session.extract_mode, session.metrics, fresh=True, known=session.listings)
+    except requests.RequestException as error:
+        print('Request error', url, error)
+        return []
+
+
+#Runs every page of every query through the shared pipeline, yielding the parsed records
+#of one query (a list with one entry per page) at a time, in query order, as soon as all of
+#its pages are in. Pages of later queries keep being fetched and parsed in the meantime
+#first holds each query's probed page 0 records (None to fetch it), skip each query's page
+#numbers to leave out (already checkpointed), which come back as empty pages
+#known is the set of baseline ids for the online records (see parse_page)
+def pipeline_pages(queries, path, counts, online=False, mode='xpath', metrics=None, first=None, skip=None,
+                   known=frozenset()):
+    if first is None:
+        first = [None] * len(queries)
+    if skip is None:
+        skip = [()] * len(queries)
+    jobs = []
+    for q, query in enumerate(queries):
+        for x, page_url in enumerate(page_urls(query, path, counts[q])):
+            if x not in skip[q] and (x > 0 or first[q] is None):
+                jobs.append(((q, x), page_url))
+    with contextlib.closing(get_pipeline().run(jobs, online, mode, metrics, known)) as results:
+        for q in range(0, len(queries)):
+            group = []
+            for x in range(0, counts[q]):
+                if x in skip[q]:
+                    group.append([])
+                elif x == 0 and first[q] is not None:
+                    group.append(first[q])
+                else:
+                    group.append(next(results)[1])
+            yield group
+
+
+#Alerts on queries at the page cap and gives empty queries a single page to try
+def page_spans(counts, stage):
+    out = []
+    for pages in counts:
+        if pages >= 18:
+            print(stage + '- ALERT: Listings missed - Search span included more than 18 pages')
+        elif pages == 0:
+            pages += 1
+        out.append(pages)
+    return out
+
+
+#Fetches a batch of pages concurrently through the shared fetch layer and parses them
+#Records come back in url order
+def fetch_records(urls, online=False, mode='xpath', metrics=None, known=()):
+    return fetcher.map(lambda page_url: grab_records(page_url, online, mode, metrics, known=known), urls)
+
+
+#Builds the url of every page in a query, page 0 is the bare query
+def page_urls(query, path, pages):
+    urls = []
+    for x in range(0, pages):
+        if x == 0:
+            urls.append(query)
         else:
-            pages = int(string_pages)
-            return pages
+            urls.append(query + path + str(x))
+    return urls
+
+
+#Fetches page 1 of a query once for both its page count and its records, returns
+#(pages, records) so the page need not be downloaded again. A page with listings but no
+#paginator is a single page of results, a page with neither (or a failed request) is retried
+#under the retry policy and counts as 0 pages if it never shows either
+#records is None when no request for the page succeeded
+def probe_page(url, online=False, mode='xpath', metrics=None, retry=None, known=()):
+    if retry is None:
+        retry = RetryPolicy(metrics=metrics)
+    attempt = 0
+    records = None
+    while True:
+        try:
+            content = fetcher.get(url, metrics, fresh=attempt > 0)
+        except requests.RequestException as error:
+            print('Request error', url, error)
+            content = None
+        list_pages = []
+        if content is not None:
+            start = time.perf_counter()
+            records = []
+            if content.strip():
+                tree = etree.fromstring(content, PAGE_PARSER)
+                list_pages = PAGE_BUTTONS(tree)
+                if mode == 'json':
+                    records = parse_state(content, online)
+                if len(records) == 0:
+                    records = parse_tree(tree, online, known)
+            if metrics is not None:
+                metrics.observe('air_parse_seconds', time.perf_counter() - start, stage=parse_stage(online))
+        if len(list_pages) > 0 and list_pages[-1].strip().isdigit():
+            retry.success()
+            return int(list_pages[-1]), records
+        if records:
+            retry.success()
+            return 1, records
+        retry.failure()
+        attempt += 1
+        if not retry.wait(attempt, 'page_count'):
+            return 0, records
+
+
+#Returns the number of pages to iterate over for a given query
+def get_pages(url, metrics=None, retry=None):
+    return probe_page(url, metrics=metrics, retry=retry)[0]
 
 
 def list_builder(range_start, range_length, item):
@@ -740,54 +2999,60 @@ def list_builder(range_start, range_length, item):
 
 
 #The run method generates the baseline database and the baseline distribution graph
-def run(loc_title, path, searches):
-    info = Listing.baseline(path, searches)
-    total = info[0]
-    sample_total = info[1]
+#carried is the [total, sample] of cells kept from the previous run in an incremental refresh
+def run(loc_title, path, searches, session=None, carried=(0, 0)):
+    session = session_for(session)
+    info = Listing.baseline(path, searches, session)
+    total = info[0] + carried[0]
+    sample_total = info[1] + carried[1]
     baseline_file_name = loc_title + ' Baseline'
-    highest_bed_number = Listing.highest_bed_number
-    highest_price = Listing.highest_price
+    highest_bed_number = session.listings.highest_bed_number
+    highest_price = session.listings.highest_price
     data = []
     global scheme
     for bed in range(1, highest_bed_number+1):
-        out = Listing.list_by_bed(bed)
+        out = session.listings.list_by_bed(bed)
         name = str(bed) + ' Bed'
         if len(out) > 0:
-            data.append(go.Histogram(x=out, marker=dict(color=scheme[bed]), opacity=0.65,
-                                     name=name, xbins=dict(start=0, end=highest_price, size=20)))
+            data.append(binned_histogram(out, highest_price, 20, marker=dict(color=scheme[bed]), opacity=0.65,
+                                         name=name))
     layout = go.Layout(barmode='overlay', xaxis=dict(tickprefix='$', fixedrange=True), yaxis=dict(fixedrange=True),
                        title=loc_title+' - Baseline - Sample of '+str(total)+'/'+str(sample_total)+' Listings')
     fig = go.Figure(data=data, layout=layout)
-    return py.plot(fig, filename=baseline_file_name)
+    return plot_chart(fig, baseline_file_name, session)
 
 
 #Vacancy method genrates 30-day vacancy database and 30-day vacancy chart
-def vacancy(loc_title, url, path, period):
+#dates limits the scrape to some nights of the period, the chart always covers all of it
+#Returns the chart and the period's DemandReport (also kept as session.demand)
+def vacancy(loc_title, url, path, period, session=None, dates=None):
+    session = session_for(session)
     global scheme
-    highest_bed_number = Listing.highest_bed_number
-    month_listings = list_builder(0, len(period), 0)
-    ListingOnline.scrape(url, path, period)
+    highest_bed_number = session.listings.highest_bed_number
+    month_listings = np.zeros(len(period), dtype=np.int64)
+    ListingOnline.scrape(url, path, period, session, dates)
+    report = DemandReport(session.online, period, session.listings)
+    session.demand = report
     graph_data = list()
     bed_number_count = 0
     xvals = list()
     for item in period:
         xvals.append(item.out())
     for bed_number in range(1, highest_bed_number + 1):
-        if not Listing.count_by_bed(bed_number) > 3:
+        if not session.listings.count_by_bed(bed_number) > 3:
             continue
         else:
-            month_data = []
-            for day in range(len(period)):
-                count = ListingOnline.count_by_bed_by_date(bed_number, period[day])
-                month_data.append(count)
-                month_listings[day] += count
-            if not month_data == len(month_data)*[0]:
+            row = report._bed_row(bed_number)
+            month_data = report.vacant_by_bed[row] if row is not None else np.zeros(len(period), dtype=np.int64)
+            month_listings += month_data
+            if month_data.any():
                 bed_number_count += 1
-                graph_data.append(go.Bar(x=xvals, y=month_data, marker=dict(color=scheme[bed_number-1]),
+                graph_data.append(go.Bar(x=xvals, y=month_data.tolist(), marker=dict(color=scheme[bed_number-1]),
                                          name=str(bed_number) + ' Bed'))
             else:
                 continue
-    graph_data.append(go.Scatter(x=xvals, y=month_listings, name='Total Vacancy', line=dict(color=scheme, width=4)))
+    graph_data.append(go.Scatter(x=xvals, y=month_listings.tolist(), name='Total Vacancy',
+                                 line=dict(color='rgb(80, 80, 80)', width=4)))
 
     layout = go.Layout(barmode='group', yaxis=dict(fixedrange=True), title=loc_title+' Vacancy Report', xaxis=dict(
         rangeslider=dict(),
@@ -797,113 +3062,334 @@ def vacancy(loc_title, url, path, period):
     fig = go.Figure(data=graph_data, layout=layout)
     name = loc_title + "Vacancy Report"
 
-    return [py.plot(fig, filename=name), argrelextrema(np.asanyarray(month_listings), np.less)]
+    return [plot_chart(fig, name, session), report]
 
 
 #Accesses ListingOnline database and plots distribution of price by bed-count
-def run_a_date(loc_title, date_on):
-    highest_bed_number = Listing.highest_bed_number
-    group_labels = []
-    hist_data = []
-    for bed in range(1, highest_bed_number+1):
-        out = ListingOnline.list_by_bed_by_date(bed, date_on)
-        name = str(bed) + ' Bed'
-        if len(out) > 3:
-            hist_data.append(out)
-            group_labels.append(name)
-
-    fig = ff.create_distplot(hist_data, group_labels, show_hist=False, colors=scheme[:len(hist_data)])
-    fig['layout'].update(title=date_on.out()+' - '+loc_title)
+#Prices come from the session's DemandReport when it covers the date, density curves from
+#the session's DensityEngine (computed here unless the date was batched beforehand)
+def run_a_date(loc_title, date_on, session=None, report=None):
+    session = session_for(session)
+    if report is None:
+        report = session.demand
+    if report is None or date_on not in report.columns:
+        report = DemandReport(session.online, [date_on], session.listings)
+    highest_bed_number = session.listings.highest_bed_number
+    curves = session.density.curves(loc_title, report, [date_on], range(1, highest_bed_number+1))[date_on]
+    data = []
+    for i, (bed, x, y) in enumerate(curves):
+        data.append(go.Scatter(x=x, y=y, mode='lines', name=str(bed) + ' Bed', line=dict(color=scheme[i])))
+    fig = go.Figure(data=data, layout=go.Layout(title=date_on.out()+' - '+loc_title, xaxis=dict(tickprefix='$')))
     name = loc_title + date_on.out()
-    return py.plot(fig, filename=name)
-
-
-#Initializes excel workbook for data output
+    return plot_chart(fig, name, session)
+
+
+#Streams sheets into an xlsx file through an openpyxl write-only workbook: rows are spooled
+#to disk as they are appended, so memory stays flat whatever the number of rows
+#With keep=True the sheets already in the file are carried over on close, ahead of the new
+#ones, by streaming their rows out of a read-only workbook (values only, the old sheets are
+#never loaded whole). A sheet written again under an existing name replaces the old one
+#The file is saved under a temporary name and moved into place, so a failed export leaves
+#the old workbook as it was. Use it as a context manager or call close() to save
+class ExcelExport:
+    def __init__(self, filename, keep=True, chunk=10000):
+        self.filename = filename
+        self.keep = keep
+        self.chunk = chunk
+        self.book = Workbook(write_only=True)
+        self.written = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+
+    def _sheet(self, name):
+        if name in self.written:
+            raise ValueError('Sheet already written: ' + name)
+        self.written.append(name)
+        return self.book.create_sheet(name)
+
+    #Appends rows (lists of cell values) to a new sheet, header first when given
+    def write_rows(self, name, rows, header=None):
+        sheet = self._sheet(name)
+        if header is not None:
+            sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+
+    #Writes a frame in the layout of DataFrame.to_excel (index in the first column), chunk
+    #rows at a time. Missing values (NaN, NA) are left as empty cells
+    def write_frame(self, name, frame):
+        self.write_rows(name, self._frame_rows(frame), [frame.index.name] + [str(col) for col in frame.columns])
+
+    def _frame_rows(self, frame):
+        for start in range(0, len(frame), self.chunk):
+            part = frame.iloc[start:start + self.chunk]
+            values = part.astype(object).where(part.notna(), None)
+            for label, row in zip(part.index.tolist(), values.itertuples(index=False, name=None)):
+                yield [label] + list(row)
+
+    def _carry(self):
+        if not self.keep or not os.path.exists(self.filename):
+            return
+        source = load_workbook(self.filename, read_only=True)
+        try:
+            position = 0
+            for old in source.worksheets:
+                if old.title in self.written:
+                    continue
+                sheet = self.book.create_sheet(old.title)
+                for row in old.iter_rows(values_only=True):
+                    sheet.append(row)
+                self.book.move_sheet(old.title, position - len(self.book.sheetnames) + 1)
+                position += 1
+        finally:
+            source.close()
+
+    def close(self):
+        self._carry()
+        if len(self.book.sheetnames) == 0:
+            self.book.create_sheet('Sheet')
+        base, extension = os.path.splitext(self.filename)
+        partial = base + '.partial' + extension
+        self.book.save(partial)
+        os.replace(partial, self.filename)
+
+
+#Initializes excel workbook for data output, an export that keeps the sheets of an existing
+#"<title> Data.xlsx"
 def initialize_workbook(title):
-    book = load_workbook(title+" Data.xlsx")
-    writer = pd.ExcelWriter(title+" Data.xlsx", engine='openpyxl')
-    writer.book = book
-    writer.sheets = dict((ws.title, ws) for ws in book.worksheets)
-    return writer
+    return ExcelExport(title+" Data.xlsx")
 
 
 #Converts basline database to Pandas Dataframe
-def baseline_frame(scan_length):
+#Columns come straight from the listing index arrays, vacant day counts from one reduction
+#over the vacancy store, missing values are NaN rather than '--'
+def baseline_frame(scan_length, session=None):
+    session = session_for(session)
     baseline_data = ['ID', 'Title', 'Type', 'City', 'Price', 'Beds', 'Rating', 'Number of Reviews', '# of Vacant Days',
                      '% Vacancy']
-    blank_entry = pd.Series(["--", "--", "--", "--", "--", "--", "--", "--", "--"])
-    baseline_df = pd.DataFrame(data=[blank_entry, blank_entry], columns=baseline_data[1:], index=['blank', 'blank'])
-    for item in Listing._baseline:
-        sub = ListingOnline.search_by_id(item.id)
-        if sub is None:
-            num_of = "--"
-            perc_of = "--"
-        else:
-            num_of = len(sub.vacant_dates.keys())
-            perc_of = "{0:.1f}%".format(100*len(sub.vacant_dates.keys())/scan_length)
-
-        temp = pd.DataFrame(data=[[item.title, item.typo, item.city, item.price, item.beds, item.rating,
-                                   item.review_count, num_of, perc_of]], columns=baseline_data[1:], index=[item.id])
-        baseline_df = baseline_df.append(temp)
+    listings = session.listings
+    n = len(listings)
+    store = session.online
+    vacant_counts = store.vacant_counts()
+    rows = np.fromiter((store.rows.get(ident, -1) for ident in listings.ids), dtype=np.int64, count=n)
+    num_of = np.where(rows >= 0, vacant_counts[np.maximum(rows, 0)] if len(vacant_counts) else 0, -1)
+    columns = dict()
+    columns[baseline_data[1]] = listings.titles
+    columns[baseline_data[2]] = np.asarray(listings.types.values + [None], dtype=object)[listings.type_codes[:n]]
+    columns[baseline_data[3]] = np.asarray(listings.cities.values + [None], dtype=object)[listings.city_codes[:n]]
+    for name, values in zip(['Price', 'Beds', 'Number of Reviews', '# of Vacant Days'],
+                            [listings.prices[:n], listings.beds[:n], listings.review_counts[:n], num_of]):
+        columns[name] = pd.array(np.where(values >= 0, values, 0), dtype='Int64')
+        columns[name][values < 0] = pd.NA
+    columns[baseline_data[6]] = listings.ratings[:n]
+    baseline_df = pd.DataFrame(columns, index=pd.Index(listings.ids, name=baseline_data[0]))
+    baseline_df = baseline_df[baseline_data[1:-1]]
+    baseline_df[baseline_data[-1]] = (100 * baseline_df['# of Vacant Days'] / scan_length).astype('Float64').round(1)
     return baseline_df
 
 #Converts vacancy database to Pandas Dataframe
-def vacancy_frame(scan):
-    cols = list()
-    cols.append('')
-    for item in scan:
-        cols.append(item.out())
-    blank_entry = pd.Series(len(scan)*["--"])
-    vac_df = pd.DataFrame(data=[blank_entry, blank_entry], columns=cols[1:], index=['blank', 'blank'])
-    for listing in ListingOnline.all_pulled:
-        listing_data = []
-        for i in range(1, len(cols)):
-            unit = '--'
-            for x in listing.vacant_dates:
-                if x.out() == cols[i]:
-
-                    unit = 'V'
-            listing_data.append(unit)
-        temp = pd.DataFrame(data=[listing_data], columns=cols[1:], index=[listing.id])
-        vac_df = vac_df.append(temp)
+#One boolean column per day of the scan, sliced straight out of the vacancy store
+def vacancy_frame(scan, session=None):
+    store = session_for(session).online
+    n = len(store)
+    cols = store._cols(scan)
+    vac_df = pd.DataFrame(store.vacant[:n][:, cols], columns=[item.out() for item in scan],
+                          index=pd.Index(store.ids, name='ID'))
     return vac_df
 
 
+#Plans an incremental refresh on top of a previous run of the market
+#Every cell is probed (page 1 only), cells with the same page count as last time and a
+#baseline that is not due under cell_age (see refresh_due) are carried over from the store
+#with their listings, and the nights of the scan that are not stale under the schedule keep
+#their vacancy from it
+#Returns the cells and nights still to scrape, the nights to load from the store and the
+#[total, sample] carried over
+def refresh_plan(session, store, run_id, searches, scan, schedule=REFRESH_SCHEDULE, cell_age=7):
+    cells = store.cell_state(session.loc_title, run_id)
+    probes = fetcher.map(lambda search_on: search_probe(search_on, session.extract_mode, session.metrics,
+                                                        session.retry), searches)
+    now = datetime.datetime.now()
+    today = Date.to_form(now.date())
+    changed = []
+    kept = []
+    for slot, (search_on, (pages, first)) in enumerate(zip(searches, probes)):
+        search_on.pages = pages
+        search_on.first = first
+        previous = cells.get(search_on.query())
+        if previous is None or previous[0] != pages or previous[4] is None or \
+                refresh_due((now - datetime.datetime.fromisoformat(previous[4])).days, cell_age, slot, today.index):
+            changed.append(search_on)
+        else:
+            kept.append(search_on)
+    store.load_cells(session, run_id, kept)
+    carried = [sum(search_on.readable for search_on in kept), sum(search_on.sample for search_on in kept)]
+    nights = store.night_state(session.loc_title, run_id)
+    dates = stale_dates(scan, nights, schedule, now)
+    kept_dates = [date_on for date_on in scan if date_on not in dates]
+    session.metrics.set('air_refresh_cells', len(changed), result='scraped')
+    session.metrics.set('air_refresh_cells', len(kept), result='carried')
+    session.metrics.set('air_refresh_nights', len(dates), result='scraped')
+    session.metrics.set('air_refresh_nights', len(kept_dates), result='carried')
+    print('Refresh: ' + str(len(changed)) + '/' + str(len(searches)) + ' cells, ' + str(len(dates)) + '/' +
+          str(len(scan)) + ' nights to scrape')
+    return changed, dates, kept_dates, carried
+
+
 #Combines all prior methods into one method
 #Takes location title, coordinates, base url, url extention, window size, name of excel document
 #for output
-def full_run(loc_title, coordinates, url, path, scan_length, book, new):
-    start = Date.to_form(datetime.date.today() + datetime.timedelta(1))
-    search_list = MapSearch.chop(MapSearch.clean(url, coordinates), 3)
-    scan = days_forward(start, scan_length)
+#adaptive=True replaces the fixed pieces x pieces grid with adaptive quadtree cells
+#extract='json' reads listings from the embedded page state, falling back to the html cards
+#charts='offline' writes all charts to "<title> Charts.html" in one batch, 'cloud' uploads them
+#Each run works in its own ScrapeSession (a new one unless one is passed in)
+#Results are saved to the market's SQLite store ("<title> Data.sqlite" unless a DataStore is
+#passed in). The Excel baseline, demand and vacancy sheets are an optional view of the store,
+#written when an ExcelExport is given as book (the caller closes it) or new is not 'new'
+#(added to the existing "<title> Data.xlsx", saved at the end of the run)
+#The run's metrics are written to "<title> Metrics.json", or "<title> Metrics.prom" with
+#metrics='prometheus' (metrics=None skips the export)
+#retry is the run's RetryPolicy (backoff, retry budget and circuit breaker), default settings if None
+#refresh=True builds on the market's last finished run instead of scraping everything again:
+#only cells whose page count changed and nights that are new or stale under the schedule
+#are scraped (see refresh_plan), with a full run when there is no previous run
+#Progress is checkpointed to the store after every page, map cell and night, resume is the
+#id of an interrupted run to carry on with (see resume_run)
+def full_run(loc_title, coordinates, url, path, scan_length, book=None, new='new', pieces=3, adaptive=False,
+             extract='xpath', charts='offline', session=None, store=None, metrics='json', retry=None, refresh=False,
+             schedule=REFRESH_SCHEDULE, cell_age=7, resume=None):
+    if session is None:
+        session = ScrapeSession(loc_title, extract, charts, retry=retry)
+    if store is None:
+        store = DataStore(loc_title + " Data.sqlite")
+    previous = None
+    if resume is not None:
+        run_id, scan_start, scan_length = store.conn.execute(
+            'SELECT id, scan_start, scan_length FROM runs WHERE id = ?', (resume,)).fetchone()
+        start = Date(scan_start)
+    else:
+        if refresh:
+            previous = store.latest_run(loc_title, finished=True)
+        start = Date.to_form(datetime.date.today() + datetime.timedelta(1))
+        run_id = store.start_run(loc_title, start.out(), scan_length)
+    session.checkpoint = Checkpoint(store, session, run_id)
+    area = MapSearch.clean(url, coordinates)
+    with session.metrics.timer('air_stage_seconds', stage='search'):
+        if resume is not None:
+            search_list = store.run_searches(loc_title, run_id, url)
+        elif adaptive:
+            search_list = area.adaptive(mode=session.extract_mode, metrics=session.metrics, retry=session.retry)
+        else:
+            search_list = area.chop(pieces)
+        if resume is None:
+            session.checkpoint.plan_cells(search_list)
+    session.metrics.set('air_search_cells', len(search_list))
+    session.searches = search_list
+    scan = days_forward(start, scan_length, session)
+    cells = search_list
+    dates = None
+    carried = (0, 0)
+    if resume is not None:
+        cells, dates, kept_dates, carried = store.restore(session, run_id, search_list, scan)
+    elif previous is not None:
+        with session.metrics.timer('air_stage_seconds', stage='refresh'):
+            cells, dates, kept_dates, carried = refresh_plan(session, store, previous, search_list, scan, schedule,
+                                                             cell_age)
+        session.checkpoint.carry_cells([search_on for search_on in search_list if search_on not in cells])
     plots = list()
-    plots.append(run(loc_title, path, search_list))
-    vac_results = vacancy(loc_title, url, path, scan)
+    with session.metrics.timer('air_stage_seconds', stage='baseline'):
+        plots.append(run(loc_title, path, cells, session, carried))
+    with session.metrics.timer('air_stage_seconds', stage='online'):
+        if resume is not None:
+            store.load_nights(session, run_id, kept_dates)
+        elif previous is not None:
+            store.load_nights(session, previous, kept_dates)
+            session.checkpoint.carry_nights(kept_dates, previous)
+        vac_results = vacancy(loc_title, url, path, scan, session, dates)
+    with session.metrics.timer('air_stage_seconds', stage='store'):
+        store.save_session(session, run_id)
+        store.finish_run(run_id)
     vac = vac_results[0]
     plots.insert(0, vac)
-    minimum = vac_results[1][0]
-    mins = []
-    for num in minimum:
-        mins.append(Date.scan[num-1])
-    for item in mins:
-        plots.append(run_a_date(loc_title, item))
-    out = []
-    for item in plots:
-        out.append(fileid_from_url(item))
-    end_time = datetime.datetime.now()
-    global start_time
-    diff = end_time - start_time
-    print("Time Elapsed: "+str(diff))
+    report = vac_results[1]
+    with session.metrics.timer('air_stage_seconds', stage='charts'):
+        session.density.curves(loc_title, report, report.spike_dates(),
+                               range(1, session.listings.highest_bed_number + 1))
+        for item in report.spike_dates():
+            plots.append(run_a_date(loc_title, item, session, report))
+        if session.chart_backend == 'cloud':
+            out = []
+            for item in plots:
+                out.append(fileid_from_url(item))
+        else:
+            out = session.charts.render(plots)
     if not new == 'new':
         book = initialize_workbook(loc_title)
-    baseline_frame(scan_length).to_excel(book, start.out()+' Baseline')
+    if book is not None:
+        with session.metrics.timer('air_stage_seconds', stage='export'):
+            book.write_frame(start.out()+' Baseline', store.baseline_frame(loc_title, run_id, scan_length))
+            book.write_frame(start.out()+' Demand', report.frame())
+            book.write_frame(start.out()+' Vacancy', vacancy_frame(scan, session))
+            if not new == 'new':
+                book.close()
+    session.metrics.set('air_listings', len(session.listings))
+    session.metrics.set('air_run_seconds', session.elapsed().total_seconds())
+    if metrics == 'prometheus':
+        session.metrics.write(loc_title + " Metrics.prom", metrics)
+    elif metrics is not None:
+        session.metrics.write(loc_title + " Metrics.json")
+    print(loc_title + " - Time Elapsed: "+str(session.elapsed()))
 
     return out
 
 
-location_title = "Boca Raton"
-location = "boca-raton"
-coords = 'ne_lat=18.478222609602486&ne_lng=-66.10346080373603&sw_lat=18.456396421667705&sw_lng=-66.12285853933173'
-url = "https://www.airbnb.com/s/"+location+"?room_types%5B%5D=Entire%20home%2Fapt"
-path = "&section_offset="
-workbook = pd.ExcelWriter(location_title+" Data.xlsx")
+#Picks up the market's latest interrupted run where its checkpoints left off: the run's own
+#map cells are scraped, finished cells and nights are loaded from the store, partly scraped
+#ones skip the pages they finished, and the run then completes like full_run (same window as
+#the original run). Takes full_run's arguments, and runs full_run from scratch when there is
+#nothing to resume: the latest run finished, or its window has already started
+def resume_run(loc_title, coordinates, url, path, scan_length, store=None, **kwargs):
+    if store is None:
+        store = DataStore(loc_title + " Data.sqlite")
+    unfinished = store.unfinished_run(loc_title)
+    if unfinished is None:
+        print(loc_title + ' - No interrupted run, starting a new one')
+        return full_run(loc_title, coordinates, url, path, scan_length, store=store, **kwargs)
+    if not Date.to_form(datetime.date.today()) < Date(unfinished[1]):
+        print(loc_title + ' - Window of run ' + str(unfinished[0]) + ' started ' + unfinished[1] +
+              ', starting a new one')
+        return full_run(loc_title, coordinates, url, path, scan_length, store=store, **kwargs)
+    print(loc_title + ' - Resuming run ' + str(unfinished[0]) + ' from ' + unfinished[1])
+    return full_run(loc_title, coordinates, url, path, scan_length, store=store, resume=unfinished[0], **kwargs)
+
+
+#Batch runner, runs full_run for several markets at once, each in its own session
+#markets is a list of dicts of full_run arguments, all runs share the fetch layer
+#Returns a dict of location title -> full_run output (or the exception the run raised)
+def run_markets(markets, max_workers=4):
+    results = dict()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = dict()
+        for market in markets:
+            futures[market['loc_title']] = pool.submit(full_run, **market)
+        for title, future in futures.items():
+            try:
+                results[title] = future.result()
+            except Exception as error:
+                print(title + ' - Run failed: ' + repr(error))
+                results[title] = error
+    return results
+
+
+if __name__ == '__main__':
+    location_title = "Boca Raton"
+    location = "boca-raton"
+    coords = 'ne_lat=18.478222609602486&ne_lng=-66.10346080373603&sw_lat=18.456396421667705&sw_lng=-66.12285853933173'
+    url = "https://www.airbnb.com/s/"+location+"?room_types%5B%5D=Entire%20home%2Fapt"
+    path = "&section_offset="
+    configure_fetcher(cache=ResponseCache(location_title + " Cache"))
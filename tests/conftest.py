@@ -0,0 +1,38 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Z Danial - AirAnalytics Source.py')
+
+
+#The source file name has spaces in it, so it is loaded by path
+@pytest.fixture(scope='session')
+def air():
+    spec = importlib.util.spec_from_file_location('air_analytics', SOURCE)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['air_analytics'] = module
+    spec.loader.exec_module(module)
+    module.configure_pipeline(parse_workers=0)
+    return module
+
+
+#Runs full_run, resume_run or a refresh of a small fake market into a store under tmp_path,
+#charts are rendered to "<title> Charts.html" there. Returns the session, the store and the
+#number of requests made
+@pytest.fixture
+def market(air, tmp_path, monkeypatch):
+    from pages import FakeFetcher, quiet
+    monkeypatch.chdir(tmp_path)
+
+    def run(title, function, crash_at=None, **kwargs):
+        fetcher = FakeFetcher(crash_at)
+        monkeypatch.setattr(air, 'fetcher', fetcher)
+        session = air.ScrapeSession(title)
+        store = air.DataStore(str(tmp_path / (title + ' Data.sqlite')))
+        quiet(function, title, 'ne_lat=18.47&ne_lng=-66.10&sw_lat=18.45&sw_lng=-66.12',
+              'https://www.airbnb.com/s/homes?x=1', '&section_offset=', 6, pieces=2, session=session, store=store,
+              metrics=None, **kwargs)
+        return session, store, fetcher.calls
+    return run
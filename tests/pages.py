@@ -0,0 +1,49 @@
+import contextlib
+import io
+
+WRAPPER = ('<div class="listingCardWrapper_9kg52c"><div class="listingContainer_f21qs6" id="listing-%d">'
+           '<div class="infoContainer_v72lrv">%s</div></div></div>')
+
+
+#A listing card in the markup the xpath selectors expect, inner is its info container
+def card(i, inner, name='Listing %d - Entire home - Boca Raton'):
+    if '%' in name:
+        name = name % i
+    return ('<div itemprop="itemListElement"><meta itemprop="name" content="' + name + '"/>' +
+            WRAPPER % (i, inner) + '</div>')
+
+
+def page(cards, last_page=17):
+    buttons = ''.join('<li class="buttonContainer_1am0dt"><a>%d</a></li>' % n for n in [1, last_page])
+    return ('<html><body><div>' + ''.join(cards) + '<ul>' + buttons + '</ul></div></body></html>').encode()
+
+
+def quiet(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+
+#Serves every search page from the map cell and page offset in its url: cells overlap in the
+#listings they show, and every night is vacant. crash_at raises after that many requests
+class FakeFetcher:
+    max_workers = 4
+
+    def __init__(self, crash_at=None):
+        self.crash_at = crash_at
+        self.calls = 0
+
+    def get(self, url, metrics=None, fresh=False):
+        if self.crash_at is not None and self.calls >= self.crash_at:
+            raise RuntimeError('crash')
+        self.calls += 1
+        offset = int(url.split('section_offset=')[1]) if 'section_offset=' in url else 0
+        cell = sum(map(ord, url.split('&section_offset')[0])) % 7
+        start = cell * 100 + offset * 18
+        return page([card(i, '<span>$%d</span><span>%d beds</span><span>%d reviews</span>'
+                          % (100 + i % 400, 1 + i % 4, i % 90)) for i in range(start, start + 18)])
+
+    def can_refetch(self):
+        return True
+
+    def map(self, function, items):
+        return [function(item) for item in items]
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+
+#300 listings scattered over about 20 x 20 km around Boca Raton, every tenth without coordinates
+@pytest.fixture
+def session(air):
+    rng = np.random.default_rng(3)
+    session = air.ScrapeSession('Area')
+    for i in range(300):
+        lat, lng = 26.3 + rng.uniform(-0.1, 0.1), -80.1 + rng.uniform(-0.1, 0.1)
+        if i % 10 == 0:
+            lat = lng = '--'
+        air.Listing(str(i), 'Listing ' + str(i), 'Entire home', 'Boca Raton', 100 + i, 1 + i % 3, 4.5, 10, session,
+                    lat, lng)
+    return session
+
+
+def located(session):
+    return [listing for listing in session.listings if listing.lat != '--']
+
+
+@pytest.mark.parametrize('box', [(26.28, -80.12, 26.31, -80.08), (26.0, -81.0, 27.0, -79.0), (26.5, -80.0, 26.6, -79.9)])
+def test_within_box_matches_a_full_scan(air, session, box):
+    sw_lat, sw_lng, ne_lat, ne_lng = box
+    expected = [listing.id for listing in located(session)
+                if sw_lat <= listing.lat <= ne_lat and sw_lng <= listing.lng <= ne_lng]
+    assert [listing.id for listing in air.Listing.within_box(*box, session=session)] == expected
+
+
+def test_within_radius_matches_a_full_scan_nearest_first(air, session):
+    distances = dict((listing.id, air.distance_km(26.3, -80.1, listing.lat, listing.lng))
+                     for listing in located(session))
+    found = air.Listing.within_radius(26.3, -80.1, 4, session=session)
+    assert sorted(listing.id for listing in found) == sorted(ident for ident, km in distances.items() if km <= 4)
+    assert [distances[listing.id] for listing in found] == sorted(distances[listing.id] for listing in found)
+    assert len(found) > 0
+
+
+def test_a_listing_seen_again_keeps_its_first_row(air, session):
+    air.Listing('5', 'Again', 'Private room', 'Delray', 999, 4, 3.0, 1, session, 26.3, -80.1)
+    assert len(session.listings) == 300
+    assert (session.listings.search_by_id('5').title, session.listings.search_by_id('5').price) == ('Listing 5', 105)
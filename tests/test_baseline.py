@@ -0,0 +1,26 @@
+from pages import card, page, quiet
+
+GOOD = '<span>$100</span><span>2 beds</span><span>5 reviews</span>'
+
+
+def records(air, cards):
+    return quiet(air.parse_page, page(cards))
+
+
+def test_rejected_page_leaves_the_baseline_untouched(air):
+    session = air.ScrapeSession('Baseline')
+    unreadable = '<div itemprop="itemListElement"></div>'
+    rejected = records(air, [card(i, GOOD) for i in range(4)] + [unreadable] * 2)
+    assert quiet(air.Listing.baseline_processor, rejected, session) == [0, 0]
+    assert len(session.listings) == 0
+    accepted = records(air, [card(i, GOOD) for i in range(5)])
+    assert quiet(air.Listing.baseline_processor, accepted, session) == [5, 500, 5]
+    assert len(session.listings) == 5
+
+
+def test_listing_without_price_adds_a_unit_but_no_price(air):
+    session = air.ScrapeSession('Baseline')
+    cards = [card(i, GOOD) for i in range(9)] + [card(9, '<span>no price</span><span>2 beds</span>')]
+    assert quiet(air.Listing.baseline_processor, records(air, cards), session) == [10, 900, 10]
+    again = [card(i, GOOD) for i in range(5, 15)]
+    assert quiet(air.Listing.baseline_processor, records(air, again), session) == [10, 500, 5]
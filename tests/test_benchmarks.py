@@ -0,0 +1,54 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import sys
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'Z Danial - AirAnalytics Benchmarks.py')
+
+
+def load_benchmarks():
+    spec = importlib.util.spec_from_file_location('air_benchmarks', BENCHMARKS)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run(bench, *argv):
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        code = bench.main(list(argv))
+    return code, out.getvalue()
+
+
+#A tiny run of every stage, saved as a baseline and compared against itself and against a
+#baseline it cannot match. The suite loads its own copy of the source, the session's copy is
+#put back afterwards
+def test_small_suite_saves_and_compares_baselines(air, tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'air_analytics', air)
+    bench = load_benchmarks()
+    saved = str(tmp_path / 'baseline.json')
+    small = ['--page-count', '4', '--sizes', '200', '--windows', '30']
+    code, out = run(bench, *small + ['--save', saved])
+    assert code == 0 and 'Baseline saved' in out
+    with open(saved) as f:
+        results = json.load(f)
+    assert any(key.startswith('baseline_processor') for key in results)
+    assert any(key.startswith('vacancy_frame') for key in results)
+    assert all(result['throughput'] > 0 for result in results.values())
+    for result in results.values():
+        result['throughput'] *= 1000
+    faster = str(tmp_path / 'faster.json')
+    with open(faster, 'w') as f:
+        json.dump(results, f)
+    code, out = run(bench, *small + ['--compare', faster])
+    assert code == 1 and 'REGRESSION' in out
+
+
+def test_regressions_only_flag_drops_past_the_tolerance():
+    bench = load_benchmarks()
+    baseline = {'a': {'throughput': 100.0}, 'b': {'throughput': 100.0}, 'c': {'throughput': 0}}
+    results = {'a': {'throughput': 85.0}, 'b': {'throughput': 70.0}, 'c': {'throughput': 1.0},
+               'd': {'throughput': 1.0}}
+    assert bench.regressions(results, baseline, 0.2) == [('b', 100.0, 70.0)]
@@ -0,0 +1,62 @@
+import os
+import time
+
+import pytest
+
+from pages import card, page
+
+
+class Response:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+#A Fetcher whose network is a list of responses served in order
+@pytest.fixture
+def network(air, tmp_path):
+    def make(responses, **kwargs):
+        fetcher = air.Fetcher(rate=0, cache=air.ResponseCache(str(tmp_path / 'cache'), **kwargs))
+        served = list(responses)
+        fetcher.session.get = lambda url, timeout=None: Response(served.pop(0))
+        return fetcher
+    return make
+
+
+GOOD = page([card(1, '<span>$100</span><span>2 beds</span>')])
+
+
+def test_cache_serves_a_page_until_its_ttl(air, network):
+    fetcher = network([GOOD, GOOD], ttl=60)
+    assert fetcher.get('https://example.com/s?b=2&a=1') == GOOD
+    assert fetcher.get('https://EXAMPLE.com/s?a=1&b=2') == GOOD
+    assert fetcher.metrics.counters[('air_cache_hits_total', ())] == 1
+    assert fetcher.metrics.counters[('air_cache_misses_total', ())] == 1
+    path = fetcher.cache._path(air.ResponseCache.key('https://example.com/s?a=1&b=2'))
+    os.utime(path, (time.time(), time.time() - 120))
+    assert fetcher.get('https://example.com/s?a=1&b=2') == GOOD
+    assert fetcher.metrics.counters[('air_cache_misses_total', ())] == 2
+
+
+def test_cache_evicts_least_recently_used(air, tmp_path):
+    cache = air.ResponseCache(str(tmp_path / 'cache'), max_bytes=25)
+    for name in 'abc':
+        cache.put('https://example.com/' + name, b'x' * 10)
+        time.sleep(0.01)
+    assert cache.get('https://example.com/a') is None
+    assert cache.get('https://example.com/c') == b'x' * 10
+    assert cache.size == 20
+
+
+def test_pages_without_listings_are_not_cached(air, network):
+    fetcher = network([b'<html><body>blocked</body></html>', GOOD, b'not served'])
+    assert fetcher.get('https://example.com/s') == b'<html><body>blocked</body></html>'
+    assert fetcher.get('https://example.com/s') == GOOD
+    assert fetcher.get('https://example.com/s') == GOOD
+
+
+def test_offline_replays_the_cache_and_never_fetches(air, network, tmp_path):
+    network([GOOD]).get('https://example.com/s')
+    offline = network([], offline=True, ttl=0)
+    assert offline.get('https://example.com/s') == GOOD
+    assert offline.get('https://example.com/other') == b''
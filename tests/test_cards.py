@@ -0,0 +1,57 @@
+from pages import card, page, quiet
+
+
+EDGE_PAGE = page([
+    card(1, '<span>$120</span><span>$95</span><span>1 bed</span><span>7 reviews</span>'),
+    card(2, '<span>no price</span><span>2 beds</span>'),
+    card(3, '<span>$1,2,3</span><span>x beds</span><span>12 reviews · new</span>'),
+    card(4, '<span>$ 12</span><span>3 beds</span><span>2 beds</span>'),
+    '<div itemprop="itemListElement"><meta itemprop="name" content="A - B - C"/></div>',
+    '<div itemprop="itemListElement"></div>',
+])
+
+
+def test_card_fields_edge_cards(air):
+    tree = air.etree.fromstring(EDGE_PAGE, air.PAGE_PARSER)
+    fields = air.CardFields(air.LISTING_NODES(tree))
+    assert [card is None for card in fields.cards] == [False, False, False, False, True, True]
+    assert fields.first_price.tolist() == [120, -1, 123, -1, -1, -1]
+    assert fields.price.tolist() == [95, -1, 123, -1, -1, -1]
+    assert fields.beds.tolist() == [1, 2, -1, 2, -1, -1]
+    assert fields.reviews.tolist() == [7, -1, 12, -1, -1, -1]
+
+
+def test_parse_page_edge_cards(air):
+    records = quiet(air.parse_page, EDGE_PAGE)
+    assert records[0]['id'] == '1'
+    assert (records[0]['name'], records[0]['typo'], records[0]['city']) == ('Listing 1', 'Entire home', 'Boca Raton')
+    assert (records[0]['price'], records[0]['beds'], records[0]['review_count']) == (95, 1, 7)
+    assert (records[1]['price'], records[1]['beds'], records[1]['error']) == ('--', 2, 1)
+    assert (records[2]['price'], records[2]['beds'], records[2]['review_count']) == (123, '--', 12)
+    assert records[4:] == [air.CARD_ERROR, air.CARD_ERROR]
+    online = quiet(air.parse_page, EDGE_PAGE, online=True)
+    assert (online[0]['id'], online[0]['price']) == ('1', 120)
+    assert online[4:] == [[0, 0], [0, 0]]
+
+
+RATED = ('<span>$80</span><span>3 beds</span><div class="ratingContainer_inline_36rlri">'
+         '<span role="img" aria-label="Rating 4.5 out of 5"></span>'
+         '<span class="text_5mbkop-o_O-size_micro_16wifzf-o_O-inline_g86r3e">243</span></div>')
+
+
+def test_rating_block(air):
+    record = quiet(air.parse_page, page([card(1, RATED)]))[0]
+    assert (record['rating'], record['review_count'], record['error']) == (4.5, 243, 0)
+
+
+def test_online_cards_of_known_listings_skip_the_listing_record(air):
+    records = quiet(air.parse_page, page([card(1, RATED), card(2, RATED)]), online=True, known=frozenset(['1']))
+    assert [(record['id'], record['price']) for record in records] == [('1', 80), ('2', 80)]
+    assert records[0]['listing'] == air.CARD_ERROR
+    assert records[1]['listing']['rating'] == 4.5
+
+
+def test_cards_nested_in_rows_are_all_found(air):
+    rows = page(['<div class="row">' + card(1, RATED) + card(2, RATED) + '</div>',
+                 '<div class="row">' + card(3, RATED) + '</div>'])
+    assert [record['id'] for record in quiet(air.parse_page, rows)] == ['1', '2', '3']
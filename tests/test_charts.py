@@ -0,0 +1,23 @@
+import plotly.graph_objs as go
+
+
+def test_chart_batch_renders_one_file(air, tmp_path):
+    batch = air.ChartBatch('Charts', str(tmp_path))
+    batch.add(go.Figure(data=[go.Bar(x=[1, 2], y=[3, 4])]), 'bars')
+    batch.add(go.Figure(data=[go.Scatter(x=[1, 2], y=[3, 4])]), 'lines')
+    links = batch.render()
+    path = str(tmp_path / 'Charts Charts.html')
+    assert links == [path + '#chart-0', path + '#chart-1']
+    with open(path, encoding='utf-8') as f:
+        page = f.read()
+    assert page.count('<div id="chart-') == 2
+    assert page.count('plotly.js v') == 1
+
+
+def test_full_run_renders_its_charts(air, market, tmp_path):
+    session, store, calls = market('Rendered', air.full_run)
+    with open(str(tmp_path / 'Rendered Charts.html'), encoding='utf-8') as f:
+        page = f.read()
+    assert page.count('<div id="chart-') == len(session.charts.charts) >= 2
+    assert 'Rendered Vacancy Report' in page
+    assert 'Total Vacancy' in page
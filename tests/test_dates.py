@@ -0,0 +1,27 @@
+import datetime
+
+
+def test_dates_roll_over_months_years_and_leap_days(air):
+    assert air.Date('2024-02-28').add_days(1).out() == '2024-02-29'
+    assert air.Date('2024-02-28').add_days(2).out() == '2024-03-01'
+    assert air.Date('2023-02-28').add_days(1).out() == '2023-03-01'
+    assert air.Date('2025-12-31').add_days(1).out() == '2026-01-01'
+    assert air.Date('2026-01-31').add_days(1).out() == '2026-02-01'
+    assert air.Date('2026-03-01').add_days(-1).out() == '2026-02-28'
+    assert air.Date('2024-03-01').add_days(-1).out() == '2024-02-29'
+
+
+def test_old_format_and_derived_fields(air):
+    date_on = air.Date('02/29/2024')
+    assert date_on == air.Date('2024-02-29')
+    assert (date_on.year, date_on.month, date_on.string_day, date_on.day) == ('2024', '02', '29', 29)
+    assert date_on.path() == '&checkin=2024-02-29&checkout=2024-03-01'
+    assert air.Date.to_form(datetime.date(2024, 2, 29)) == date_on
+    assert air.Date.from_index(date_on.index) == date_on and hash(date_on) == date_on.index
+
+
+def test_scan_window_across_a_leap_day(air):
+    scan = air.days_forward(air.Date('2024-02-27'), 4)
+    assert air.Date.list_out(scan) == ['2024-02-27', '2024-02-28', '2024-02-29', '2024-03-01', '2024-03-02']
+    assert air.day_indices(scan).tolist() == list(range(scan[0].index, scan[0].index + 5))
+    assert sorted([scan[2], scan[0], scan[1]]) == scan[:3]
@@ -0,0 +1,33 @@
+import numpy as np
+
+
+#Ten listings over 15 nights: 1 bed listings (even ids) at $100 and 2 bed listings at $200,
+#total vacancy alternates 9 / 10 and drops to 2 on the eighth night
+def report(air):
+    store = air.VacancyStore()
+    period = [air.Date('2026-02-20').add_days(day) for day in range(15)]
+    store.set_period(period)
+    for day, date_on in enumerate(period):
+        vacant = 2 if day == 7 else 9 + day % 2
+        for listing in range(vacant):
+            store.mark(str(listing), 1 + listing % 2, date_on, 100 * (1 + listing % 2))
+    return air.DemandReport(store, period), period
+
+
+def test_spikes_are_the_unusually_low_vacancy_nights(air):
+    demand, period = report(air)
+    assert demand.total.tolist() == [2 if day == 7 else 9 + day % 2 for day in range(15)]
+    assert demand.spike_dates() == [period[7]]
+    assert period[7] in demand.minima_dates()
+    assert len(demand.minima_dates()) > len(demand.spike_dates())
+    assert demand.frame()['Spike'].tolist() == [day == 7 for day in range(15)]
+
+
+def test_vacancy_and_prices_by_bed_count(air):
+    demand, period = report(air)
+    assert demand.vacant_count(1, period[0]) == 5
+    assert demand.vacant_count(2, period[7]) == 1
+    assert demand.vacant_count(3, period[0]) == 0
+    assert demand.bed_prices(2, period[0]) == [200] * 4
+    assert demand.vacancy_rate[:, 7].tolist() == [0.2, 0.2]
+    assert np.allclose(demand.quantiles[:, 1], [100, 100, 150, 200, 200])
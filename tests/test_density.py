@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+stats = pytest.importorskip('scipy.stats')
+
+
+def prices(seed=7):
+    rng = np.random.default_rng(seed)
+    return np.concatenate([rng.normal(150, 30, 300), rng.normal(400, 60, 100)]).round()
+
+
+@pytest.mark.parametrize('bandwidth', ['scott', 'silverman'])
+def test_density_matches_gaussian_kde(air, bandwidth):
+    values = prices()
+    engine = air.DensityEngine(bandwidth=bandwidth)
+    lo, hi = values.min() - 100, values.max() + 100
+    y = engine._smooth([(values, lo, hi)])[0]
+    exact = stats.gaussian_kde(values, bw_method=bandwidth)(np.linspace(lo, hi, engine.points))
+    assert np.abs(y - exact).max() < 0.01 * exact.max()
+    assert abs(y.sum() * (hi - lo) / (engine.points - 1) - 1) < 0.01
+
+
+def test_curves_per_bed_count_are_cached(air):
+    store = air.VacancyStore()
+    period = [air.Date('2026-03-01'), air.Date('2026-03-02')]
+    store.set_period(period)
+    for i, price in enumerate(prices()):
+        store.mark(str(i), 1 + i % 2, period[0], int(price))
+    store.mark('x', 3, period[0], 100)
+    report = air.DemandReport(store, period)
+    engine = air.DensityEngine()
+    curves = engine.curves('M', report, period, [1, 2, 3])
+    assert [bed for bed, x, y in curves[period[0]]] == [1, 2]
+    assert curves[period[1]] == []
+    for bed, x, y in curves[period[0]]:
+        exact = stats.gaussian_kde(report.bed_prices(bed, period[0]))(x)
+        assert np.abs(np.asarray(y) - exact).max() < 0.01 * exact.max()
+    assert engine.curves('M', None, period[:1], [1, 2, 3]) == {period[0]: curves[period[0]]}
+
+
+def test_unknown_bandwidth(air):
+    with pytest.raises(ValueError):
+        air.DensityEngine(bandwidth='wide')
@@ -0,0 +1,34 @@
+import pandas as pd
+from openpyxl import load_workbook
+
+
+def sheets(filename):
+    book = load_workbook(filename, read_only=True)
+    try:
+        return dict((sheet.title, [list(row) for row in sheet.iter_rows(values_only=True)]) for sheet in book.worksheets)
+    finally:
+        book.close()
+
+
+def test_export_carries_over_the_sheets_it_does_not_write(air, tmp_path):
+    filename = str(tmp_path / 'M Data.xlsx')
+    with air.ExcelExport(filename) as book:
+        book.write_rows('A', [[1, 2]], ['x', 'y'])
+        book.write_rows('B', [['old']])
+    with air.ExcelExport(filename) as book:
+        book.write_rows('B', [['new']])
+        book.write_frame('C', pd.DataFrame({'Price': [100.0, float('nan')], 'Beds': [1, 2]}, index=pd.Index(['1', '2'], name='ID')))
+    out = sheets(filename)
+    assert list(out) == ['A', 'B', 'C']
+    assert out['A'] == [['x', 'y'], [1, 2]]
+    assert out['B'] == [['new']]
+    assert out['C'] == [['ID', 'Price', 'Beds'], ['1', 100, 1], ['2', None, 2]]
+
+
+def test_export_without_keep_replaces_the_file(air, tmp_path):
+    filename = str(tmp_path / 'M Data.xlsx')
+    with air.ExcelExport(filename) as book:
+        book.write_rows('A', [[1]])
+    with air.ExcelExport(filename, keep=False) as book:
+        book.write_rows('B', [[2]])
+    assert list(sheets(filename)) == ['B']
@@ -0,0 +1,137 @@
+import threading
+import time
+
+from pages import card, page
+
+
+class Response:
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+
+
+#A network that answers every url with a page naming it after a short delay, and counts the
+#requests and the most requests in flight at once
+class SlowNetwork:
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.urls = []
+        self.active = 0
+        self.peak = 0
+
+    def get(self, url, timeout=None):
+        with self.lock:
+            self.urls.append(url)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        return Response(page([card(1, '<span>$100</span>', name=url)]))
+
+
+def fetcher_on(air, network, **kwargs):
+    fetcher = air.Fetcher(**kwargs)
+    fetcher.session.get = network.get
+    return fetcher
+
+
+def test_map_keeps_order_and_limits_requests_per_host(air):
+    network = SlowNetwork()
+    fetcher = fetcher_on(air, network, max_workers=8, per_host=2, rate=0)
+    urls = ['https://a.example/%d' % i for i in range(6)] + ['https://b.example/%d' % i for i in range(6)]
+    try:
+        pages = fetcher.map(fetcher.get, urls)
+    finally:
+        fetcher.close()
+    assert [url.encode() in content for url, content in zip(urls, pages)] == [True] * 12
+    assert 2 < network.peak <= 4
+    assert fetcher.metrics.value('air_requests_total', status=200) == 12
+
+
+def test_requests_to_a_host_are_rate_limited(air):
+    network = SlowNetwork(delay=0)
+    fetcher = fetcher_on(air, network, max_workers=4, per_host=4, rate=20)
+    start = time.monotonic()
+    try:
+        fetcher.map(fetcher.get, ['https://a.example/%d' % i for i in range(6)])
+    finally:
+        fetcher.close()
+    assert time.monotonic() - start >= 5 / 20 * 0.9
+
+
+#A network whose response waits on a gate, so every caller arrives while the first request is
+#still in flight. With error set the request fails with it instead
+class GatedNetwork(SlowNetwork):
+    def __init__(self, error=None):
+        SlowNetwork.__init__(self, delay=0)
+        self.gate = threading.Event()
+        self.error = error
+
+    def get(self, url, timeout=None):
+        self.gate.wait(5)
+        if self.error is not None:
+            raise self.error
+        return SlowNetwork.get(self, url, timeout)
+
+
+def gated_gets(fetcher, network, url, callers=6):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(catch(fetcher.get, url))) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    while fetcher.metrics.value('air_requests_coalesced_total') < callers - 1:
+        time.sleep(0.01)
+    network.gate.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def catch(function, *args):
+    try:
+        return function(*args)
+    except Exception as error:
+        return error
+
+
+def test_concurrent_gets_of_a_url_share_one_request(air):
+    network = GatedNetwork()
+    fetcher = fetcher_on(air, network, rate=0)
+    try:
+        results = gated_gets(fetcher, network, 'https://a.example/1')
+        assert network.urls == ['https://a.example/1']
+        assert len(set(results)) == 1 and b'https://a.example/1' in results[0]
+        assert fetcher.metrics.value('air_requests_total', status=200) == 1
+        fetcher.get('https://a.example/1')
+        assert len(network.urls) == 2
+    finally:
+        fetcher.close()
+
+
+def test_waiters_see_the_error_of_the_shared_request(air):
+    network = GatedNetwork(error=air.requests.ConnectionError('down'))
+    fetcher = fetcher_on(air, network, rate=0)
+    try:
+        results = gated_gets(fetcher, network, 'https://a.example/1')
+    finally:
+        fetcher.close()
+    assert [type(result) for result in results] == [air.requests.ConnectionError] * 6
+    assert fetcher.metrics.value('air_request_errors_total') == 1
+
+
+#Page one of every search is the page its page count was probed from, so a run never asks
+#for the same url twice
+def test_a_run_requests_every_page_once(air, market, monkeypatch):
+    import pages
+    urls = []
+    get = pages.FakeFetcher.get
+
+    def recording(self, url, metrics=None, fresh=False):
+        urls.append(url)
+        return get(self, url, metrics, fresh)
+    monkeypatch.setattr(pages.FakeFetcher, 'get', recording)
+    session, store, calls = market('Once', air.full_run)
+    assert calls == len(urls) > 0
+    assert len(set(urls)) == len(urls)
@@ -0,0 +1,35 @@
+import pandas as pd
+
+
+def session_with(air):
+    session = air.ScrapeSession('Frames')
+    air.Listing('1', 'A', 'Entire home', 'Boca Raton', 100, 2, 4.5, 10, session)
+    air.Listing('2', 'B', 'Private room', 'Delray', '--', '--', '--', '--', session)
+    air.Listing('3', 'C', 'Entire home', 'Boca Raton', 300, 1, 3.0, 2, session)
+    scan = [air.Date('2026-03-01').add_days(i) for i in range(4)]
+    session.online.set_period(scan)
+    air.ListingOnline('1', scan[0], 90, session)
+    for day in [1, 3]:
+        air.ListingOnline.vacant_date('1', scan[day], 95, session)
+    air.ListingOnline('2', scan[2], 50, session)
+    return session, scan
+
+
+def test_baseline_frame(air):
+    session, scan = session_with(air)
+    frame = air.baseline_frame(len(scan), session)
+    assert frame.index.tolist() == ['1', '2', '3'] and frame.index.name == 'ID'
+    assert frame.columns.tolist() == ['Title', 'Type', 'City', 'Price', 'Beds', 'Rating', 'Number of Reviews',
+                                      '# of Vacant Days', '% Vacancy']
+    assert frame.loc['1'].tolist() == ['A', 'Entire home', 'Boca Raton', 100, 2, 4.5, 10, 3, 75.0]
+    assert frame.loc['2', 'Type'] == 'Private room' and frame.loc['2', '# of Vacant Days'] == 1
+    assert frame.loc[['2'], ['Price', 'Beds', 'Number of Reviews']].isna().all(axis=None)
+    assert pd.isna(frame.loc['3', '# of Vacant Days']) and pd.isna(frame.loc['3', '% Vacancy'])
+
+
+def test_vacancy_frame(air):
+    session, scan = session_with(air)
+    frame = air.vacancy_frame(scan, session)
+    assert frame.columns.tolist() == ['2026-03-01', '2026-03-02', '2026-03-03', '2026-03-04']
+    assert frame.astype(int).values.tolist() == [[1, 1, 0, 1], [0, 0, 1, 0]]
+    assert air.vacancy_frame(scan[1:3], session).astype(int).values.tolist() == [[1, 0], [0, 1]]
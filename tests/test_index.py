@@ -0,0 +1,26 @@
+def add(air, session, count, start=0):
+    for i in range(start, start + count):
+        air.Listing(str(i), 'Listing ' + str(i), 'Entire home', 'Boca Raton', 100 + i, 1 + i % 3, 4.5, 10, session)
+
+
+def test_lookups_by_id_title_and_bed_count(air):
+    session = air.ScrapeSession('Index')
+    add(air, session, 3000)
+    listings = session.listings
+    assert len(listings) == 3000 and '2999' in listings and '3000' not in listings
+    assert listings.search_by_id('1234').title == 'Listing 1234'
+    assert listings.search_by_title('Listing 77').id == '77'
+    assert listings.search_by_id('x') is None and listings.search_by_title('x') is None
+    assert listings.count_by_bed(1) == 1000
+    assert listings.list_by_bed(3)[:2] == [102, 105]
+    assert (listings.highest_bed_number, listings.highest_price) == (3, 3099)
+    assert air.Listing.count_by_bed(2, session) == 1000
+
+
+def test_missing_values_are_left_out_of_the_bed_queries(air):
+    session = air.ScrapeSession('Index')
+    air.Listing('1', 'A', 'Entire home', 'Boca Raton', '--', 2, '--', '--', session)
+    air.Listing('2', 'B', 'Entire home', 'Boca Raton', 150, '--', 4.0, 3, session)
+    assert session.listings.list_by_bed(2) == []
+    assert session.listings.count_by_bed(2) == 1
+    assert (session.listings.highest_bed_number, session.listings.highest_price) == (2, 150)
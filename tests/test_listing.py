@@ -0,0 +1,34 @@
+import pytest
+
+
+def test_views_read_back_what_was_scraped(air):
+    session = air.ScrapeSession('Listing')
+    first = air.Listing('1', 'A', 'Entire home', 'Boca Raton', 150, 2, 4.75, 12, session, 26.35, -80.08)
+    missing = air.Listing('2', 'B', 'Private room', 'Boca Raton', '--', '--', '--', '--', session)
+    assert first.out() == ('1', 'A', 'Entire home', 'Boca Raton', 150, 2, 4.75, 12)
+    assert missing.out() == ('2', 'B', 'Private room', 'Boca Raton', '--', '--', '--', '--')
+    assert (first.lat, first.lng, missing.lat, missing.lng) == (26.35, -80.08, '--', '--')
+    assert type(first.price) is int and type(first.beds) is int and type(first.rating) is float
+    assert [listing.id for listing in session.listings] == ['1', '2']
+    assert session.listings.search_by_id('2').out() == missing.out()
+    with pytest.raises(AttributeError):
+        first.extra = 1
+
+
+def test_a_listing_seen_again_keeps_its_row(air):
+    session = air.ScrapeSession('Listing')
+    air.Listing('1', 'A', 'Entire home', 'Boca Raton', 150, 2, 4.75, 12, session)
+    again = air.Listing('1', 'A', 'Entire home', 'Boca Raton', 99, 3, 4.0, 1, session, 26.35, -80.08)
+    assert len(session.listings) == 1 and again.row == 0
+    assert again.out() == ('1', 'A', 'Entire home', 'Boca Raton', 150, 2, 4.75, 12)
+    assert (again.lat, again.lng) == (26.35, -80.08)
+
+
+def test_columns_grow_and_intern_their_categories(air):
+    index = air.ListingIndex(capacity=4)
+    for i in range(10):
+        index.add(str(i), 'L' + str(i), ['Entire home', 'Private room'][i % 2], 'Boca Raton', 100 + i, 1, 4.5, i)
+    assert len(index.prices) == 16
+    assert (len(index.types), len(index.cities)) == (2, 1)
+    assert index.search_by_id('9').out() == ('9', 'L9', 'Private room', 'Boca Raton', 109, 1, 4.5, 9)
+    assert index.list_by_bed(1) == list(range(100, 110))
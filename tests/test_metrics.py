@@ -0,0 +1,48 @@
+import json
+import re
+
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"'
+                    r'(?:,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})? \S+$')
+
+
+def test_prometheus_text(air):
+    metrics = air.Metrics()
+    metrics.inc('air_requests_total', stage='baseline')
+    metrics.inc('air_requests_total', 2, stage='baseline')
+    metrics.set('air_listings', 7)
+    metrics.observe('air_parse_seconds', 0.02, buckets=(0.01, 0.1), stage='online')
+    metrics.observe('air_parse_seconds', 5, buckets=(0.01, 0.1), stage='online')
+    metrics.set('air_note', 1, title='a "b" \\ c')
+    assert metrics.to_prometheus().splitlines() == [
+        '# TYPE air_requests_total counter',
+        'air_requests_total{stage="baseline"} 3',
+        '# TYPE air_listings gauge',
+        'air_listings 7',
+        '# TYPE air_note gauge',
+        'air_note{title="a \\"b\\" \\\\ c"} 1',
+        '# TYPE air_parse_seconds histogram',
+        'air_parse_seconds_bucket{stage="online",le="0.01"} 0',
+        'air_parse_seconds_bucket{stage="online",le="0.1"} 1',
+        'air_parse_seconds_bucket{stage="online",le="+Inf"} 2',
+        'air_parse_seconds_sum{stage="online"} 5.02',
+        'air_parse_seconds_count{stage="online"} 2',
+    ]
+    assert json.loads(metrics.to_json())['counters'] == [
+        {'name': 'air_requests_total', 'labels': {'stage': 'baseline'}, 'value': 3}]
+
+
+def test_run_metrics_export(air, market, tmp_path):
+    session, store, calls = market('Metrics', air.full_run)
+    metrics = session.metrics
+    assert metrics.value('air_listings') == len(session.listings)
+    assert metrics.value('air_cards_total', stage='baseline', result='accepted') > 0
+    text = metrics.to_prometheus()
+    lines = text.splitlines()
+    assert all(SAMPLE.match(line) for line in lines if not line.startswith('#'))
+    names = [line.split()[2] for line in lines if line.startswith('# TYPE')]
+    assert len(names) == len(set(names))
+    assert 'air_stage_seconds_count{stage="online"} 1' in lines
+    metrics.write(str(tmp_path / 'm.prom'), 'prometheus')
+    metrics.write(str(tmp_path / 'm.json'))
+    assert open(str(tmp_path / 'm.prom')).read() == text
+    assert json.load(open(str(tmp_path / 'm.json'))) == metrics.to_dict()
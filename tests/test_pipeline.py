@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from pages import FakeFetcher, quiet
+
+URLS = ['https://www.airbnb.com/s/homes?x=%d&section_offset=%d' % (cell, offset)
+        for cell in range(3) for offset in range(4)]
+
+
+@pytest.fixture
+def pages(air, monkeypatch):
+    monkeypatch.setattr(air, 'fetcher', FakeFetcher())
+    return [(n, url) for n, url in enumerate(URLS)]
+
+
+def test_parse_pool_matches_inline_parsing(air, pages):
+    pipeline = air.ScrapePipeline(parse_workers=1)
+    try:
+        pooled = quiet(lambda: list(pipeline.run(pages)))
+    finally:
+        pipeline.close()
+    inline = quiet(lambda: list(air.ScrapePipeline(parse_workers=0).run(pages)))
+    assert [key for key, records in pooled] == list(range(len(URLS)))
+    assert all(records is not None and len(records) == 18 for key, records in pooled)
+    assert pooled == inline
+
+
+def test_parse_errors_stop_the_run(air, pages, monkeypatch):
+    def broken(content, online=False, mode='xpath', known=()):
+        raise ValueError('bad page')
+    monkeypatch.setattr(air, 'timed_parse', broken)
+    threads = threading.active_count()
+    with pytest.raises(RuntimeError, match='bad page'):
+        list(air.ScrapePipeline(parse_workers=0).run(pages))
+    assert threading.active_count() == threads
+
+
+def test_consumer_leaving_early_stops_the_stages(air, pages):
+    threads = threading.active_count()
+    run = air.ScrapePipeline(parse_workers=0, queue_size=2).run(pages)
+    quiet(next, run)
+    run.close()
+    assert threading.active_count() == threads
+
+
+def test_failed_run_leaves_no_pipeline_threads(air, market):
+    threads = threading.active_count()
+    with pytest.raises(RuntimeError):
+        market('Failed', air.full_run, crash_at=90)
+    assert threading.active_count() == threads
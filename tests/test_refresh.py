@@ -0,0 +1,52 @@
+import datetime
+
+
+#Daily refreshes of a 30 night window that starts tomorrow, after a full scrape on the first
+#day. Returns the number of nights scraped each day and the oldest night scraped each day
+def daily_refreshes(air, days, schedule=None):
+    schedule = schedule or air.REFRESH_SCHEDULE
+    scraped = {}
+    counts = []
+    oldest = []
+    for day in range(days):
+        now = datetime.datetime(2026, 2, 20, 6) + datetime.timedelta(days=day)
+        start = air.Date.to_form(now.date() + datetime.timedelta(1))
+        scan = [air.Date.from_index(index) for index in air.scan_window(start, start.add_days(30))]
+        due = air.stale_dates(scan, scraped, schedule, now)
+        ages = [(now - datetime.datetime.fromisoformat(scraped[date_on.out()])).days
+                for date_on in due if date_on.out() in scraped]
+        oldest.append(max(ages, default=0))
+        for date_on in due:
+            scraped[date_on.out()] = now.isoformat()
+        counts.append(len(due))
+    return counts, oldest
+
+
+def test_daily_refreshes_scrape_a_tenth_of_the_window(air):
+    counts, oldest = daily_refreshes(air, 45)
+    assert counts[0] == 31
+    assert max(counts[1:]) <= 3
+    assert max(oldest) <= 21
+
+
+def test_nights_scraped_together_are_spread_over_their_max_age(air):
+    counts, oldest = daily_refreshes(air, 13, ((7, 1), (30, 3), (None, 7)))
+    assert max(counts[1:]) - min(counts[1:]) <= 1
+    assert max(oldest) <= 3
+
+
+def test_near_nights_go_stale_first(air):
+    now = datetime.datetime(2026, 3, 1, 6)
+    scan = [air.Date('2026-03-02'), air.Date('2026-03-20')]
+    scraped = {date_on.out(): (now - datetime.timedelta(days=10)).isoformat() for date_on in scan}
+    assert air.stale_dates(scan, scraped, now=now) == [scan[0]]
+    assert air.stale_dates(scan, {}, now=now) == scan
+
+
+def test_refresh_on_the_same_day_only_probes(air, market):
+    reference, store, reference_calls = market('Refresh', air.full_run)
+    refreshed, store, calls = market('Refresh', air.full_run, refresh=True)
+    assert calls == 4
+    assert store.conn.execute('SELECT count(*), count(finished) FROM runs').fetchone() == (2, 2)
+    assert sorted(refreshed.listings.ids) == sorted(reference.listings.ids)
+    assert int(refreshed.online.vacant.sum()) == int(reference.online.vacant.sum())
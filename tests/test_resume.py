@@ -0,0 +1,31 @@
+import pytest
+
+
+def test_resume_after_crash_matches_full_run(air, market):
+    reference, reference_store, reference_calls = market('Reference', air.full_run)
+    with pytest.raises(RuntimeError):
+        market('Crashed', air.full_run, crash_at=60)
+    resumed, store, calls = market('Crashed', air.resume_run)
+    assert calls < reference_calls
+    assert store.conn.execute('SELECT count(*), count(finished) FROM runs').fetchone() == (1, 1)
+    assert sorted(resumed.listings.ids) == sorted(reference.listings.ids)
+    assert int(resumed.online.vacant.sum()) == int(reference.online.vacant.sum())
+    assert store.baseline_frame('Crashed', 1, 6).equals(reference_store.baseline_frame('Reference', 1, 6))
+
+
+def test_unfinished_run_only_picks_the_latest_run(air, tmp_path):
+    store = air.DataStore(str(tmp_path / 'runs.sqlite'))
+    stale = store.start_run('M', '2099-01-01', 6)
+    assert store.unfinished_run('M') == (stale, '2099-01-01', 6)
+    store.finish_run(store.start_run('M', '2099-01-02', 6))
+    assert store.unfinished_run('M') is None
+
+
+def test_resume_starts_fresh_once_the_window_has_started(air, market, tmp_path):
+    with pytest.raises(RuntimeError):
+        market('Started', air.full_run, crash_at=60)
+    store = air.DataStore(str(tmp_path / 'Started Data.sqlite'))
+    with store.conn:
+        store.conn.execute("UPDATE runs SET scan_start = '2000-01-01'")
+    session, store, calls = market('Started', air.resume_run)
+    assert store.conn.execute('SELECT id, finished IS NOT NULL FROM runs ORDER BY id').fetchall() == [(1, 0), (2, 1)]
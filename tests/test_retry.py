@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from pages import card, page, quiet
+
+BLOCKED = b'<html><body>blocked</body></html>'
+GOOD = page([card(1, '<span>$100</span><span>2 beds</span>')], last_page=3)
+
+
+def policy(air, **kwargs):
+    settings = dict(base=0, cap=0, cooldown=0, metrics=air.Metrics())
+    settings.update(kwargs)
+    return air.RetryPolicy(**settings)
+
+
+def test_retry_attempts_and_budget(air):
+    retry = policy(air, attempts=3, budget=3)
+    assert retry.wait(1) and retry.wait(2)
+    assert not retry.wait(3)
+    assert retry.wait(1)
+    assert not retry.wait(1)
+    assert retry.metrics.counters[('air_retry_budget_exhausted_total', (('stage', 'fetch'),))] == 1
+
+
+def test_circuit_breaker_opens_and_gives_up(air):
+    retry = policy(air, threshold=2, trips=2)
+    retry.failure()
+    assert not retry.is_open()
+    retry.failure()
+    assert retry.is_open()
+    assert retry.wait(1) and retry.wait(1)
+    assert not retry.wait(1)
+    retry.success()
+    assert not retry.is_open() and retry.wait(1)
+
+
+def test_circuit_breaker_waits_out_the_cooldown(air):
+    retry = policy(air, threshold=1, cooldown=0.2)
+    retry.failure()
+    start = time.monotonic()
+    assert retry.wait(1)
+    assert time.monotonic() - start >= 0.15
+
+
+class Response:
+    def __init__(self, content):
+        self.content = content
+        self.status_code = 200
+
+
+#Probes through a cached Fetcher whose network serves responses in order
+@pytest.fixture
+def probe(air, tmp_path, monkeypatch):
+    def run(responses, offline=False, warm=None):
+        fetcher = air.Fetcher(rate=0, cache=air.ResponseCache(str(tmp_path / 'cache'), offline=offline))
+        if warm is not None:
+            fetcher.cache.put('https://example.com/s', warm)
+        served = list(responses)
+        fetcher.session.get = lambda url, timeout=None: Response(served.pop(0))
+        monkeypatch.setattr(air, 'fetcher', fetcher)
+        retry = policy(air)
+        pages, records = quiet(air.probe_page, 'https://example.com/s', retry=retry)
+        return pages, fetcher.metrics.counters, retry
+    return run
+
+
+def test_probe_retries_go_to_the_network(air, probe):
+    pages, counters, retry = probe([BLOCKED, GOOD], warm=BLOCKED)
+    assert pages == 3
+    assert counters[('air_cache_hits_total', ())] == 1
+    assert counters[('air_requests_total', (('status', 200),))] == 2
+
+
+def test_offline_misses_are_not_retried(air, probe):
+    pages, counters, retry = probe([], offline=True)
+    assert pages == 0 and retry.spent == 0
+    assert ('air_retries_total', (('stage', 'page_count'),)) not in retry.metrics.counters
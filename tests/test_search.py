@@ -0,0 +1,54 @@
+import re
+
+from pages import card, page, quiet
+
+
+def test_chop_tiles_the_area(air):
+    area = air.MapSearch('https://www.airbnb.com/s/homes?x=1', 10.0, 20.0, 12.0, 23.0)
+    boxes = quiet(area.chop, 3)
+    assert len(boxes) == 9
+    assert abs(sum((box.ne_lat - box.sw_lat) * (box.ne_lng - box.sw_lng) for box in boxes) - 6.0) < 1e-9
+    assert min(box.sw_lat for box in boxes) == 10.0 and max(box.ne_lat for box in boxes) == 12.0
+    assert min(box.sw_lng for box in boxes) == 20.0 and abs(max(box.ne_lng for box in boxes) - 23.0) < 1e-9
+    assert len(set((round(box.sw_lat, 9), round(box.sw_lng, 9)) for box in boxes)) == 9
+
+
+#Every search is a full 18 pages while its box is wider than 0.5 degrees of latitude, and a
+#single page of results below that, unless it lies in the south west quarter
+class DensityFetcher:
+    max_workers = 4
+
+    def __init__(self):
+        self.urls = []
+
+    def get(self, url, metrics=None, fresh=False):
+        self.urls.append(url)
+        value = dict((key, float(number)) for key, number in re.findall(r'(\w\w_l\w\w)=([-\d.]+)', url))
+        dense = value['ne_lat'] - value['sw_lat'] > 0.5 or (value['ne_lat'] <= 0.5 and value['ne_lng'] <= 0.5)
+        return page([card(1, '<span>$100</span>')], last_page=18 if dense else 1)
+
+    def can_refetch(self):
+        return True
+
+    def map(self, function, items):
+        return [function(item) for item in items]
+
+
+def test_adaptive_splits_only_the_dense_boxes(air, monkeypatch):
+    monkeypatch.setattr(air, 'fetcher', DensityFetcher())
+    area = air.MapSearch('https://www.airbnb.com/s/homes?x=1', 0.0, 0.0, 2.0, 2.0)
+    leaves = quiet(area.adaptive, max_depth=3)
+    sizes = sorted(round(leaf.ne_lat - leaf.sw_lat, 3) for leaf in leaves)
+    assert sizes == [0.25] * 4 + [0.5] * 15
+    assert abs(sum((leaf.ne_lat - leaf.sw_lat) * (leaf.ne_lng - leaf.sw_lng) for leaf in leaves) - 4.0) < 1e-9
+    assert all(leaf.first is not None for leaf in leaves)
+    #The south west corner hits max_depth while still full, so it stays a leaf at 18 pages
+    assert [leaf.pages for leaf in leaves].count(18) == 4
+    assert len(air.fetcher.urls) == 1 + 4 + 16 + 4
+
+
+def test_clean_reads_the_bounds_from_a_search_url(air):
+    box = air.MapSearch.clean('https://www.airbnb.com/s/homes?x=1',
+                              'https://www.airbnb.com/s/homes?tab_id=home_tab&ne_lat=40.9&ne_lng=-73.7'
+                              '&sw_lat=40.5&sw_lng=-74.2&zoom=10')
+    assert (box.sw_lat, box.sw_lng, box.ne_lat, box.ne_lng) == (40.5, -74.2, 40.9, -73.7)
@@ -0,0 +1,24 @@
+import pytest
+
+
+def test_markets_in_one_process_keep_their_own_state(air, market):
+    default_ids = list(air.default_session.listings.ids)
+    first, first_store, _ = market('First', air.full_run)
+    alone, _, _ = market('Alone', air.full_run)
+    second, _, _ = market('Second', air.full_run)
+    assert sorted(first.listings.ids) == sorted(alone.listings.ids)
+    assert len(first.listings.ids) > 0
+    assert int(first.online.vacant.sum()) == int(second.online.vacant.sum())
+    assert first.listings is not second.listings and first.metrics is not second.metrics
+    assert first.retry.metrics is first.metrics and second.retry.metrics is second.metrics
+    assert list(air.default_session.listings.ids) == default_ids
+    assert first_store.conn.execute('SELECT count(*) FROM runs').fetchone() == (1,)
+
+
+def test_session_rejects_unknown_options(air):
+    with pytest.raises(ValueError):
+        air.ScrapeSession('Bad', extract_mode='regex')
+    with pytest.raises(ValueError):
+        air.ScrapeSession('Bad', chart_backend='svg')
+    retry = air.RetryPolicy()
+    assert air.ScrapeSession('Own', retry=retry).retry is retry
@@ -0,0 +1,39 @@
+import json
+
+from pages import card, page, quiet
+
+
+def result(listing_id, amount, **listing):
+    listing.update(id=listing_id)
+    return {'listing': listing, 'pricing_quote': {'rate': {'amount': amount}}}
+
+
+#A page whose state blob lists listing 7 in two sections, with one result missing its price
+def state_page(cards=()):
+    state = {'niobeClientData': [{'sections': [
+        {'items': [result(7, 120, name='Beach House', room_type='Entire home', city='Boca Raton', beds=2,
+                          star_rating=4.8, reviews_count=31, lat=26.35, lng=-80.08),
+                   {'listing': {'id': 8}, 'pricing_quote': {'rate': None}}]},
+        {'items': [result(7, 120), result(9, 95, beds='two', star_rating=None)]}]}]}
+    script = '<script type="application/json" id="data-state"><!--' + json.dumps(state) + '--></script>'
+    return page(cards).replace(b'<body>', b'<body>' + script.encode())
+
+
+def test_parse_state_reads_the_embedded_results(air):
+    records = air.parse_state(state_page())
+    assert [record['id'] for record in records] == ['7', '9']
+    assert records[0] == {'id': '7', 'name': 'Beach House', 'typo': 'Entire home', 'city': 'Boca Raton',
+                          'price': 120, 'beds': 2, 'rating': 4.8, 'review_count': 31, 'lat': 26.35,
+                          'lng': -80.08, 'error': 0}
+    assert (records[1]['beds'], records[1]['rating'], records[1]['lat']) == ('--', '--', '--')
+    online = air.parse_state(state_page(), online=True)
+    assert online[0]['price'] == 120 and online[0]['listing']['name'] == 'Beach House'
+
+
+def test_json_mode_falls_back_to_the_cards(air):
+    cards = [card(3, '<span>$150</span>')]
+    assert [record['id'] for record in quiet(air.parse_page, state_page(cards), mode='json')] == ['7', '9']
+    assert [record['id'] for record in quiet(air.parse_page, state_page(cards))] == ['3']
+    assert [record['id'] for record in quiet(air.parse_page, page(cards), mode='json')] == ['3']
+    broken = page(cards).replace(b'<body>', b'<body><script type="application/json">{"niobe": </script>')
+    assert [record['id'] for record in quiet(air.parse_page, broken, mode='json')] == ['3']
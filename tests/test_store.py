@@ -0,0 +1,36 @@
+def listings(air, prices, vacant=()):
+    session = air.ScrapeSession('Store')
+    for ident, price in prices.items():
+        air.Listing(ident, 'Listing ' + ident, 'Entire home', 'Boca Raton', price, 2, 4.5, 10, session, 26.3, -80.1)
+    period = [air.Date('2026-03-01'), air.Date('2026-03-02')]
+    session.online.set_period(period)
+    for ident in vacant:
+        air.ListingOnline(ident, period[0], prices[ident], session)
+    return session
+
+
+def test_baseline_frame_keeps_each_run_as_it_was(air, tmp_path):
+    store = air.DataStore(str(tmp_path / 'store.sqlite'))
+    for prices, vacant in [({'1': 100, '2': 200}, ['1']), ({'1': 150, '3': 300}, ['3'])]:
+        session = listings(air, prices, vacant)
+        run_id = store.start_run('Store', '2026-03-01', 2)
+        store.save_session(session, run_id)
+        store.finish_run(run_id)
+    first = store.baseline_frame('Store', 1, 2)
+    second = store.baseline_frame('Store', 2, 2)
+    assert first['Price'].to_dict() == {'1': 100, '2': 200}
+    assert first['# of Vacant Days'].to_dict() == {'1': 1, '2': 0}
+    assert second['Price'].to_dict() == {'1': 150, '3': 300}
+    assert second['% Vacancy'].to_dict() == {'1': 0.0, '3': 50.0}
+    assert store.latest_run('Store', finished=True) == 2
+
+
+def test_saving_a_run_twice_changes_nothing(air, tmp_path):
+    store = air.DataStore(str(tmp_path / 'store.sqlite'))
+    session = listings(air, {'1': 100, '2': 200}, ['1', '2'])
+    run_id = store.start_run('Store', '2026-03-01', 2)
+    store.save_session(session, run_id)
+    store.save_session(session, run_id)
+    counts = [store.conn.execute('SELECT count(*) FROM ' + table).fetchone()[0]
+              for table in ['listings', 'run_listings', 'observations']]
+    assert counts == [2, 2, 2]
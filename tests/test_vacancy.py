@@ -0,0 +1,41 @@
+def test_store_grows_both_ways_and_keeps_its_marks(air):
+    store = air.VacancyStore(capacity=2, days=2)
+    day = air.Date('2026-03-10')
+    store.mark('a', 1, day, 100)
+    store.mark('b', 2, day.add_days(40), 200)
+    store.mark('c', 1, day.add_days(-5), '--')
+    for i in range(10):
+        store.mark(str(i), 2, day, 50 + i)
+    assert len(store) == 13
+    assert store.vacant_dates('a') == {'2026-03-10': 100}
+    assert store.vacant_dates('b') == {'2026-04-19': 200}
+    assert store.vacant_dates('c') == {'2026-03-05': None}
+    assert store.vacant_dates('x') == {}
+    assert store.day_labels()[:1] == ['2026-03-05'] and store.n_days == 46
+
+
+def test_counts_and_prices_by_bed_and_day(air):
+    store = air.VacancyStore()
+    period = [air.Date('2026-03-01').add_days(i) for i in range(3)]
+    store.set_period(period)
+    store.mark('a', 1, period[0], 100)
+    store.mark('a', 1, period[2], 120)
+    store.mark('b', 1, period[0], '--')
+    store.mark('c', 2, period[1], 300)
+    assert store.vacant_counts(period).tolist() == [2, 1, 1]
+    assert dict((bed, counts.tolist()) for bed, counts in store.counts_by_bed(period).items()) == \
+        {1: [2, 0, 1], 2: [0, 1, 0]}
+    assert store.count_by_bed_by_date(1, period[0]) == 2
+    assert store.list_by_bed_by_date(1, period[0]) == [100]
+    assert store.count_by_bed_by_date(1, air.Date('2027-01-01')) == 0
+
+
+def test_listing_online_marks_the_session_store(air):
+    session = air.ScrapeSession('Vacancy')
+    air.Listing('1', 'A', 'Entire home', 'Boca Raton', 100, 2, 4.5, 10, session)
+    day = air.Date('2026-03-01')
+    online = air.ListingOnline('1', day, 90, session)
+    air.ListingOnline.vacant_date('1', day.add_days(1), 95, session)
+    assert online.vacant_dates == {'2026-03-01': 90, '2026-03-02': 95}
+    assert air.ListingOnline.count_by_bed_by_date(2, day, session) == 1
+    assert air.ListingOnline.search_by_id('1', session) is online